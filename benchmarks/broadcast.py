@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# MegaBots broadcast benchmark, measures the cost of one broadcast against the recipient count
+# Usage: python benchmarks/broadcast.py [send latency in ms of the slow websites]
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+RECIPIENT_COUNTS = [ 1, 4, 16, 64, 256, 1024 ]
+ROUNDS = 200
+SLOW_LATENCY = len(sys.argv) >= 2 and float(sys.argv[1]) or 1
+
+# Fake websocket which only counts the send bytes, a slow websocket waits before every send
+class FakeWebsocket:
+    def __init__(self, latency = 0):
+        self.latency = latency
+        self.bytes = 0
+
+    async def send(self, message):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency / 1000)
+        self.bytes += len(message)
+
+# The old broadcast: encode the message for every recipient and send one after another
+async def serialBroadcastMessage(type, data = {}):
+    for item in server.connections.values():
+        await item["websocket"].send(json.dumps({ "type": type, "data": data }, separators=(",", ":")))
+
+# A typical robot tick done message with some map updates
+messageData = {
+    "robot_id": 1,
+    "robot": { "x": 4, "y": 4 },
+    "map": [
+        { "x": 3, "y": 4, "type": 1 },
+        { "x": 5, "y": 4, "type": 2 },
+        { "x": 4, "y": 3, "type": 1 },
+        { "x": 4, "y": 5, "type": 1 }
+    ]
+}
+
+# Wait until all the outbound queues are send
+async def drainOutboxes():
+    while any(len(item["outbox"].messages) > 0 for item in server.connections.values()):
+        await asyncio.sleep(0)
+
+# Returns how long the broadcaster is blocked and how long it takes until every recipient has the messages
+async def measure(broadcast, rounds):
+    startTime = time.perf_counter()
+    for i in range(rounds):
+        result = broadcast("robot_tick_done", messageData)
+        if asyncio.iscoroutine(result):
+            await result
+    blockedTime = time.perf_counter() - startTime
+    await drainOutboxes()
+    totalTime = time.perf_counter() - startTime
+    return blockedTime / rounds * 1000, totalTime / rounds * 1000
+
+def createConnection(latency):
+    websocket = FakeWebsocket(latency)
+    return websocket, server.Outbox(websocket)
+
+async def benchmark():
+    for robotId in range(1, 5):
+        robot = server.createRobot(robotId)
+        robot["websocket"], robot["outbox"] = createConnection(0)
+        server.connections[robot["websocket"]] = robot
+
+    print("Broadcast of robot_tick_done to the 4 robots and N websites (ms per broadcast)")
+    print("The broadcaster is blocked / all recipients have the message, slow websites wait %g ms per send" % SLOW_LATENCY)
+    print("%10s %18s %18s %18s %18s" % ("websites", "serial", "queued", "serial+slow", "queued+slow"))
+    for recipientCount in RECIPIENT_COUNTS:
+        results = []
+        for slow in [ False, True ]:
+            for i in range(recipientCount):
+                websocket, outbox = createConnection(slow and SLOW_LATENCY or 0)
+                outbox.size = server.WEBSITE_OUTBOX_SIZE
+                server.websites[i] = { "type": "website", "id": i, "websocket": websocket, "outbox": outbox }
+                server.connections[websocket] = server.websites[i]
+
+            # Less rounds for the slow websites because every round waits at least the latency
+            rounds = slow and 5 or ROUNDS
+            for broadcast in [ serialBroadcastMessage, server.broadcastMessage ]:
+                results.append("%8.3f /%8.3f" % await measure(broadcast, rounds))
+
+            for website in server.websites.values():
+                website["outbox"].close()
+                del server.connections[website["websocket"]]
+            server.websites.clear()
+        print("%10d %18s %18s %18s %18s" % (recipientCount, results[0], results[1], results[2], results[3]))
+
+asyncio.run(benchmark())
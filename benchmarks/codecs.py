@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# MegaBots codecs benchmark, measures the encode and decode time and size of the messages for the codecs
+# Usage: python benchmarks/codecs.py [map size]
+
+import json
+import random
+import sys
+import time
+
+# Optional codecs, they are skipped when they are not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Constants
+MAP_SIZE = len(sys.argv) >= 2 and int(sys.argv[1]) or 64
+ROUNDS = 2000
+
+TILE_UNKOWN = 0
+TILE_FLOOR = 1
+TILE_CHEST = 2
+
+codecs = [ ("json", lambda message: json.dumps(message, separators=(",", ":")), json.loads) ]
+if orjson != None:
+    codecs.append(("orjson", lambda message: orjson.dumps(message).decode(), orjson.loads))
+if msgpack != None:
+    codecs.append(("msgpack", msgpack.packb, msgpack.unpackb))
+
+# A world info message with a half discovered map, a typical robot tick done and read sensors done message
+messages = [
+    ("world_info", {
+        "type": "world_info",
+        "data": {
+            "tick": { "type": 0, "speed": 200, "phase": 1, "overrun": 0 },
+            "active_program_id": 2,
+            "programs": [
+                { "id": 1, "name": "Nothing" },
+                { "id": 2, "name": "Discover" },
+                { "id": 3, "name": "Random directions" }
+            ],
+            "map": {
+                "id": 1621529804034,
+                "version": MAP_SIZE * MAP_SIZE // 2,
+                "width": MAP_SIZE,
+                "height": MAP_SIZE,
+                "data": [ [ random.choice([ TILE_UNKOWN, TILE_UNKOWN, TILE_FLOOR, TILE_CHEST ]) for x in range(MAP_SIZE) ] for y in range(MAP_SIZE) ]
+            }
+        }
+    }),
+    ("robot_tick_done", {
+        "type": "robot_tick_done",
+        "data": {
+            "robot_id": 1,
+            "robot": { "x": 4, "y": 4 },
+            "map": [
+                { "x": 3, "y": 4, "type": 1 },
+                { "x": 5, "y": 4, "type": 2 },
+                { "x": 4, "y": 3, "type": 1 },
+                { "x": 4, "y": 5, "type": 1 }
+            ],
+            "map_version": 120
+        }
+    }),
+    ("read_sensors_done", {
+        "type": "read_sensors_done",
+        "data": {
+            "robot_id": 1,
+            "robot": { "x": 4, "y": 4 },
+            "sensors": { "up": False, "left": True, "right": False, "down": False }
+        }
+    })
+]
+
+# Returns the size and the encode and decode time in us of a message
+def measure(encode, decode, message):
+    rounds = message["type"] == "world_info" and ROUNDS // 100 or ROUNDS
+    startTime = time.perf_counter()
+    for i in range(rounds):
+        encodedMessage = encode(message)
+    encodeTime = (time.perf_counter() - startTime) / rounds * 1000000
+
+    startTime = time.perf_counter()
+    for i in range(rounds):
+        decode(encodedMessage)
+    decodeTime = (time.perf_counter() - startTime) / rounds * 1000000
+    return len(encodedMessage), encodeTime, decodeTime
+
+print("Message size, encode and decode time for the codecs, world info has a %dx%d map" % (MAP_SIZE, MAP_SIZE))
+print("%20s %10s %10s %14s %14s" % ("message", "codec", "size", "encode us", "decode us"))
+for name, message in messages:
+    for codecName, encode, decode in codecs:
+        print("%20s %10s %8d B %14.2f %14.2f" % ((name, codecName) + measure(encode, decode, message)))
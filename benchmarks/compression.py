@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# MegaBots compression benchmark, measures the bytes on the wire and the compression time per tick by connection type
+# for some compression settings of the server
+# Usage: python benchmarks/compression.py [map size]
+
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+MAP_SIZE = len(sys.argv) >= 2 and int(sys.argv[1]) or 64
+ROBOT_COUNT = 4
+TICKS = 100
+
+WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+
+TICK_MANUAL = 0
+TICK_PHASE_CONCURRENT = 1
+
+TILE_FLOOR = 1
+TILE_CHEST = 2
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The compression settings that are compared, the default settings are the settings of the server
+SETTINGS = [
+    ("off", { type: { "threshold": None, "level": 1 } for type in server.COMPRESSION_SETTINGS }),
+    ("all", { type: { "threshold": 0, "level": 6 } for type in server.COMPRESSION_SETTINGS }),
+    ("default", server.COMPRESSION_SETTINGS)
+]
+
+def encodeMessage(type, data = {}):
+    return json.dumps({
+        "type": type,
+        "data": data
+    }, separators=(",", ":"))
+
+# Write a map with some random chests
+def writeMap(mapFile):
+    mapData = [[TILE_FLOOR] * MAP_SIZE for i in range(MAP_SIZE)]
+    for y in range(1, MAP_SIZE - 1):
+        for x in range(1, MAP_SIZE - 1):
+            if random.random() < 0.2:
+                mapData[y][x] = TILE_CHEST
+    mapFile.write(json.dumps({
+        "type": "MegaBots Map",
+        "width": MAP_SIZE,
+        "height": MAP_SIZE,
+        "data": mapData
+    }, separators=(",", ":")))
+    mapFile.flush()
+
+# A lightweight robot which moves in a random direction every tick and sends its discovered tiles
+async def robotConnection(robotId, connected):
+    async with websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None) as websocket:
+        robot = { "x": None, "y": None }
+        tickMessage = encodeMessage("robot_tick", { "robot_id": robotId })
+        await websocket.send(encodeMessage("robot_connect", { "robot_id": robotId }))
+        async for data in websocket:
+            if data.startswith('{"type":"world_info"'):
+                connected.set_result(True)
+
+            if data == tickMessage:
+                if robot["x"] == None:
+                    await websocket.send(encodeMessage("read_sensors", { "robot_id": robotId }))
+                    continue
+                x, y = random.choice([ (robot["x"], robot["y"] - 1), (robot["x"] - 1, robot["y"]), (robot["x"] + 1, robot["y"]), (robot["x"], robot["y"] + 1) ])
+                x, y = min(max(x, 0), MAP_SIZE - 1), min(max(y, 0), MAP_SIZE - 1)
+                await websocket.send(encodeMessage("read_sensors", { "robot_id": robotId, "robot": { "x": x, "y": y } }))
+
+            if data.startswith('{"type":"read_sensors_done"'):
+                message = json.loads(data)
+                robot["x"] = message["data"]["robot"]["x"]
+                robot["y"] = message["data"]["robot"]["y"]
+                sensors = message["data"]["sensors"]
+                mapUpdates = [
+                    { "x": robot["x"], "y": robot["y"] - 1, "type": sensors["up"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"] - 1, "y": robot["y"], "type": sensors["left"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"] + 1, "y": robot["y"], "type": sensors["right"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"], "y": robot["y"] + 1, "type": sensors["down"] and TILE_CHEST or TILE_FLOOR }
+                ]
+                await websocket.send(encodeMessage("robot_tick_done", {
+                    "robot_id": robotId,
+                    "robot": { "x": robot["x"], "y": robot["y"] },
+                    "map": [ mapUpdate for mapUpdate in mapUpdates if 0 <= mapUpdate["x"] < MAP_SIZE and 0 <= mapUpdate["y"] < MAP_SIZE ]
+                }))
+
+# The website gives manual ticks and waits until every robot is done
+async def websiteConnection(connectStats):
+    async with websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None) as websocket:
+        await websocket.send(encodeMessage("website_connect", { "website_id": round(time.time() * 1000) }))
+        await websocket.send(encodeMessage("update_world_info", {
+            "tick": { "type": TICK_MANUAL, "phase": TICK_PHASE_CONCURRENT },
+            "active_program_id": 1
+        }))
+        while not (await websocket.recv()).startswith('{"type":"world_info"'):
+            pass
+
+        # Only the ticks are measured, the connect messages are measured separately
+        await asyncio.sleep(0.2)
+        connectStats.update(json.loads(json.dumps(server.compressionStats)))
+        for i in range(TICKS):
+            await websocket.send(encodeMessage("world_tick"))
+            doneCount = 0
+            while doneCount < ROBOT_COUNT:
+                data = await websocket.recv()
+                if data.startswith('{"type":"robot_tick_done"'):
+                    doneCount += 1
+
+async def benchmark(mapPath):
+    serverTask = asyncio.ensure_future(server.websocketsServer())
+    await asyncio.sleep(0.5)
+    supervisor = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT_PATH, "webots", "supervisor.py"), mapPath)
+    await asyncio.sleep(0.5)
+
+    robotTasks = []
+    for robotId in range(1, ROBOT_COUNT + 1):
+        connected = asyncio.get_running_loop().create_future()
+        robotTasks.append(asyncio.ensure_future(robotConnection(robotId, connected)))
+        await connected
+
+    connectStats = {}
+    await websiteConnection(connectStats)
+    for robotTask in robotTasks:
+        robotTask.cancel()
+    await asyncio.gather(*robotTasks, return_exceptions=True)
+    supervisor.terminate()
+    await supervisor.wait()
+    serverTask.cancel()
+    await asyncio.gather(serverTask, return_exceptions=True)
+    return connectStats
+
+print("Bytes on the wire and compression time by connection type of %d robots and 1 website on a %dx%d map" % (ROBOT_COUNT, MAP_SIZE, MAP_SIZE))
+print("Connect has the world info and connect messages, tick is the average of %d concurrent manual ticks" % TICKS)
+print("%10s %12s %28s %28s" % ("settings", "connection", "connect bytes / wire / ms", "tick bytes / wire / ms"))
+with tempfile.NamedTemporaryFile("w", suffix=".json") as mapFile:
+    writeMap(mapFile)
+    for name, settings in SETTINGS:
+        # A fresh server for every settings
+        importlib.reload(server)
+        server.COMPRESSION_SETTINGS = settings
+        connectStats = asyncio.run(benchmark(mapFile.name))
+        for type, stats in server.compressionStats.items():
+            connect = connectStats[type]
+            print("%10s %12s %28s %28s" % (name, type,
+                "%8d / %8d / %6.2f" % (connect["bytes"], connect["wire_bytes"], connect["time"] * 1000),
+                "%8d / %8d / %6.3f" % ((stats["bytes"] - connect["bytes"]) / TICKS, (stats["wire_bytes"] - connect["wire_bytes"]) / TICKS, (stats["time"] - connect["time"]) * 1000 / TICKS)))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# MegaBots discover benchmark, measures the ticks until a generated maze is fully discovered and the discover program time per tick
+# for the discover assignments, the robots are simulated like the reference client: one step every tick over the shortest path,
+# but a robot which waits for another robot gives up its direction after some ticks so idle robots can't block it forever
+# Usage: python benchmarks/discover.py [map size...]
+
+import asyncio
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+MAP_SIZES = len(sys.argv) >= 2 and [ int(mapSize) for mapSize in sys.argv[1:] ] or [ 16, 32, 64 ]
+ROBOT_COUNT = 4
+MAX_TICKS = 20000
+WAIT_TICKS = 5
+ROUNDS = 3
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Fake websocket which drops all messages
+class FakeWebsocket:
+    def __init__(self):
+        self.protocol = types.SimpleNamespace(extensions=[])
+
+    async def send(self, message):
+        pass
+
+# Generate a random maze map with the map generator
+def generateMap(mapSize):
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "webots"))
+        subprocess.run([ sys.executable, os.path.join(ROOT_PATH, "map-generator.py"), str(mapSize), str(mapSize) ], cwd=directory, check=True)
+        with open(os.path.join(directory, "webots", "map.json"), "r") as mapFile:
+            return json.loads(mapFile.read())["data"]
+
+# The first step of the shortest path over the known floor and unkown tiles which avoids the other robots
+def findStep(robot, destination, robotTiles):
+    cameFrom = { (robot["x"], robot["y"]): None }
+    frontier = collections.deque([ (robot["x"], robot["y"]) ])
+    while len(frontier) > 0:
+        x, y = frontier.popleft()
+        if (x, y) == destination:
+            while cameFrom[(x, y)] != (robot["x"], robot["y"]):
+                x, y = cameFrom[(x, y)]
+            return x, y
+
+        for neighborX, neighborY in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+            if neighborX < 0 or neighborY < 0 or neighborX >= server.mapWidth or neighborY >= server.mapHeight:
+                continue
+            if server.mapGrid.get(neighborX, neighborY) == server.TILE_CHEST or (neighborX, neighborY) in robotTiles or (neighborX, neighborY) in cameFrom:
+                continue
+            cameFrom[(neighborX, neighborY)] = (x, y)
+            frontier.append((neighborX, neighborY))
+    return None
+
+# Discover the tiles around a robot like the sensors of the robot
+def readSensors(robot, mazeData):
+    for x, y in ((robot["x"], robot["y"]), (robot["x"] - 1, robot["y"]), (robot["x"], robot["y"] - 1), (robot["x"] + 1, robot["y"]), (robot["x"], robot["y"] + 1)):
+        if 0 <= x < server.mapWidth and 0 <= y < server.mapHeight and server.mapGrid.get(x, y) == server.TILE_UNKOWN:
+            server.setMapTile(x, y, mazeData[y][x])
+
+# The tiles the robots can discover, that are the floor tiles that can be reached from the border and their neighbors
+def discoverableTiles(mazeData):
+    mapSize = len(mazeData)
+    reached = { (x, y) for x in range(mapSize) for y in (0, mapSize - 1) } | { (x, y) for x in (0, mapSize - 1) for y in range(mapSize) }
+    frontier = collections.deque(reached)
+    tiles = set(reached)
+    while len(frontier) > 0:
+        x, y = frontier.popleft()
+        for neighborX, neighborY in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+            if 0 <= neighborX < mapSize and 0 <= neighborY < mapSize:
+                tiles.add((neighborX, neighborY))
+                if mazeData[neighborY][neighborX] != server.TILE_CHEST and (neighborX, neighborY) not in reached:
+                    reached.add((neighborX, neighborY))
+                    frontier.append((neighborX, neighborY))
+    return tiles
+
+# Returns the ticks until all discoverable tiles of the maze are discovered and the discover program time per tick in ms
+async def simulate(mazeData, assignment):
+    mapSize = len(mazeData)
+    server.DISCOVER_ASSIGNMENT = assignment
+    await server.supervisorConnectHandler(FakeWebsocket(), { "supervisor_id": 1, "map": { "width": mapSize, "height": mapSize } })
+    for robotId in range(1, ROBOT_COUNT + 1):
+        await server.robotConnectHandler(FakeWebsocket(), { "robot_id": robotId })
+    for robot in server.robots.values():
+        readSensors(robot, mazeData)
+
+    unkownTiles = { (x, y) for x, y in discoverableTiles(mazeData) if server.mapGrid.get(x, y) == server.TILE_UNKOWN }
+    ticks = 0
+    programTime = 0
+    while len(unkownTiles) > 0 and ticks < MAX_TICKS:
+        startTime = time.perf_counter()
+        await server.discoverProgram()
+        programTime += time.perf_counter() - startTime
+
+        for robot in server.robots.values():
+            if len(robot["directions"]) == 0:
+                continue
+
+            # The robot cancels its direction when it is there or when the direction is impossible
+            destination = (robot["directions"][0]["x"], robot["directions"][0]["y"])
+            step = None
+            if (robot["x"], robot["y"]) != destination:
+                robotTiles = { (otherRobot["x"], otherRobot["y"]) for otherRobot in server.robots.values() if otherRobot != robot }
+                step = findStep(robot, destination, robotTiles)
+                if step == None and findStep(robot, destination, set()) != None:
+                    robot["waitTicks"] = robot.get("waitTicks", 0) + 1
+                    if robot["waitTicks"] >= WAIT_TICKS:
+                        robot["waitTicks"] = 0
+                        robot["directions"].pop(0)
+                    continue
+            if step != None:
+                robot["x"], robot["y"] = step
+                readSensors(robot, mazeData)
+                unkownTiles = { (x, y) for x, y in unkownTiles if server.mapGrid.get(x, y) == server.TILE_UNKOWN }
+            if step == None or step == destination:
+                robot["directions"].pop(0)
+        ticks += 1
+    return ticks, programTime / ticks * 1000
+
+# Remove all connections and the map so every simulation starts with a new server
+def resetServer():
+    for item in list(server.connections.values()):
+        item["outbox"].close()
+    server.connections.clear()
+    server.robots.clear()
+    server.supervisors.clear()
+    server.mapGrid = None
+
+async def benchmark():
+    print("Ticks until a generated maze is fully discovered by %d robots and the discover program time per tick" % ROBOT_COUNT)
+    print("Average of %d mazes, greedy gives every robot the closest tile in robot order" % ROUNDS)
+    print("%10s %24s %24s" % ("map", "greedy ticks / ms", "matching ticks / ms"))
+    for mapSize in MAP_SIZES:
+        results = { server.DISCOVER_GREEDY: [ 0, 0 ], server.DISCOVER_MATCHING: [ 0, 0 ] }
+        for i in range(ROUNDS):
+            mazeData = generateMap(mapSize)
+            for assignment in results:
+                random.seed(i)
+                ticks, programTime = await simulate(mazeData, assignment)
+                results[assignment][0] += ticks / ROUNDS
+                results[assignment][1] += programTime / ROUNDS
+                resetServer()
+        print("%10s %24s %24s" % ("%dx%d" % (mapSize, mapSize),
+            "%8d / %8.3f" % tuple(results[server.DISCOVER_GREEDY]), "%8d / %8.3f" % tuple(results[server.DISCOVER_MATCHING])))
+
+asyncio.run(benchmark())
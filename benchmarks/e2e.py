@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# MegaBots end to end benchmark, starts the server, the supervisor stand-in and the robot clients as processes on a generated
+# maze and measures the ticks per second, the tick latency, the messages per second that the website gets and the CPU time and
+# memory of the server; the results are appended as one JSON line with the commit to the results file, so the results of commits
+# can be compared
+# Usage: python benchmarks/e2e.py [robot count] [map size] [tick mode] [clients] [ticks] [results path]
+#        tick mode: manual-serial, manual-concurrent, auto-serial or auto-concurrent
+#        clients: reference (the reference client for every robot), team (the four team clients and reference clients
+#        for the other robots) or headless (the robot controllers of the headless engine in one process)
+
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import websockets
+
+# Constants
+ROBOT_COUNT = len(sys.argv) >= 2 and int(sys.argv[1]) or 4
+MAP_SIZE = len(sys.argv) >= 3 and int(sys.argv[2]) or 24
+TICK_MODE = len(sys.argv) >= 4 and sys.argv[3] or "manual-concurrent"
+CLIENTS = len(sys.argv) >= 5 and sys.argv[4] or "reference"
+TICKS = len(sys.argv) >= 6 and int(sys.argv[5]) or 200
+RESULTS_PATH = len(sys.argv) >= 7 and sys.argv[6] or "e2e-results.jsonl"
+
+# The tick speed in ms of the auto tick modes and the time limits in seconds
+AUTO_TICK_SPEED = 10
+CONNECT_TIMEOUT = 10
+BENCHMARK_TIMEOUT = 120
+
+WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+
+TICK_MANUAL = 0
+TICK_AUTO = 1
+
+TICK_PHASE_SERIAL = 0
+TICK_PHASE_CONCURRENT = 1
+
+TICK_MODES = {
+    "manual-serial": (TICK_MANUAL, TICK_PHASE_SERIAL),
+    "manual-concurrent": (TICK_MANUAL, TICK_PHASE_CONCURRENT),
+    "auto-serial": (TICK_AUTO, TICK_PHASE_SERIAL),
+    "auto-concurrent": (TICK_AUTO, TICK_PHASE_CONCURRENT)
+}
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The team clients by robot id, the other robots are reference clients
+TEAM_CLIENTS = {
+    1: [ os.path.join(ROOT_PATH, "clients", "bastiaan", "client.py"), "1" ],
+    2: [ os.path.join(ROOT_PATH, "clients", "eki", "client.py") ],
+    3: [ os.path.join(ROOT_PATH, "clients", "maarten", "client.py") ],
+    4: [ os.path.join(ROOT_PATH, "clients", "rowdey", "client.py") ]
+}
+
+def encodeMessage(type, data = {}):
+    return json.dumps({
+        "type": type,
+        "data": data
+    }, separators=(",", ":"))
+
+# The command lines of the robot client processes
+def clientCommands():
+    robotIds = range(1, ROBOT_COUNT + 1)
+    if CLIENTS == "headless":
+        return [ [ sys.executable, os.path.join(ROOT_PATH, "server", "headless.py"), "websockets" ] + [ str(robotId) for robotId in robotIds ] ]
+    if CLIENTS == "team":
+        return [ [ sys.executable ] + TEAM_CLIENTS.get(robotId, [ TEAM_CLIENTS[1][0], str(robotId) ]) for robotId in robotIds ]
+    return [ [ sys.executable, TEAM_CLIENTS[1][0], str(robotId) ] for robotId in robotIds ]
+
+# The CPU time in seconds and the resident memory in bytes of a process, None when there is no proc file system
+def processUsage(pid):
+    try:
+        with open("/proc/%d/stat" % pid, "r") as statFile:
+            fields = statFile.read().rsplit(")", 1)[1].split()
+        with open("/proc/%d/statm" % pid, "r") as statmFile:
+            residentPages = int(statmFile.read().split()[1])
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK"), residentPages * os.sysconf("SC_PAGE_SIZE")
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+# The website starts the ticks and measures them, a tick starts with the world tick message or the first robot tick
+# and ends when every robot is done, all the messages the website gets are counted
+async def websiteConnection(serverPid):
+    tickType, tickPhase = TICK_MODES[TICK_MODE]
+    async with websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None) as websocket:
+        await websocket.send(encodeMessage("website_connect", { "website_id": round(time.time() * 1000) }))
+        await websocket.send(encodeMessage("update_world_info", { "tick": { "type": TICK_MANUAL, "phase": tickPhase } }))
+
+        # Wait until all the robots are connected
+        robotIds = set()
+        startTime = time.perf_counter()
+        while len(robotIds) < ROBOT_COUNT:
+            if time.perf_counter() - startTime > CONNECT_TIMEOUT:
+                raise TimeoutError("Only %d of the %d robots are connected" % (len(robotIds), ROBOT_COUNT))
+            try:
+                message = json.loads(await asyncio.wait_for(websocket.recv(), 1))
+            except asyncio.TimeoutError:
+                continue
+            if message["type"] == "robot_connect":
+                robotIds.add(message["data"]["robot_id"])
+
+        latencies = []
+        messages = 0
+        tickStartTime = None
+        doneRobotIds = set()
+        startUsage = processUsage(serverPid)
+        startTime = time.perf_counter()
+        if tickType == TICK_AUTO:
+            await websocket.send(encodeMessage("update_world_info", { "tick": { "type": TICK_AUTO, "speed": AUTO_TICK_SPEED } }))
+        else:
+            tickStartTime = time.perf_counter()
+            await websocket.send(encodeMessage("world_tick"))
+
+        while len(latencies) < TICKS and time.perf_counter() - startTime < BENCHMARK_TIMEOUT:
+            data = await websocket.recv()
+            messages += 1
+            if not (data.startswith('{"type":"robot_tick"') or data.startswith('{"type":"robot_tick_done"')):
+                continue
+
+            message = json.loads(data)
+            if message["type"] == "robot_tick" and tickStartTime == None:
+                tickStartTime = time.perf_counter()
+            if message["type"] == "robot_tick_done":
+                doneRobotIds.add(message["data"]["robot_id"])
+                if len(doneRobotIds) == ROBOT_COUNT:
+                    latencies.append(time.perf_counter() - tickStartTime)
+                    doneRobotIds = set()
+                    tickStartTime = None
+                    if tickType == TICK_MANUAL and len(latencies) < TICKS:
+                        tickStartTime = time.perf_counter()
+                        await websocket.send(encodeMessage("world_tick"))
+
+        elapsedTime = time.perf_counter() - startTime
+        endUsage = processUsage(serverPid)
+        if tickType == TICK_AUTO:
+            await websocket.send(encodeMessage("update_world_info", { "tick": { "type": TICK_MANUAL } }))
+
+    results = {
+        "ticks": len(latencies),
+        "ticks_per_second": len(latencies) / elapsedTime,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "website_messages_per_second": messages / elapsedTime,
+        "server_cpu_ms_per_tick": None,
+        "server_cpu_percent": None,
+        "server_rss_bytes": None
+    }
+    if startUsage != None and endUsage != None:
+        results["server_cpu_ms_per_tick"] = (endUsage[0] - startUsage[0]) / len(latencies) * 1000
+        results["server_cpu_percent"] = (endUsage[0] - startUsage[0]) / elapsedTime * 100
+        results["server_rss_bytes"] = endUsage[1]
+    return results
+
+def benchmark():
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "webots"))
+        subprocess.run([ sys.executable, os.path.join(ROOT_PATH, "map-generator.py"), str(MAP_SIZE), str(MAP_SIZE) ], cwd=directory, check=True)
+
+        server = subprocess.Popen([ sys.executable, os.path.join(ROOT_PATH, "server", "server.py") ], cwd=os.path.join(ROOT_PATH, "server"))
+        time.sleep(1)
+        supervisor = subprocess.Popen([ sys.executable, os.path.join(ROOT_PATH, "webots", "supervisor.py"), os.path.join(directory, "webots", "map.json") ])
+        time.sleep(0.5)
+        clients = [ subprocess.Popen(command, stdout=subprocess.DEVNULL) for command in clientCommands() ]
+        try:
+            results = asyncio.run(websiteConnection(server.pid))
+        finally:
+            for process in clients + [ supervisor ]:
+                process.terminate()
+                process.wait()
+            server.terminate()
+            serverUsage = os.wait4(server.pid, 0)[2]
+
+    # The peak memory of the server is only known when it is stopped, the max RSS is in kilobytes on Linux
+    results["server_max_rss_bytes"] = serverUsage.ru_maxrss * (sys.platform == "darwin" and 1 or 1024)
+    return results
+
+commit = subprocess.run([ "git", "rev-parse", "--short", "HEAD" ], cwd=ROOT_PATH, capture_output=True, text=True).stdout.strip() or None
+results = benchmark()
+
+print("%d %s robots on a %dx%d maze with %s ticks at commit %s" % (ROBOT_COUNT, CLIENTS, MAP_SIZE, MAP_SIZE, TICK_MODE, commit))
+print("%10s %14s %14s %14s %18s %14s %14s" % ("ticks/s", "p50 tick ms", "p99 tick ms", "website msg/s", "server ms/tick", "server CPU %", "server RSS MB"))
+print("%10.1f %14.2f %14.2f %14.0f %18s %14s %14s" % (results["ticks_per_second"], results["latency_p50_ms"], results["latency_p99_ms"], results["website_messages_per_second"],
+    results["server_cpu_ms_per_tick"] != None and "%.2f" % results["server_cpu_ms_per_tick"] or "-",
+    results["server_cpu_percent"] != None and "%.1f" % results["server_cpu_percent"] or "-",
+    results["server_rss_bytes"] != None and "%.1f" % (results["server_rss_bytes"] / 1e6) or "-"))
+
+with open(RESULTS_PATH, "a") as resultsFile:
+    resultsFile.write(json.dumps({
+        "commit": commit,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "parameters": { "robots": ROBOT_COUNT, "map_size": MAP_SIZE, "tick_mode": TICK_MODE, "clients": CLIENTS, "ticks": TICKS },
+        "results": results
+    }) + "\n")
+print("Results are appended to " + RESULTS_PATH)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# MegaBots fleet benchmark, measures the ticks per second of the server against the robot count, the robots and the website
+# ask for batches so every tick sends every robot one batch with the moves of the other robots
+# Usage: python benchmarks/fleet.py [robot count...]
+
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import websockets
+
+# Constants
+ROBOT_COUNTS = len(sys.argv) >= 2 and [ int(robotCount) for robotCount in sys.argv[1:] ] or [ 4, 64, 256, 1024 ]
+BENCHMARK_TIME = 5
+MAX_TICKS = 200
+
+WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+
+TICK_MANUAL = 0
+TICK_PHASE_CONCURRENT = 1
+
+TILE_FLOOR = 1
+TILE_CHEST = 2
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def encodeMessage(type, data = {}):
+    return json.dumps({
+        "type": type,
+        "data": data
+    }, separators=(",", ":"))
+
+# Write a map with some random chests which border is big enough for all the robots
+def writeMap(mapFile, robotCount):
+    mapSize = max(16, robotCount // 4 + 2)
+    mapData = [[TILE_FLOOR] * mapSize for i in range(mapSize)]
+    for y in range(1, mapSize - 1):
+        for x in range(1, mapSize - 1):
+            if random.random() < 0.2:
+                mapData[y][x] = TILE_CHEST
+    mapFile.write(json.dumps({
+        "type": "MegaBots Map",
+        "width": mapSize,
+        "height": mapSize,
+        "data": mapData
+    }, separators=(",", ":")))
+    mapFile.flush()
+    return mapSize
+
+# A lightweight robot which moves in a random direction every tick, it only parses the messages that are for itself;
+# the robots run next to the server so they don't ask for compression, every robot would compress the same batch
+async def robotConnection(robotId, mapSize, connected):
+    async with websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None, compression=None) as websocket:
+        robot = { "id": robotId, "x": None, "y": None }
+        tickPrefix = encodeMessage("robot_tick", { "robot_id": robotId })
+        await websocket.send(encodeMessage("robot_connect", { "robot_id": robotId, "batch": True }))
+        async for data in websocket:
+            if data.startswith('{"type":"world_info"'):
+                connected.set_result(True)
+
+            if data == tickPrefix:
+                # The first tick only reads the sensors
+                if robot["x"] == None:
+                    await websocket.send(encodeMessage("read_sensors", { "robot_id": robotId }))
+                    continue
+                x, y = random.choice([ (robot["x"], robot["y"] - 1), (robot["x"] - 1, robot["y"]), (robot["x"] + 1, robot["y"]), (robot["x"], robot["y"] + 1) ])
+                x, y = min(max(x, 0), mapSize - 1), min(max(y, 0), mapSize - 1)
+                await websocket.send(encodeMessage("read_sensors", { "robot_id": robotId, "robot": { "x": x, "y": y } }))
+
+            if data.startswith('{"type":"read_sensors_done"'):
+                message = json.loads(data)
+                robot["x"] = message["data"]["robot"]["x"]
+                robot["y"] = message["data"]["robot"]["y"]
+                sensors = message["data"]["sensors"]
+                mapUpdates = [
+                    { "x": robot["x"], "y": robot["y"] - 1, "type": sensors["up"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"] - 1, "y": robot["y"], "type": sensors["left"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"] + 1, "y": robot["y"], "type": sensors["right"] and TILE_CHEST or TILE_FLOOR },
+                    { "x": robot["x"], "y": robot["y"] + 1, "type": sensors["down"] and TILE_CHEST or TILE_FLOOR }
+                ]
+                await websocket.send(encodeMessage("robot_tick_done", {
+                    "robot_id": robotId,
+                    "robot": { "x": robot["x"], "y": robot["y"] },
+                    "map": [ mapUpdate for mapUpdate in mapUpdates if 0 <= mapUpdate["x"] < mapSize and 0 <= mapUpdate["y"] < mapSize ]
+                }))
+
+# The CPU time in seconds of a process, None when there is no proc file system
+def processTime(pid):
+    try:
+        with open("/proc/%d/stat" % pid, "r") as statFile:
+            fields = statFile.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+# The website gives manual ticks and waits until every robot is done, it gets the messages of a tick in one batch
+# so its outbox doesn't overflow with the messages of a big fleet
+async def websiteConnection(robotCount, serverPid):
+    async with websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None) as websocket:
+        await websocket.send(encodeMessage("website_connect", { "website_id": round(time.time() * 1000), "batch": True }))
+        await websocket.send(encodeMessage("update_world_info", {
+            "tick": { "type": TICK_MANUAL, "phase": TICK_PHASE_CONCURRENT },
+            "active_program_id": 1
+        }))
+
+        ticks = 0
+        startTime = time.perf_counter()
+        startServerTime = processTime(serverPid)
+        while time.perf_counter() - startTime < BENCHMARK_TIME and ticks < MAX_TICKS:
+            await websocket.send(encodeMessage("world_tick"))
+            doneCount = 0
+            while doneCount < robotCount:
+                data = await websocket.recv()
+                if data.startswith('{"type":"robot_tick_done"'):
+                    doneCount += 1
+                if data.startswith('{"type":"batch"'):
+                    doneCount += sum(1 for message in json.loads(data)["data"]["messages"] if message["type"] == "robot_tick_done")
+            ticks += 1
+        elapsedTime = time.perf_counter() - startTime
+        endServerTime = processTime(serverPid)
+        serverTime = startServerTime != None and endServerTime != None and (endServerTime - startServerTime) / ticks or None
+        return ticks / elapsedTime, serverTime
+
+async def benchmark(robotCount, mapSize, serverPid):
+    robotTasks = []
+    for robotId in range(1, robotCount + 1):
+        connected = asyncio.get_running_loop().create_future()
+        robotTasks.append(asyncio.ensure_future(robotConnection(robotId, mapSize, connected)))
+        await connected
+
+    result = await websiteConnection(robotCount, serverPid)
+    for robotTask in robotTasks:
+        robotTask.cancel()
+    await asyncio.gather(*robotTasks, return_exceptions=True)
+    return result
+
+print("Concurrent manual ticks of N robots, every robot moves and reads its sensors every tick")
+print("The robots run in this process, the server CPU time is measured separately during the ticks")
+print("%10s %10s %10s %18s" % ("robots", "map", "ticks/s", "server ms/tick"))
+for robotCount in ROBOT_COUNTS:
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as mapFile:
+        mapSize = writeMap(mapFile, robotCount)
+        server = subprocess.Popen([ sys.executable, os.path.join(ROOT_PATH, "server", "server.py") ], cwd=os.path.join(ROOT_PATH, "server"))
+        time.sleep(1)
+        supervisor = subprocess.Popen([ sys.executable, os.path.join(ROOT_PATH, "webots", "supervisor.py"), mapFile.name ])
+        time.sleep(0.5)
+        try:
+            ticksPerSecond, serverTime = asyncio.run(benchmark(robotCount, mapSize, server.pid))
+        finally:
+            supervisor.terminate()
+            supervisor.wait()
+            server.terminate()
+            server.wait()
+        print("%10d %10s %10.2f %18s" % (robotCount, "%dx%d" % (mapSize, mapSize), ticksPerSecond, serverTime != None and "%.1f" % (serverTime * 1000) or "-"))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# MegaBots grid benchmark, measures the map operations of the server on the bytearray grid against a list of lists of tiles
+# Usage: python benchmarks/grid.py [map size...]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+MAP_SIZES = len(sys.argv) >= 2 and [ int(mapSize) for mapSize in sys.argv[1:] ] or [ 64, 512, 4096 ]
+LOOKUPS = 100000
+
+# A random map with floor, unkown and chest tiles
+def randomTiles(mapSize):
+    table = bytes(i % 3 for i in range(256))
+    return os.urandom(mapSize * mapSize).translate(table)
+
+# The list of lists versions of the grid operations
+def listCreate(mapSize):
+    mapData = [[server.TILE_UNKOWN] * mapSize for i in range(mapSize)]
+    for x in range(mapSize):
+        mapData[0][x] = server.TILE_FLOOR
+        mapData[mapSize - 1][x] = server.TILE_FLOOR
+    for y in range(mapSize):
+        mapData[y][0] = server.TILE_FLOOR
+        mapData[y][mapSize - 1] = server.TILE_FLOOR
+    return mapData
+
+def listSurrounded(mapData, x, y):
+    mapSize = len(mapData)
+    return (
+        (x > 0 and mapData[y][x - 1] == server.TILE_CHEST) and
+        (y > 0 and mapData[y - 1][x] == server.TILE_CHEST) and
+        (x < mapSize - 1 and mapData[y][x + 1] == server.TILE_CHEST) and
+        (y < mapSize - 1 and mapData[y + 1][x] == server.TILE_CHEST)
+    )
+
+def listSurroundedCount(mapData):
+    return sum(1 for y in range(len(mapData)) for x in range(len(mapData)) if listSurrounded(mapData, x, y))
+
+def listUnkownTiles(mapData):
+    return { (x, y) for y in range(len(mapData)) for x in range(len(mapData)) if mapData[y][x] == server.TILE_UNKOWN and not listSurrounded(mapData, x, y) }
+
+def listLookups(mapData, points):
+    return sum(1 for x, y in points if mapData[y][x] == server.TILE_CHEST)
+
+def listSnapshot(mapData):
+    return b"".join(bytes(row) for row in mapData)
+
+# The grid versions of the same operations
+def gridCreate(mapSize):
+    grid = server.Grid(mapSize, mapSize)
+    grid.fillBorder(server.TILE_FLOOR)
+    return grid
+
+def gridSurroundedCount(grid):
+    return grid.surroundedMask().count(1)
+
+def gridUnkownTiles(grid):
+    surrounded = grid.surroundedMask()
+    return { (index % grid.width, index // grid.width) for index in server.Grid.maskIndexes(grid.mask(server.TILE_UNKOWN)) if surrounded[index] == 0 }
+
+def gridLookups(grid, points):
+    tiles = grid.tiles
+    return sum(1 for x, y in points if tiles[y * grid.width + x] == server.TILE_CHEST)
+
+def gridSnapshot(grid):
+    return bytes(grid.tiles)
+
+# Returns the time of a function in ms and its result
+def measure(function, *arguments):
+    startTime = time.perf_counter()
+    result = function(*arguments)
+    return (time.perf_counter() - startTime) * 1000, result
+
+print("Map operations on a list of lists and on the bytearray grid in ms, the map has random floor, unkown and chest tiles")
+print("Surrounded counts the tiles with chests on all four sides, unkown index finds the unkown tiles that are not surrounded")
+print("and lookups are %d random chest checks" % LOOKUPS)
+print("%10s %10s %14s %14s %14s %14s %14s" % ("map", "storage", "create", "surrounded", "unkown index", "lookups", "snapshot"))
+for mapSize in MAP_SIZES:
+    tiles = randomTiles(mapSize)
+    grid = server.Grid(mapSize, mapSize)
+    grid.tiles[:] = tiles
+    mapData = grid.rows()
+    points = [ (random.randrange(mapSize), random.randrange(mapSize)) for i in range(LOOKUPS) ]
+
+    listResults = [ measure(listCreate, mapSize), measure(listSurroundedCount, mapData), measure(listUnkownTiles, mapData), measure(listLookups, mapData, points), measure(listSnapshot, mapData) ]
+    gridResults = [ measure(gridCreate, mapSize), measure(gridSurroundedCount, grid), measure(gridUnkownTiles, grid), measure(gridLookups, grid, points), measure(gridSnapshot, grid) ]
+    assert listResults[0][1] == gridResults[0][1].rows()
+    for listResult, gridResult in zip(listResults[1:], gridResults[1:]):
+        assert listResult[1] == gridResult[1]
+
+    for name, results in [ ("list", listResults), ("grid", gridResults) ]:
+        print("%10s %10s %14.2f %14.2f %14.2f %14.2f %14.2f" % (("%dx%d" % (mapSize, mapSize), name) + tuple(result[0] for result in results)))
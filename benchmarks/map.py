@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# MegaBots map benchmark, measures the size and encode time of the world info map for the map encodings
+# Usage: python benchmarks/map.py [map size...]
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+MAP_SIZES = len(sys.argv) >= 2 and [ int(mapSize) for mapSize in sys.argv[1:] ] or [ 64, 256, 1024 ]
+ROUNDS = 5
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Generate a random maze map with the map generator
+def generateMap(mapSize):
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "webots"))
+        subprocess.run([ sys.executable, os.path.join(ROOT_PATH, "map-generator.py"), str(mapSize), str(mapSize) ], cwd=directory, check=True)
+        with open(os.path.join(directory, "webots", "map.json"), "r") as mapFile:
+            return json.loads(mapFile.read())["data"]
+
+# Returns the size of the world info frames and the encode time in ms
+def measure(mapEncodings):
+    startTime = time.perf_counter()
+    for i in range(ROUNDS):
+        server.mapSnapshots.clear()
+        frames = server.encodeFrames("world_info", server.worldInfoData(), mapEncodings)
+    encodeTime = (time.perf_counter() - startTime) / ROUNDS * 1000
+    return sum(len(frame) for frame in frames), encodeTime
+
+print("World info message size and encode time for the map encodings, smallest sends the smallest of packed and rle")
+print("%10s %8s %20s %20s %20s %20s" % ("map", "tiles", "json", "packed", "rle", "smallest"))
+for mapSize in MAP_SIZES:
+    server.mapWidth = mapSize
+    server.mapHeight = mapSize
+
+    # A new map is unkown except the border and a discovered map is a complete maze
+    unkownMapData = [[server.TILE_UNKOWN] * mapSize for i in range(mapSize)]
+    for i in range(mapSize):
+        unkownMapData[0][i] = unkownMapData[mapSize - 1][i] = server.TILE_FLOOR
+        unkownMapData[i][0] = unkownMapData[i][mapSize - 1] = server.TILE_FLOOR
+
+    for name, mapData in [ ("unkown", unkownMapData), ("maze", generateMap(mapSize)) ]:
+        server.mapGrid = server.Grid.fromRows(mapData)
+        results = []
+        for mapEncodings in [ (), (server.MAP_ENCODING_PACKED,), (server.MAP_ENCODING_RLE,), tuple(server.MAP_COMPACT_ENCODINGS) ]:
+            results.append("%9d B %6.1f ms" % measure(mapEncodings))
+        print("%10s %8s %20s %20s %20s %20s" % ("%dx%d" % (mapSize, mapSize), name, results[0], results[1], results[2], results[3]))
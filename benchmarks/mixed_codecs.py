@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# MegaBots mixed codecs check, runs the server in this process with peers that negotiate different codecs in one room:
+# a JSON only robot, a MessagePack robot, a MessagePack supervisor and a JSON website; every peer must only get
+# frames of its own codec and every tick must be done for both robots in the serial and the concurrent tick phase
+# Usage: python benchmarks/mixed_codecs.py [ticks]
+
+import asyncio
+import json
+import os
+import sys
+import time
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+TICKS = len(sys.argv) >= 2 and int(sys.argv[1]) or 50
+MAP_SIZE = 8
+TIMEOUT = 30
+
+WEBSOCKETS_PORT = 8090
+WEBSOCKETS_URL = "ws://127.0.0.1:%d/" % WEBSOCKETS_PORT
+
+# A peer of the check, it sends its messages in the codec that it negotiated and counts the frames it gets by frame type
+class Peer:
+    def __init__(self, name, codec):
+        self.name = name
+        self.codec = codec
+        self.frames = { "text": 0, "binary": 0 }
+        self.websocket = None
+
+    async def connect(self, type, data):
+        self.websocket = await websockets.connect(WEBSOCKETS_URL, max_size=None)
+        if self.codec == server.MESSAGE_CODEC_MSGPACK:
+            data = dict(data, codecs=[ server.MESSAGE_CODEC_MSGPACK, server.MESSAGE_CODEC_JSON ])
+        await self.websocket.send(json.dumps({ "type": type, "data": data }))
+
+    async def sendMessage(self, type, data = {}):
+        await self.websocket.send(server.encodeMessage(type, data, self.codec))
+
+    async def receiveMessage(self):
+        data = await self.websocket.recv()
+        self.frames[isinstance(data, bytes) and "binary" or "text"] += 1
+        return server.decodeMessage(data)
+
+# The robots answer their robot tick with a read sensors message and their read sensors done with a tick done
+async def robotPeer(peer, robotId):
+    await peer.connect("robot_connect", { "robot_id": robotId })
+    while True:
+        message = await peer.receiveMessage()
+        if message["type"] == "robot_tick" and message["data"]["robot_id"] == robotId:
+            await peer.sendMessage("read_sensors", { "robot_id": robotId })
+        if message["type"] == "read_sensors_done":
+            await peer.sendMessage("robot_tick_done", { "robot_id": robotId })
+
+async def supervisorPeer(peer):
+    await peer.connect("supervisor_connect", { "supervisor_id": round(time.time() * 1000), "map": { "width": MAP_SIZE, "height": MAP_SIZE } })
+    while True:
+        message = await peer.receiveMessage()
+        if message["type"] == "read_sensors":
+            await peer.sendMessage("read_sensors_done", {
+                "robot_id": message["data"]["robot_id"],
+                "sensors": { "up": False, "left": False, "right": False, "down": False }
+            })
+
+# The website runs the manual ticks of a tick phase and returns when both robots are done with every tick
+async def websitePeer(peer, tickPhase):
+    await peer.sendMessage("update_world_info", { "tick": { "type": server.TICK_MANUAL, "phase": tickPhase } })
+    for tick in range(TICKS):
+        await peer.sendMessage("world_tick")
+        doneRobotIds = set()
+        while len(doneRobotIds) < 2:
+            message = await peer.receiveMessage()
+            if message["type"] == "robot_tick_done":
+                doneRobotIds.add(message["data"]["robot_id"])
+
+async def check():
+    async with websockets.serve(server.websocketConnection, "127.0.0.1", WEBSOCKETS_PORT, max_size=None):
+        supervisor = Peer("MessagePack supervisor", server.MESSAGE_CODEC_MSGPACK)
+        jsonRobot = Peer("JSON robot", server.MESSAGE_CODEC_JSON)
+        msgpackRobot = Peer("MessagePack robot", server.MESSAGE_CODEC_MSGPACK)
+        website = Peer("JSON website", server.MESSAGE_CODEC_JSON)
+        tasks = [ asyncio.ensure_future(supervisorPeer(supervisor)) ]
+        await asyncio.sleep(0.2)
+        tasks += [ asyncio.ensure_future(robotPeer(jsonRobot, 1)), asyncio.ensure_future(robotPeer(msgpackRobot, 2)) ]
+        await website.connect("website_connect", { "website_id": round(time.time() * 1000) })
+        await asyncio.sleep(0.2)
+
+        for tickPhase, name in [ (server.TICK_PHASE_SERIAL, "serial"), (server.TICK_PHASE_CONCURRENT, "concurrent") ]:
+            startTime = time.perf_counter()
+            await asyncio.wait_for(websitePeer(website, tickPhase), TIMEOUT)
+            print("%d %s ticks with mixed codecs in %.2f s" % (TICKS, name, time.perf_counter() - startTime))
+
+        for task in tasks:
+            task.cancel()
+        for peer in [ supervisor, jsonRobot, msgpackRobot, website ]:
+            print("%24s %6d text frames %6d binary frames" % (peer.name, peer.frames["text"], peer.frames["binary"]))
+            if peer.codec == server.MESSAGE_CODEC_MSGPACK:
+                assert peer.frames["text"] == 0 and peer.frames["binary"] > 0, peer.name + " got JSON frames"
+            else:
+                assert peer.frames["binary"] == 0 and peer.frames["text"] > 0, peer.name + " got MessagePack frames"
+            await peer.websocket.close()
+    print("All peers only got frames of their own codec")
+
+if server.msgpack == None:
+    sys.exit("MessagePack is not installed, the mixed codecs can't be checked")
+asyncio.run(check())
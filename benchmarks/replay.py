@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# MegaBots replay benchmark, replays a recording of the server made with the record path setting at a speed factor,
+# the server mode connects all recorded connections to a running server and sends their recorded inbound messages,
+# the dashboard mode listens like the server and replays the recorded outbound messages of the first website
+# to every dashboard that connects; a speed of 1 is real time, 100 is a hundred times faster and 0 is as fast as possible
+# Usage: python benchmarks/replay.py <recording> [server|dashboard] [speed]
+
+import asyncio
+import os
+import sys
+import time
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import server
+
+# Constants
+RECORDING_PATH = sys.argv[1]
+MODE = len(sys.argv) >= 3 and sys.argv[2] or "server"
+SPEED = float(sys.argv[3]) if len(sys.argv) >= 4 else 1
+
+WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+WEBSOCKETS_PORT = 8080
+
+# Wait until the time of a record at the replay speed, returns how late the record is in seconds
+async def waitForRecord(startTime, recordTime):
+    if SPEED == 0:
+        return 0
+    delay = recordTime / SPEED - (time.perf_counter() - startTime)
+    if delay > 0:
+        await asyncio.sleep(delay)
+        return 0
+    return -delay
+
+# Receive and count all the messages of a replayed connection so the server never waits for it
+async def drainConnection(websocket, stats):
+    try:
+        async for data in websocket:
+            stats["received"] += 1
+            stats["received_bytes"] += len(data)
+    except websockets.ConnectionClosed:
+        pass
+
+# Replay the recorded inbound messages of all connections against a running server
+async def replayServer():
+    connections = {}
+    drainTasks = []
+    closeTasks = []
+    stats = { "connections": 0, "sent": 0, "sent_bytes": 0, "received": 0, "received_bytes": 0, "lag": 0 }
+    recordTime = 0
+    startTime = time.perf_counter()
+    for recordTime, kind, connectionId, payload in server.readRecords(RECORDING_PATH):
+        if kind == server.RECORD_SEND or kind == server.RECORD_BROADCAST:
+            continue
+        stats["lag"] = max(stats["lag"], await waitForRecord(startTime, recordTime))
+
+        if kind == server.RECORD_OPEN:
+            websocket = await websockets.connect(WEBSOCKETS_URL, max_size=None, ping_interval=None)
+            connections[connectionId] = websocket
+            drainTasks.append(asyncio.ensure_future(drainConnection(websocket, stats)))
+            stats["connections"] += 1
+
+        if kind == server.RECORD_RECEIVE and connectionId in connections:
+            await connections[connectionId].send(payload)
+            stats["sent"] += 1
+            stats["sent_bytes"] += len(payload)
+
+        # The recorded messages don't wait for the answers of the server, so a handler of the server can still wait
+        # on a tick that is never done and the closing handshake is not awaited
+        if kind == server.RECORD_CLOSE and connectionId in connections:
+            closeTasks.append(asyncio.ensure_future(connections.pop(connectionId).close()))
+
+    replayTime = time.perf_counter() - startTime
+    for websocket in connections.values():
+        closeTasks.append(asyncio.ensure_future(websocket.close()))
+    await asyncio.gather(*closeTasks, *drainTasks)
+
+    print("Replayed %d connections with %d messages (%d bytes) of a %.2f s recording in %.2f s, %.1fx real time" % (
+        stats["connections"], stats["sent"], stats["sent_bytes"], recordTime, replayTime, recordTime / max(replayTime, 1e-9)))
+    print("%.0f messages/s send, %d messages (%d bytes) received, max lag behind the recording %.2f ms" % (
+        stats["sent"] / max(replayTime, 1e-9), stats["received"], stats["received_bytes"], stats["lag"] * 1000))
+
+# Replay the recorded outbound messages of the first website of the recording to a connected dashboard
+async def replayDashboard(websocket, path = None):
+    websiteId = None
+    sent = 0
+    recordTime = 0
+    startTime = time.perf_counter()
+    drainTask = asyncio.ensure_future(drainConnection(websocket, { "received": 0, "received_bytes": 0 }))
+    try:
+        for recordTime, kind, connectionId, payload in server.readRecords(RECORDING_PATH):
+            # The first website connection of the recording is the dashboard, the messages before its world info are skipped
+            if kind == server.RECORD_RECEIVE and websiteId == None and server.decodeMessage(payload)["type"] == "website_connect":
+                websiteId = connectionId
+            if not ((kind == server.RECORD_SEND and connectionId == websiteId) or (kind == server.RECORD_BROADCAST and websiteId != None)):
+                continue
+
+            await waitForRecord(startTime, recordTime)
+            await websocket.send(payload)
+            sent += 1
+    except websockets.ConnectionClosed:
+        pass
+    print("Replayed %d messages of a %.2f s recording to a dashboard in %.2f s" % (sent, recordTime, time.perf_counter() - startTime))
+
+    # The dashboard keeps showing the end of the recording until it disconnects
+    await drainTask
+
+async def replay():
+    if MODE == "dashboard":
+        print("Waiting for dashboards at ws://127.0.0.1:%d/" % WEBSOCKETS_PORT)
+        async with websockets.serve(replayDashboard, "127.0.0.1", WEBSOCKETS_PORT, max_size=None):
+            await asyncio.Future()
+    else:
+        await replayServer()
+
+asyncio.run(replay())
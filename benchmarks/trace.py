@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# MegaBots trace analysis, merges the span files that the server, the robot clients and the supervisor write to the trace
+# folder when the server traces the ticks and splits every robot tick into its hops: the planning and the map update
+# of the robot, the sensor lookup of the supervisor, the message handlers and the outbox queues of the server and the
+# rest which is the network and the waiting in the event loops; the slowest robot ticks are shown span by span
+# and all spans can be exported in the Chrome trace event format for chrome://tracing or Perfetto
+# Usage: python benchmarks/trace.py <trace folder> [chrome trace path]
+
+import json
+import os
+import sys
+
+# Constants
+TRACE_PATH = sys.argv[1]
+CHROME_TRACE_PATH = len(sys.argv) >= 3 and sys.argv[2] or None
+
+SLOWEST_TRACES = 5
+
+HOPS = [ "robot plan", "supervisor lookup", "robot map update", "server handlers", "server queues", "network and waiting" ]
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+# All the spans of the span files in the trace folder
+def readSpans():
+    spans = []
+    for fileName in sorted(os.listdir(TRACE_PATH)):
+        if fileName.endswith(".jsonl"):
+            with open(os.path.join(TRACE_PATH, fileName), "r") as spanFile:
+                for line in spanFile:
+                    # The last line of a killed process can be cut off
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass
+    return spans
+
+# The time of every hop of a robot tick in seconds, the queue spans of the messages for the websites
+# and for the other robots are not part of the robot tick
+def traceHops(tickSpan, spans):
+    hops = dict.fromkeys(HOPS, 0)
+    for span in spans:
+        if span["name"] == "plan":
+            hops["robot plan"] += span["duration"]
+        if span["name"] == "map update":
+            hops["robot map update"] += span["duration"]
+        if span["name"] == "sensor lookup":
+            hops["supervisor lookup"] += span["duration"]
+        if span["name"].startswith("handle "):
+            hops["server handlers"] += span["duration"]
+        if span["name"].startswith("queue ") and (span["to"] == "robot " + str(tickSpan["robot_id"]) or span["to"].startswith("supervisor ")):
+            hops["server queues"] += span["duration"]
+    hops["network and waiting"] = max(tickSpan["duration"] - sum(hops.values()), 0)
+    return hops
+
+# Write all spans as complete events of the Chrome trace event format, every process gets its own row
+def writeChromeTrace(spans):
+    processIds = {}
+    events = []
+    for span in sorted(spans, key=lambda span: span["start"]):
+        if span["process"] not in processIds:
+            processIds[span["process"]] = len(processIds) + 1
+            events.append({ "name": "process_name", "ph": "M", "pid": processIds[span["process"]], "tid": 0, "args": { "name": span["process"] } })
+        events.append({
+            "name": span["name"],
+            "ph": "X",
+            "ts": span["start"] * 1e6,
+            "dur": span["duration"] * 1e6,
+            "pid": processIds[span["process"]],
+            "tid": 0,
+            "args": { key: value for key, value in span.items() if key not in ("name", "process", "start", "duration") }
+        })
+    with open(CHROME_TRACE_PATH, "w") as chromeTraceFile:
+        json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, chromeTraceFile)
+
+spans = readSpans()
+traces = {}
+for span in spans:
+    traces.setdefault(span["trace_id"], []).append(span)
+
+# Only the robot ticks that are done have a robot tick span of the server
+tickSpans = [ span for span in spans if span["name"] == "robot tick" ]
+if len(tickSpans) == 0:
+    sys.exit("No traced robot ticks in " + TRACE_PATH + ", set the trace path of the server to trace the ticks")
+hopsByTrace = { tickSpan["trace_id"]: traceHops(tickSpan, traces[tickSpan["trace_id"]]) for tickSpan in tickSpans }
+
+processes = sorted({ span["process"] for span in spans })
+print("%d traced robot ticks with %d spans from %s" % (len(tickSpans), len(spans), ", ".join(processes)))
+durations = [ tickSpan["duration"] for tickSpan in tickSpans ]
+print("%22s %12s %12s %12s %12s" % ("hop", "p50 ms", "p99 ms", "max ms", "share %"))
+print("%22s %12.3f %12.3f %12.3f %12.1f" % ("robot tick", percentile(durations, 0.5) * 1000, percentile(durations, 0.99) * 1000, max(durations) * 1000, 100))
+for hop in HOPS:
+    hopDurations = [ hops[hop] for hops in hopsByTrace.values() ]
+    print("%22s %12.3f %12.3f %12.3f %12.1f" % (hop, percentile(hopDurations, 0.5) * 1000, percentile(hopDurations, 0.99) * 1000,
+        max(hopDurations) * 1000, sum(hopDurations) / max(sum(durations), 1e-9) * 100))
+
+print()
+print("The %d slowest robot ticks:" % min(SLOWEST_TRACES, len(tickSpans)))
+for tickSpan in sorted(tickSpans, key=lambda span: span["duration"], reverse=True)[:SLOWEST_TRACES]:
+    print("Trace %s of Robot %d took %.3f ms" % (tickSpan["trace_id"], tickSpan["robot_id"], tickSpan["duration"] * 1000))
+    for span in sorted(traces[tickSpan["trace_id"]], key=lambda span: span["start"]):
+        print("    %+10.3f ms %10.3f ms  %-12s %s%s" % ((span["start"] - tickSpan["start"]) * 1000, span["duration"] * 1000, span["process"], span["name"],
+            "to" in span and " to " + span["to"] or ""))
+
+if CHROME_TRACE_PATH != None:
+    writeChromeTrace(spans)
+    print()
+    print("Chrome trace is written to " + CHROME_TRACE_PATH)
@@ -5,26 +5,94 @@
 
 import asyncio
 import json
+import os
 import random
+import struct
 import sys
+import time
 import websockets
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import tracing
+
+# Optional MessagePack codec
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Constants
 DEBUG = False
 
 ROBOT_ID = len(sys.argv) >= 2 and int(sys.argv[1]) or 1
+ROOM = len(sys.argv) >= 3 and sys.argv[2] or "default"
 
 WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+# The permessage-deflate compression, None sends and receives all messages uncompressed
+WEBSOCKETS_COMPRESSION = "deflate"
+RECONNECT_DELAY = 1
+
+# The trace folder for the spans of the ticks that the server traces
+TRACE_PATH = "traces"
 
 TILE_UNKOWN = 0
 TILE_FLOOR = 1
 TILE_CHEST = 2
 
-# Map data is unkown until world info message from server
+MAP_ENCODING_JSON = 0
+MAP_ENCODING_PACKED = 1
+MAP_ENCODING_RLE = 2
+
+MAP_FRAME_SNAPSHOT = 1
+MAP_FRAME_UPDATES = 2
+
+MESSAGE_CODEC_JSON = 0
+MESSAGE_CODEC_MSGPACK = 1
+
+# Map data is unkown until world info message from server, the tiles are stored in a flat buffer
 mapWidth = None
 mapHeight = None
 mapData = None
 
+# The map id and version of the map data, so only the map changes are send when reconnecting
+mapId = None
+mapVersion = None
+
+# The spans of the traced ticks
+traceWriter = tracing.TraceWriter(TRACE_PATH, "robot " + str(ROBOT_ID), "robot-" + str(ROBOT_ID))
+
+# Tables to get the tile at every position of a packed byte
+unpackTables = [ bytes((byte >> (i * 2)) & 3 for byte in range(256)) for i in range(4) ]
+
+# Decode a binary map frame directly into the map data buffer
+def decodeMapFrame(frame):
+    global mapWidth, mapHeight, mapData
+
+    if frame[0] == MAP_FRAME_SNAPSHOT:
+        mapEncoding, mapWidth, mapHeight = struct.unpack_from("<BII", frame, 1)
+        mapData = bytearray(mapWidth * mapHeight)
+        if mapEncoding == MAP_ENCODING_PACKED:
+            for i in range(4):
+                tileCount = len(range(i, len(mapData), 4))
+                mapData[i::4] = frame[10:10 + tileCount].translate(unpackTables[i])
+        if mapEncoding == MAP_ENCODING_RLE:
+            index = 0
+            value = 0
+            shift = 0
+            for byte in memoryview(frame)[10:]:
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    mapData[index:index + (value >> 2)] = bytes([ value & 3 ]) * (value >> 2)
+                    index += value >> 2
+                    value = 0
+                    shift = 0
+
+    if frame[0] == MAP_FRAME_UPDATES:
+        for mapUpdate in struct.unpack_from("<%dI" % struct.unpack_from("<I", frame, 1)[0], frame, 5):
+            if mapData[mapUpdate >> 2] == TILE_UNKOWN:
+                mapData[mapUpdate >> 2] = mapUpdate & 3
+
 # Get all the neigbors of a point
 def getTileNeighbors(point):
     neighbors = []
@@ -42,7 +110,14 @@ def getTileNeighbors(point):
 # https://www.redblobgames.com/pathfinding/a-star/introduction.html
 def findPath(begin, end, withOtherRobots):
     frontier = [ { "x": begin["x"], "y": begin["y"] } ]
-    cameFrom =  [[None] * mapWidth for i in range(mapHeight)]
+    cameFrom = [None] * (mapWidth * mapHeight)
+
+    # Collect the tiles of the other robots once
+    robotTiles = set()
+    if withOtherRobots:
+        for robot in robots.values():
+            if robot["connected"]:
+                robotTiles.add((robot["x"], robot["y"]))
 
     # Traverse complete map to search for end point
     while len(frontier) > 0:
@@ -57,24 +132,18 @@ def findPath(begin, end, withOtherRobots):
         random.shuffle(neighbors)
         for neighbor in neighbors:
             # Ignore other robot tiles
-            if withOtherRobots:
-                colliding = False
-                for robot in robots:
-                    if robot["connected"] and robot["x"] == neighbor["x"] and robot["y"] == neighbor["y"]:
-                        colliding = True
-                        break
-                if colliding:
-                    continue
+            if (neighbor["x"], neighbor["y"]) in robotTiles:
+                continue
 
             # Ignore chest tiles
-            tileType = mapData[neighbor["y"]][neighbor["x"]]
+            tileType = mapData[neighbor["y"] * mapWidth + neighbor["x"]]
             if not (tileType == TILE_FLOOR or tileType == TILE_UNKOWN):
                 continue
 
             # Add tile to came from point map
-            if cameFrom[neighbor["y"]][neighbor["x"]] == None:
+            if cameFrom[neighbor["y"] * mapWidth + neighbor["x"]] == None:
                 frontier.append(neighbor)
-                cameFrom[neighbor["y"]][neighbor["x"]] = current
+                cameFrom[neighbor["y"] * mapWidth + neighbor["x"]] = current
 
     # Reverse from end to find the shortest path to begin
     current = end
@@ -89,17 +158,17 @@ def findPath(begin, end, withOtherRobots):
             break
 
         path.append(current)
-        current = cameFrom[current["y"]][current["x"]]
+        current = cameFrom[current["y"] * mapWidth + current["x"]]
     path.reverse()
     return path
 
-# Robots
-robots = [
-    { "id": 1, "x": None, "y": None, "directions": [], "connected": False },
-    { "id": 2, "x": None, "y": None, "directions": [], "connected": False },
-    { "id": 3, "x": None, "y": None, "directions": [], "connected": False },
-    { "id": 4, "x": None, "y": None, "directions": [], "connected": False }
-]
+# Robots by id, other robots are added when they are connected
+robots = {}
+
+def getRobot(robotId):
+    if robotId not in robots:
+        robots[robotId] = { "id": robotId, "x": None, "y": None, "directions": [], "connected": False }
+    return robots[robotId]
 
 # Simple log function
 def log(line):
@@ -108,47 +177,79 @@ def log(line):
 
 # Websocket server connection
 async def websocketConnection():
-    global mapWidth, mapHeight, mapData
+    global mapWidth, mapHeight, mapData, mapId, mapVersion
 
-    robot = next((robot for robot in robots if robot["id"] == ROBOT_ID), None)
+    robot = getRobot(ROBOT_ID)
     tickCounter = 0
+    trace = { "id": None, "name": None, "start": None }
 
     log("Connecting with the websockets server at " + WEBSOCKETS_URL + "...")
-    async with websockets.connect(WEBSOCKETS_URL) as websocket:
+    async with websockets.connect(WEBSOCKETS_URL, compression=WEBSOCKETS_COMPRESSION) as websocket:
+        # The messages are send in the codec the server uses, which is known after the first message
+        messageCodec = MESSAGE_CODEC_JSON
         async def sendMessage(type, data = {}):
-            await websocket.send(json.dumps({
-                "type": type,
-                "data": data
-            }, separators=(",", ":")))
-
-        # Send robot connect message
-        await sendMessage("robot_connect", { "robot_id": robot["id"] })
+            # The messages of a traced tick carry its trace id, the read sensors and tick done messages end a span
+            if trace["id"] != None and (type == "read_sensors" or type == "robot_tick_done" or type == "cancel_direction"):
+                data = dict(data, trace_id=trace["id"])
+                if type != "cancel_direction":
+                    traceWriter.span(trace["id"], trace["name"], trace["start"])
+                if type == "robot_tick_done":
+                    trace["id"] = None
+
+            message = { "type": type, "data": data }
+            if messageCodec == MESSAGE_CODEC_MSGPACK:
+                await websocket.send(msgpack.packb(message))
+            else:
+                await websocket.send(json.dumps(message, separators=(",", ":")))
+
+        # Send robot connect message with the map encodings and codecs we can decode and the map version we already have
+        connectData = {
+            "robot_id": robot["id"],
+            "room": ROOM,
+            "map_encodings": [ MAP_ENCODING_RLE, MAP_ENCODING_PACKED ],
+            "codecs": [ MESSAGE_CODEC_MSGPACK, MESSAGE_CODEC_JSON ] if msgpack != None else [ MESSAGE_CODEC_JSON ]
+        }
+        if mapId != None:
+            connectData["map_id"] = mapId
+            connectData["map_version"] = mapVersion
+        await sendMessage("robot_connect", connectData)
 
         async for data in websocket:
-            log("Server message: " + data)
-            message = json.loads(data)
+            # Binary map frames are send before the message they belong to, other binary frames are MessagePack messages
+            if isinstance(data, bytes) and (data[0] == MAP_FRAME_SNAPSHOT or data[0] == MAP_FRAME_UPDATES):
+                log("Server map frame of " + str(len(data)) + " bytes")
+                decodeMapFrame(data)
+                continue
 
-            # World info message
+            log("Server message: " + str(data))
+            if isinstance(data, bytes):
+                messageCodec = MESSAGE_CODEC_MSGPACK
+                message = msgpack.unpackb(data)
+            else:
+                message = json.loads(data)
+
+            # A traced tick of this robot is planned after its robot tick message and the map is updated
+            # after its read sensors done message
+            if (message["type"] == "robot_tick" or message["type"] == "read_sensors_done") and "trace_id" in message["data"] and message["data"]["robot_id"] == robot["id"]:
+                trace["id"] = message["data"]["trace_id"]
+                trace["name"] = message["type"] == "robot_tick" and "plan" or "map update"
+                trace["start"] = time.time()
+
+            # World info message, the map is already decoded when it is send in a binary map frame
             if message["type"] == "world_info":
-                mapWidth = message["data"]["map"]["width"]
-                mapHeight = message["data"]["map"]["height"]
-
-                # Create map data
-                mapData = [[TILE_UNKOWN] * mapWidth for i in range(mapHeight)]
-                mapData[0][0] = TILE_FLOOR
-                mapData[0][mapWidth - 1] = TILE_FLOOR
-                mapData[mapHeight - 1][0] = TILE_FLOOR
-                mapData[mapHeight - 1][mapWidth - 1] = TILE_FLOOR
-
-                # Patch map data with given map
-                for y in range(mapHeight):
-                    for x in range(mapWidth):
-                        if mapData[y][x] == TILE_UNKOWN and message["data"]["map"]["data"][y][x] != TILE_UNKOWN:
-                            mapData[y][x] = message["data"]["map"]["data"][y][x]
+                if "data" in message["data"]["map"]:
+                    mapWidth = message["data"]["map"]["width"]
+                    mapHeight = message["data"]["map"]["height"]
+                    mapData = bytearray(tileType for row in message["data"]["map"]["data"] for tileType in row)
+                if "changes" in message["data"]["map"]:
+                    for mapUpdate in message["data"]["map"]["changes"]:
+                        mapData[mapUpdate["y"] * mapWidth + mapUpdate["x"]] = mapUpdate["type"]
+                mapId = message["data"]["map"]["id"]
+                mapVersion = message["data"]["map"]["version"]
 
             # Robot connect message
             if message["type"] == "robot_connect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["x"] = message["data"]["robot"]["x"]
                 otherRobot["y"] = message["data"]["robot"]["y"]
                 otherRobot["directions"] = []
@@ -163,13 +264,13 @@ async def websocketConnection():
 
             # Robot disconnect message
             if message["type"] == "robot_disconnect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["connected"] = False
                 log("Robot " + str(otherRobot["id"]) + " is disconnected")
 
             # New direction message
             if message["type"] == "new_direction":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["directions"].append({
                     "id": message["data"]["direction"]["id"],
                     "x": message["data"]["direction"]["x"],
@@ -179,33 +280,38 @@ async def websocketConnection():
 
             # Cancel direction message
             if message["type"] == "cancel_direction":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["directions"] = [direction for direction in otherRobot["directions"] if direction["id"] != message["data"]["direction_id"]]
                 log("Cancel direction for robot " + str(otherRobot["id"]))
 
             # Read sensors done message
             if message["type"] == "read_sensors_done":
+                # Use the position that is committed by the server
+                if "robot" in message["data"]:
+                    robot["x"] = message["data"]["robot"]["x"]
+                    robot["y"] = message["data"]["robot"]["y"]
+
                 # Patch map data with given sensor data
                 mapUpdates = []
 
                 if robot["y"] > 0:
                     upType = message["data"]["sensors"]["up"] and TILE_CHEST or TILE_FLOOR
-                    mapData[robot["y"] - 1][robot["x"]] = upType
+                    mapData[(robot["y"] - 1) * mapWidth + robot["x"]] = upType
                     mapUpdates.append({ "x": robot["x"], "y": robot["y"] - 1, "type": upType })
 
                 if robot["x"] > 0:
                     leftType = message["data"]["sensors"]["left"] and TILE_CHEST or TILE_FLOOR
-                    mapData[robot["y"]][robot["x"] - 1] = leftType
+                    mapData[robot["y"] * mapWidth + robot["x"] - 1] = leftType
                     mapUpdates.append({ "x": robot["x"] - 1, "y": robot["y"], "type": leftType })
 
                 if robot["x"] < mapWidth - 1:
                     rightType = message["data"]["sensors"]["right"] and TILE_CHEST or TILE_FLOOR
-                    mapData[robot["y"]][robot["x"] + 1] = rightType
+                    mapData[robot["y"] * mapWidth + robot["x"] + 1] = rightType
                     mapUpdates.append({ "x": robot["x"] + 1, "y": robot["y"], "type": rightType })
 
                 if robot["y"] < mapHeight - 1:
                     downType = message["data"]["sensors"]["down"] and TILE_CHEST or TILE_FLOOR
-                    mapData[robot["y"] + 1][robot["x"]] = downType
+                    mapData[(robot["y"] + 1) * mapWidth + robot["x"]] = downType
                     mapUpdates.append({ "x": robot["x"], "y": robot["y"] + 1, "type": downType })
 
                 # Send tick done message
@@ -300,17 +406,30 @@ async def websocketConnection():
 
             # Robot tick done message
             if message["type"] == "robot_tick_done":
+                if "map_version" in message["data"]:
+                    mapVersion = max(mapVersion, message["data"]["map_version"])
+
                 if robot["id"] != message["data"]["robot_id"]:
-                    otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                    otherRobot = getRobot(message["data"]["robot_id"])
                     if "robot" in message["data"]:
                         otherRobot["x"] = message["data"]["robot"]["x"]
                         otherRobot["y"] = message["data"]["robot"]["y"]
 
                     if "map" in message["data"]:
                         for mapUpdate in message["data"]["map"]:
-                            if mapData[mapUpdate["y"]][mapUpdate["x"]] == TILE_UNKOWN and mapUpdate["type"] != TILE_UNKOWN:
-                                mapData[mapUpdate["y"]][mapUpdate["x"]] = mapUpdate["type"]
+                            if mapData[mapUpdate["y"] * mapWidth + mapUpdate["x"]] == TILE_UNKOWN and mapUpdate["type"] != TILE_UNKOWN:
+                                mapData[mapUpdate["y"] * mapWidth + mapUpdate["x"]] = mapUpdate["type"]
 
                     log("Tick done from Robot " + str(otherRobot["id"]))
 
-asyncio.run(websocketConnection())
+# Reconnect when the connection is lost, the map is resynced with only the map changes that are missed
+async def main():
+    while True:
+        try:
+            await websocketConnection()
+        except (OSError, websockets.ConnectionClosed):
+            pass
+        log("Connection lost, reconnecting in " + str(RECONNECT_DELAY) + " seconds...")
+        await asyncio.sleep(RECONNECT_DELAY)
+
+asyncio.run(main())
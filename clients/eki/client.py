@@ -1,13 +1,22 @@
 import asyncio
 import json
+import os
+import sys
+import time
 import websockets
 import heapq
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import tracing
+
 DEBUG = False
 
 ROBOT_ID = 2
 WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
 
+# The trace folder for the spans of the ticks that the server traces
+TRACE_PATH = "traces"
+
 TILE_UNKNOW = 0
 TILE_FLOOR = 1
 TILE_CHEST = 2
@@ -16,12 +25,16 @@ mapWidth = None
 mapHeight = None
 mapData = None
 
-robots = [
-    {"id": 1, "x": None, "y": None, "directions": [], "connected": False},
-    {"id": 2, "x": None, "y": None, "directions": [], "connected": False},
-    {"id": 3, "x": None, "y": None, "directions": [], "connected": False},
-    {"id": 4, "x": None, "y": None, "directions": [], "connected": False}
-]
+# The spans of the traced ticks
+traceWriter = tracing.TraceWriter(TRACE_PATH, "robot " + str(ROBOT_ID), "robot-" + str(ROBOT_ID))
+
+robots = {}
+
+
+def getRobot(robotId):
+    if robotId not in robots:
+        robots[robotId] = {"id": robotId, "x": None, "y": None, "directions": [], "connected": False}
+    return robots[robotId]
 
 
 class Node:
@@ -92,7 +105,7 @@ def astar(start, end, withOtherRobots):
         outer_iterations += 1
 
 
-        for robot in robots:
+        for robot in robots.values():
             # if destination position equels other robot position then cancel
             if end_as_tuple[0] == robot["x"] and end_as_tuple[1] == robot["y"] and robot["connected"]:
                 return None
@@ -129,7 +142,7 @@ def astar(start, end, withOtherRobots):
             # if other robot is connected
             if withOtherRobots:
                 colliding = False
-                for robot in robots:
+                for robot in robots.values():
                     if robot["connected"] and robot["x"] == node_position[0] and robot["y"] == node_position[1]:
                         colliding = True
                         break
@@ -194,12 +207,21 @@ def log(line):
 async def websocketConnection():
     global mapWidth, mapHeight, mapData
 
-    robot = next((robot for robot in robots if robot["id"] == ROBOT_ID), None)
+    robot = getRobot(ROBOT_ID)
     tickCounter = 0
+    trace = {"id": None, "name": None, "start": None}
 
     log("Connecting with the websockets server at " + WEBSOCKETS_URL + "...")
     async with websockets.connect(WEBSOCKETS_URL) as websocket:
         async def sendMessage(type, data={}):
+            # The messages of a traced tick carry its trace id, the read sensors and tick done messages end a span
+            if trace["id"] != None and (type == "read_sensors" or type == "robot_tick_done" or type == "cancel_direction"):
+                data = dict(data, trace_id=trace["id"])
+                if type != "cancel_direction":
+                    traceWriter.span(trace["id"], trace["name"], trace["start"])
+                if type == "robot_tick_done":
+                    trace["id"] = None
+
             await websocket.send(json.dumps({
                 "type": type,
                 "data": data
@@ -212,6 +234,13 @@ async def websocketConnection():
             log("Server message: " + data)
             message = json.loads(data)
 
+            # A traced tick of this robot is planned after its robot tick message and the map is updated
+            # after its read sensors done message
+            if (message["type"] == "robot_tick" or message["type"] == "read_sensors_done") and "trace_id" in message["data"] and message["data"]["robot_id"] == robot["id"]:
+                trace["id"] = message["data"]["trace_id"]
+                trace["name"] = message["type"] == "robot_tick" and "plan" or "map update"
+                trace["start"] = time.time()
+
             # World info message
             if message["type"] == "world_info":
                 mapWidth = message["data"]["map"]["width"]
@@ -232,7 +261,7 @@ async def websocketConnection():
 
             # Robot connect message
             if message["type"] == "robot_connect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["x"] = message["data"]["robot"]["x"]
                 otherRobot["y"] = message["data"]["robot"]["y"]
                 otherRobot["directions"] = []
@@ -247,13 +276,13 @@ async def websocketConnection():
 
             # Robot disconnect message
             if message["type"] == "robot_disconnect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["connected"] = False
                 log("Robot " + str(otherRobot["id"]) + " is disconnected")
 
             # New direction message
             if message["type"] == "new_direction":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["directions"].append({
                     "id": message["data"]["direction"]["id"],
                     "x": message["data"]["direction"]["x"],
@@ -263,13 +292,18 @@ async def websocketConnection():
 
             # Cancel direction message
             if message["type"] == "cancel_direction":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["directions"] = [direction for direction in otherRobot["directions"] if
                                             direction["id"] != message["data"]["direction_id"]]
                 log("Cancel direction for robot " + str(otherRobot["id"]))
 
             # Read sensors done message
             if message["type"] == "read_sensors_done":
+                # Use the position that is committed by the server
+                if "robot" in message["data"]:
+                    robot["x"] = message["data"]["robot"]["x"]
+                    robot["y"] = message["data"]["robot"]["y"]
+
                 # Patch map data with given sensor data
                 mapUpdates = []
 
@@ -386,7 +420,7 @@ async def websocketConnection():
             # Robot tick done message
             if message["type"] == "robot_tick_done":
                 if robot["id"] != message["data"]["robot_id"]:
-                    otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                    otherRobot = getRobot(message["data"]["robot_id"])
                     if "robot" in message["data"]:
                         otherRobot["x"] = message["data"]["robot"]["x"]
                         otherRobot["y"] = message["data"]["robot"]["y"]
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import colorsys
 import json
 import math
 import os
@@ -18,18 +19,21 @@ def makeMaze(w, h):
     ver = [["| "] * w + ["|"] for _ in range(h)] + [[]]
     hor = [["+-"] * w + ["+"] for _ in range(h + 1)]
 
-    def walk(x, y):
-        vis[y][x] = 1
-
-        d = [(x - 1, y), (x, y + 1), (x + 1, y), (x, y - 1)]
-        random.shuffle(d)
-        for (xx, yy) in d:
-            if vis[yy][xx]: continue
-            if xx == x: hor[max(y, yy)][x] = "+ "
-            if yy == y: ver[y][max(x, xx)] = "  "
-            walk(xx, yy)
-
-    walk(random.randrange(w), random.randrange(h))
+    # Walk with an own stack so big mazes don't hit the recursion limit
+    x, y = random.randrange(w), random.randrange(h)
+    vis[y][x] = 1
+    stack = [(x, y)]
+    while len(stack) > 0:
+        (x, y) = stack[-1]
+        d = [(xx, yy) for (xx, yy) in [(x - 1, y), (x, y + 1), (x + 1, y), (x, y - 1)] if not vis[yy][xx]]
+        if len(d) == 0:
+            stack.pop()
+            continue
+        (xx, yy) = random.choice(d)
+        if xx == x: hor[max(y, yy)][x] = "+ "
+        if yy == y: ver[y][max(x, xx)] = "  "
+        vis[yy][xx] = 1
+        stack.append((xx, yy))
 
     s = ""
     for (a, b) in zip(hor, ver):
@@ -37,12 +41,12 @@ def makeMaze(w, h):
     return s
 
 # Map generator script
-mapWidth = len(sys.argv) >= 2 and min(int(sys.argv[1]), 64) or 16
-mapHeight = len(sys.argv) >= 2 and min(int(sys.argv[2]), 64) or 16
+mapWidth = len(sys.argv) >= 2 and int(sys.argv[1]) or 16
+mapHeight = len(sys.argv) >= 2 and int(sys.argv[2]) or 16
 mapData = [[TILE_FLOOR] * mapWidth for i in range(mapHeight)]
 
-# Generate random maze and copy into map data
-maze = makeMaze(34, 34)
+# Generate random maze which is big enough and copy into map data
+maze = makeMaze(mapWidth // 2 + 1, mapHeight // 2 + 1)
 lines = maze.split("\n")
 for y in range(1, mapHeight - 1):
     for x in range(1, mapWidth - 1):
@@ -61,13 +65,23 @@ with open("webots/map.json", "w") as mapFile:
 ############# Webots world generation #############
 ###################################################
 if len(sys.argv) >= 4 and sys.argv[3] == "webots":
-    # Robots start in the corners
+    # The robot count can be given via fifth argument
+    robotCount = len(sys.argv) >= 5 and int(sys.argv[4]) or 4
+
+    # The first four robots start in the corners, the others are spread over the border
     robots = [
         { "id": 1, "x": 0, "y": 0, "color": { "red": 1, "green": 0, "blue": 0 } },
         { "id": 2, "x": mapWidth - 1, "y": 0, "color": { "red": 0, "green": 1, "blue": 0 } },
         { "id": 3, "x": 0, "y": mapHeight - 1, "color": { "red": 1, "green": 1, "blue": 0 } },
         { "id": 4, "x": mapWidth - 1, "y": mapHeight - 1, "color": { "red": 0, "green": 0, "blue": 1 } }
-    ]
+    ][:robotCount]
+    borderTiles = [(x, 0) for x in range(1, mapWidth - 1)] + [(mapWidth - 1, y) for y in range(1, mapHeight - 1)] + \
+        [(x, mapHeight - 1) for x in range(mapWidth - 2, 0, -1)] + [(0, y) for y in range(mapHeight - 2, 0, -1)]
+    otherRobotCount = min(robotCount - len(robots), len(borderTiles))
+    for i in range(otherRobotCount):
+        x, y = borderTiles[i * len(borderTiles) // otherRobotCount]
+        red, green, blue = colorsys.hsv_to_rgb(((i + 5) * 0.618034) % 1, 0.75, 1)
+        robots.append({ "id": i + 5, "x": x, "y": y, "color": { "red": red, "green": green, "blue": blue } })
 
     # Create webots world file
     with open("webots/worlds/world.wbt", "w") as worldFile:
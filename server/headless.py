@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+# MegaBots headless engine, runs the tick logic of the server, the sensor model of the supervisor and the robot controllers
+# in one process with direct calls instead of WebSockets; the controllers speak the same protocol as the clients,
+# so the same controller code also runs over WebSockets against a real server
+# Usage: python server/headless.py [map size] [robot count] [ticks]
+#        python server/headless.py websockets [robot id...]
+
+import asyncio
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import websockets
+
+import server
+
+# Constants
+MAP_SIZE = 24
+ROBOT_COUNT = 4
+TICKS = 1000
+
+WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+RECONNECT_DELAY = 1
+
+# The ticks that a robot waits for another robot in its way before it drops its direction,
+# so two robots that wait for each other in a corridor get new directions
+WAIT_TICKS = 8
+
+# Table to mark the chest tiles of a map buffer
+CHEST_TABLE = bytes(tile == server.TILE_CHEST and 1 or 0 for tile in range(256))
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# A connection of a controller with the server in this process, the messages of the controller are given directly
+# to the message handlers of the server and the outbound frames of the server are decoded for the controller
+class HeadlessConnection:
+    def __init__(self, controller):
+        self.controller = controller
+        self.protocol = types.SimpleNamespace(extensions=[])
+
+    async def connect(self):
+        type, data = self.controller.connectMessage()
+        await self.sendMessage(type, data)
+
+    async def sendMessage(self, type, data = {}):
+        handler = server.messageHandlers.get(type)
+        if handler != None:
+            await handler(self, data)
+
+    # The server sends its encoded frames to the connection like to a websocket
+    async def send(self, frame):
+        message = server.decodeMessage(frame)
+        for message in (message["type"] == "batch" and message["data"]["messages"] or [ message ]):
+            await self.controller.handleMessage(self, message["type"], message["data"])
+
+    def close(self):
+        server.disconnectHandler(self)
+
+# A connection of a controller with a server over WebSockets, it reconnects when the connection is lost
+class WebsocketConnection:
+    def __init__(self, controller, url = WEBSOCKETS_URL):
+        self.controller = controller
+        self.url = url
+        self.websocket = None
+
+    async def sendMessage(self, type, data = {}):
+        await self.websocket.send(json.dumps({ "type": type, "data": data }, separators=(",", ":")))
+
+    async def run(self):
+        while True:
+            try:
+                async with websockets.connect(self.url, max_size=None) as websocket:
+                    self.websocket = websocket
+                    type, data = self.controller.connectMessage()
+                    await self.sendMessage(type, data)
+                    async for frame in websocket:
+                        message = json.loads(frame)
+                        for message in (message["type"] == "batch" and message["data"]["messages"] or [ message ]):
+                            await self.controller.handleMessage(self, message["type"], message["data"])
+            except (OSError, websockets.ConnectionClosed):
+                pass
+            await asyncio.sleep(RECONNECT_DELAY)
+
+# The sensor model of the supervisor, it reads the sensors of the robots from the complete map
+class SupervisorController:
+    def __init__(self, mapData):
+        self.id = round(time.time() * 1000)
+        self.mapWidth = len(mapData[0])
+        self.mapHeight = len(mapData)
+        self.mapData = mapData
+        self.robots = {}
+
+    def connectMessage(self):
+        return "supervisor_connect", { "supervisor_id": self.id, "batch": True, "map": { "width": self.mapWidth, "height": self.mapHeight } }
+
+    async def handleMessage(self, connection, type, data):
+        if type == "robot_connect" or (type == "robot_tick_done" and "robot" in data):
+            self.robots[data["robot_id"]] = (data["robot"]["x"], data["robot"]["y"])
+
+        if type == "read_sensors":
+            robotX, robotY = self.robots[data["robot_id"]]
+            if "robot" in data:
+                robotX, robotY = data["robot"]["x"], data["robot"]["y"]
+            messageData = {
+                "robot_id": data["robot_id"],
+                "sensors": {
+                    "up": robotY == 0 or self.mapData[robotY - 1][robotX] == server.TILE_CHEST,
+                    "left": robotX == 0 or self.mapData[robotY][robotX - 1] == server.TILE_CHEST,
+                    "right": robotX == self.mapWidth - 1 or self.mapData[robotY][robotX + 1] == server.TILE_CHEST,
+                    "down": robotY == self.mapHeight - 1 or self.mapData[robotY + 1][robotX] == server.TILE_CHEST
+                }
+            }
+            if "trace_id" in data:
+                messageData["trace_id"] = data["trace_id"]
+            await connection.sendMessage("read_sensors_done", messageData)
+
+# The robot controller of the reference client, it drives one step every tick over the shortest path to its first direction
+# and waits when the path is blocked by another robot; the path is kept over the ticks and only searched again
+# when the direction changes or when a chest or another robot is in the way
+class RobotController:
+    def __init__(self, robotId):
+        self.id = robotId
+        self.mapWidth = None
+        self.mapHeight = None
+        self.mapData = None
+        self.robots = {}
+        self.tickCounter = 0
+        self.path = []
+        self.waitTicks = 0
+        self.traceId = None
+
+    def connectMessage(self):
+        return "robot_connect", { "robot_id": self.id }
+
+    def getRobot(self, robotId):
+        if robotId not in self.robots:
+            self.robots[robotId] = { "id": robotId, "x": None, "y": None, "directions": [], "connected": False }
+        return self.robots[robotId]
+
+    def robotTiles(self):
+        return { (robot["x"], robot["y"]) for robot in self.robots.values() if robot["connected"] and robot["id"] != self.id }
+
+    # The shortest path from begin to end over the floor and unkown tiles as a list of points without begin,
+    # the search works on the tile indexes of the map with the chests and the blocked tiles marked as visited;
+    # a blocked end is still reached but a chest at the end is not
+    def findPath(self, begin, end, blockedTiles):
+        mapWidth = self.mapWidth
+        cameFrom = [ -1 ] * len(self.mapData)
+        visited = self.mapData.translate(CHEST_TABLE)
+        for x, y in blockedTiles:
+            visited[y * mapWidth + x] = 1
+        beginIndex = begin[1] * mapWidth + begin[0]
+        endIndex = end[1] * mapWidth + end[0]
+        visited[beginIndex] = 1
+        visited[endIndex] = CHEST_TABLE[self.mapData[endIndex]]
+
+        frontier = collections.deque([ beginIndex ])
+        while len(frontier) > 0:
+            index = frontier.popleft()
+            if index == endIndex:
+                path = []
+                while index != beginIndex:
+                    path.append((index % mapWidth, index // mapWidth))
+                    index = cameFrom[index]
+                path.reverse()
+                return path
+
+            x = index % mapWidth
+            for neighbor in (x > 0 and index - 1, index >= mapWidth and index - mapWidth, x < mapWidth - 1 and index + 1, index + mapWidth < len(visited) and index + mapWidth):
+                if neighbor is not False and visited[neighbor] == 0:
+                    visited[neighbor] = 1
+                    cameFrom[neighbor] = index
+                    frontier.append(neighbor)
+        return None
+
+    # The messages of a traced tick carry the trace id of the tick, the engine doesn't write spans of its own
+    async def sendMessage(self, connection, type, data):
+        if self.traceId != None:
+            data = dict(data, trace_id=self.traceId)
+        await connection.sendMessage(type, data)
+
+    async def tickDone(self, connection, data = None):
+        self.tickCounter += 1
+        await self.sendMessage(connection, "robot_tick_done", data or { "robot_id": self.id })
+
+    async def handleMessage(self, connection, type, data):
+        robot = self.getRobot(self.id)
+        if (type == "robot_tick" or type == "read_sensors_done") and data["robot_id"] == self.id:
+            self.traceId = data.get("trace_id")
+
+        if type == "world_info":
+            self.mapWidth = data["map"]["width"]
+            self.mapHeight = data["map"]["height"]
+            if "data" in data["map"]:
+                self.mapData = bytearray(tileType for row in data["map"]["data"] for tileType in row)
+            for mapUpdate in data["map"].get("changes", []):
+                self.mapData[mapUpdate["y"] * self.mapWidth + mapUpdate["x"]] = mapUpdate["type"]
+
+        if type == "robot_connect":
+            otherRobot = self.getRobot(data["robot_id"])
+            otherRobot["x"] = data["robot"]["x"]
+            otherRobot["y"] = data["robot"]["y"]
+            otherRobot["directions"] = [ { "id": direction["id"], "x": direction["x"], "y": direction["y"] } for direction in data["robot"]["directions"] ]
+            otherRobot["connected"] = True
+
+        if type == "robot_disconnect":
+            self.getRobot(data["robot_id"])["connected"] = False
+
+        if type == "new_direction":
+            self.getRobot(data["robot_id"])["directions"].append({ "id": data["direction"]["id"], "x": data["direction"]["x"], "y": data["direction"]["y"] })
+
+        if type == "cancel_direction":
+            otherRobot = self.getRobot(data["robot_id"])
+            otherRobot["directions"] = [ direction for direction in otherRobot["directions"] if direction["id"] != data["direction_id"] ]
+
+        # Patch the map with the sensors of the new position and tell the server
+        if type == "read_sensors_done":
+            if "robot" in data:
+                robot["x"] = data["robot"]["x"]
+                robot["y"] = data["robot"]["y"]
+            mapUpdates = []
+            for x, y, side in ((robot["x"], robot["y"] - 1, "up"), (robot["x"] - 1, robot["y"], "left"), (robot["x"] + 1, robot["y"], "right"), (robot["x"], robot["y"] + 1, "down")):
+                if 0 <= x < self.mapWidth and 0 <= y < self.mapHeight:
+                    tileType = data["sensors"][side] and server.TILE_CHEST or server.TILE_FLOOR
+                    self.mapData[y * self.mapWidth + x] = tileType
+                    mapUpdates.append({ "x": x, "y": y, "type": tileType })
+            await self.tickDone(connection, { "robot_id": self.id, "robot": { "x": robot["x"], "y": robot["y"] }, "map": mapUpdates })
+
+        if type == "robot_tick" and data["robot_id"] == self.id:
+            # The first tick only reads the sensors
+            if self.tickCounter == 0:
+                await self.sendMessage(connection, "read_sensors", { "robot_id": self.id })
+                return
+
+            if len(robot["directions"]) == 0:
+                await self.tickDone(connection)
+                return
+
+            # Cancel the direction when the robot is there or when it can't get there, wait when another robot is in the way;
+            # a destination that turns out to be a chest is dropped
+            position = (robot["x"], robot["y"])
+            destination = (robot["directions"][0]["x"], robot["directions"][0]["y"])
+            if self.mapData[destination[1] * self.mapWidth + destination[0]] == server.TILE_CHEST:
+                self.path = []
+                await self.sendMessage(connection, "cancel_direction", { "robot_id": self.id, "direction_id": robot["directions"][0]["id"] })
+                await self.tickDone(connection)
+                return
+            if position != destination:
+                robotTiles = self.robotTiles()
+                if len(self.path) == 0 or self.path[-1] != destination or abs(self.path[0][0] - position[0]) + abs(self.path[0][1] - position[1]) != 1 or self.path[0] in robotTiles or \
+                        any(self.mapData[y * self.mapWidth + x] == server.TILE_CHEST for x, y in self.path):
+                    self.path = self.findPath(position, destination, robotTiles) or []
+            if position == destination or len(self.path) == 0:
+                self.path = []
+                self.waitTicks += 1
+                if position == destination or self.waitTicks > WAIT_TICKS or self.findPath(position, destination, ()) == None:
+                    self.waitTicks = 0
+                    await self.sendMessage(connection, "cancel_direction", { "robot_id": self.id, "direction_id": robot["directions"][0]["id"] })
+                await self.tickDone(connection)
+                return
+            self.waitTicks = 0
+
+            robot["x"], robot["y"] = self.path.pop(0)
+            if (robot["x"], robot["y"]) == destination:
+                await self.sendMessage(connection, "cancel_direction", { "robot_id": self.id, "direction_id": robot["directions"][0]["id"] })
+            await self.sendMessage(connection, "read_sensors", { "robot_id": self.id, "robot": { "x": robot["x"], "y": robot["y"] } })
+
+        if type == "robot_tick_done" and data["robot_id"] != self.id:
+            otherRobot = self.getRobot(data["robot_id"])
+            if "robot" in data:
+                otherRobot["x"] = data["robot"]["x"]
+                otherRobot["y"] = data["robot"]["y"]
+            for mapUpdate in data.get("map", []):
+                if self.mapData[mapUpdate["y"] * self.mapWidth + mapUpdate["x"]] == server.TILE_UNKOWN:
+                    self.mapData[mapUpdate["y"] * self.mapWidth + mapUpdate["x"]] = mapUpdate["type"]
+
+# Generate a random maze map with the map generator
+def generateMap(mapSize):
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "webots"))
+        subprocess.run([ sys.executable, os.path.join(ROOT_PATH, "map-generator.py"), str(mapSize), str(mapSize) ], cwd=directory, check=True)
+        with open(os.path.join(directory, "webots", "map.json"), "r") as mapFile:
+            return json.loads(mapFile.read())["data"]
+
+# The unkown tiles that a connected robot can still reach over the known map, the search stops at the first ones
+def reachableUnkownTiles():
+    connectedRobots = [ robot for robot in server.robots.values() if robot["websocket"] != None ]
+    distanceFields, candidates = server.discoverDistanceFields(connectedRobots, set(), server.mapGrid, server.unkownTiles)
+    return { tile for robotCandidates in candidates for tile in robotCandidates }
+
+# Run the ticks of the world with the supervisor and robot controllers in this process, the ticks are manual
+# and concurrent and stop early when the robots can't reach any unkown tile anymore, returns the ticks that are run;
+# the reachable tiles are only searched when no robot has a direction left
+async def simulate(mapData, robotControllers, ticks, tickPhase = server.TICK_PHASE_CONCURRENT):
+    connections = [ HeadlessConnection(SupervisorController(mapData)) ] + [ HeadlessConnection(controller) for controller in robotControllers ]
+    for connection in connections:
+        await connection.connect()
+    await server.updateWorldInfoHandler(None, { "tick": { "type": server.TICK_MANUAL, "phase": tickPhase } })
+
+    tick = 0
+    while tick < ticks and len(server.unkownTiles) > 0:
+        await server.tick()
+        await server.tickIdle.wait()
+        tick += 1
+        if all(len(robot["directions"]) == 0 for robot in server.robots.values()) and len(reachableUnkownTiles()) == 0:
+            break
+
+    for connection in connections:
+        connection.close()
+    return tick
+
+async def headless(mapSize, robotCount, ticks):
+    mapData = generateMap(mapSize)
+    startTime = time.perf_counter()
+    tickCount = await simulate(mapData, [ RobotController(robotId) for robotId in range(1, robotCount + 1) ], ticks)
+    elapsedTime = time.perf_counter() - startTime
+    print("%d ticks of %d robots on a %dx%d map in %.2f s, %.0f ticks/s, %d unkown tiles left of which %d reachable" % (
+        tickCount, robotCount, mapSize, mapSize, elapsedTime, tickCount / elapsedTime, len(server.unkownTiles), len(reachableUnkownTiles())))
+
+# Run the robot controllers over WebSockets against a running server
+async def connectRobots(robotIds):
+    await asyncio.gather(*(WebsocketConnection(RobotController(robotId)).run() for robotId in robotIds))
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "websockets":
+        asyncio.run(connectRobots(len(sys.argv) >= 3 and [ int(robotId) for robotId in sys.argv[2:] ] or [ 1 ]))
+    else:
+        asyncio.run(headless(len(sys.argv) >= 2 and int(sys.argv[1]) or MAP_SIZE, len(sys.argv) >= 3 and int(sys.argv[2]) or ROBOT_COUNT,
+            len(sys.argv) >= 4 and int(sys.argv[3]) or TICKS))
@@ -1,100 +1,1122 @@
 #!/usr/bin/env python
 
 import asyncio
+import bisect
+import collections
+import colorsys
+import cProfile
+import copy
+import io
+import gzip
+import itertools
 import json
+import mmap
+import multiprocessing
+import os
+import pstats
 import random
+import re
+import struct
+import sys
+import threading
 import time
+import types
+import urllib.parse
 import websockets
+import zlib
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Opcode
+
+# Optional faster JSON backend and MessagePack codec
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Constants
 DEBUG = False
 
 WEBSOCKETS_PORT = 8080
 
+# The room of the connections that don't give a room, the other rooms are created by their first connection
+# and torn down when they have no connections for the close delay in seconds
+ROOM_DEFAULT = "default"
+ROOM_CLOSE_DELAY = 60
+
+# The permessage-deflate compression of the websockets server, None disables it for all connections
+WEBSOCKETS_COMPRESSION = "deflate"
+
 TICK_MANUAL = 0
 TICK_AUTO = 1
 
-TILE_UNKOWN = 0
-TILE_FLOOR = 1
-TILE_CHEST = 2
+TICK_PHASE_SERIAL = 0
+TICK_PHASE_CONCURRENT = 1
 
-# Simple asyncio timer class
-class Timer:
-    def __init__(self, timeout, callback, extra):
-        self._timeout = timeout
-        self._callback = callback
-        self._extra = extra
-        self._task = asyncio.ensure_future(self._job())
+# What the auto ticker does when a tick is still running at its deadline: skip the missed deadlines,
+# run the missed ticks back to back or stretch the period by starting the deadlines again from now
+TICK_OVERRUN_SKIP = 0
+TICK_OVERRUN_CATCH_UP = 1
+TICK_OVERRUN_STRETCH = 2
 
-    async def _job(self):
-        await asyncio.sleep(self._timeout)
-        await self._callback(self._extra)
+TICK_CATCH_UP_LIMIT = 10
+TICK_RATE_INTERVAL = 1
 
-    def cancel(self):
-        self._task.cancel()
+TILE_UNKOWN = 0
+TILE_FLOOR = 1
+TILE_CHEST = 2
 
-# Map data is unkown until supervisor connect message from supervisor
+# How the map is encoded for a connection, the compact encodings are send in binary map frames
+MAP_ENCODING_JSON = 0
+MAP_ENCODING_PACKED = 1
+MAP_ENCODING_RLE = 2
+
+MAP_COMPACT_ENCODINGS = [ MAP_ENCODING_PACKED, MAP_ENCODING_RLE ]
+
+MAP_FRAME_SNAPSHOT = 1
+MAP_FRAME_UPDATES = 2
+
+# The codecs of the messages, MessagePack messages are send in binary frames
+MESSAGE_CODEC_JSON = 0
+MESSAGE_CODEC_MSGPACK = 1
+MESSAGE_CODECS = [ MESSAGE_CODEC_JSON ] + ([ MESSAGE_CODEC_MSGPACK ] if msgpack != None else [])
+
+# How many map changes are kept to resync a reconnecting connection without a complete map
+MAP_CHANGE_LOG_SIZE = 65536
+
+# What to do with a website that can't keep up with its outbound messages
+SLOW_CONSUMER_COALESCE = 0
+SLOW_CONSUMER_SNAPSHOT = 1
+SLOW_CONSUMER_DISCONNECT = 2
+
+SLOW_CONSUMER_POLICY = SLOW_CONSUMER_COALESCE
+WEBSITE_OUTBOX_SIZE = 256
+
+# The compression of the outbound messages by connection type, messages smaller than the threshold in bytes
+# are send uncompressed and a threshold of None sends all messages uncompressed, the level is the zlib level
+COMPRESSION_SETTINGS = {
+    "robot": { "threshold": 1024, "level": 1 },
+    "website": { "threshold": 0, "level": 6 },
+    "supervisor": { "threshold": 1024, "level": 1 }
+}
+
+# How new robots are placed on the free tiles of the map border
+SPAWN_CORNERS = 0
+SPAWN_SPREAD = 1
+SPAWN_RANDOM = 2
+
+SPAWN_STRATEGY = SPAWN_CORNERS
+
+# How the discover program gives the unkown tiles to the idle robots, greedy gives every robot the closest tile in robot order
+# and matching gives the robots the tiles with the lowest total distance, for many idle robots matching falls back to greedy
+# on the same distances; the matching uses the closest discover candidates tiles of every idle robot
+DISCOVER_GREEDY = 0
+DISCOVER_MATCHING = 1
+
+DISCOVER_ASSIGNMENT = DISCOVER_MATCHING
+DISCOVER_CANDIDATES = 4
+DISCOVER_MATCHING_LIMIT = 64
+
+# The discover program can search in shard worker processes, every shard owns a band of map rows and keeps a copy
+# of its rows with a halo of rows around them, a robot is searched in the shard of the row that it is on;
+# the map changes are send to the shards with the next search or when there are more than the updates limit,
+# zero shards searches in the server process; the shards only pay off on big maps with the robots near the unkown
+# tiles of their own rows, a robot on rows without unkown tiles is searched over the complete map in the server
+# process right away, so maps with less tiles than the minimum are never sharded
+SHARD_COUNT = 0
+SHARD_HALO = 16
+SHARD_UPDATES_LIMIT = 4096
+SHARD_MIN_TILES = 256 * 256
+
+# The world of every room is saved in a snapshot and an append only journal of the state changes in the state folder,
+# a new snapshot is written in a thread after the snapshot journal records and starts a new journal;
+# a restarted server restores the last snapshot and replays the journals after it, None doesn't save the world
+STATE_PATH = None
+SNAPSHOT_JOURNAL_RECORDS = 10000
+
+JOURNAL_TILE = 0
+JOURNAL_ROBOT = 1
+JOURNAL_WORLD = 2
+
+# All inbound and outbound messages of the server can be recorded in a gzip stream of records for replaying them later,
+# the stream is flushed every flush interval in seconds so a killed server loses at most that part, None doesn't record
+RECORD_PATH = None
+RECORD_FLUSH_INTERVAL = 1
+
+RECORD_OPEN = 0
+RECORD_CLOSE = 1
+RECORD_RECEIVE = 2
+RECORD_SEND = 3
+RECORD_BROADCAST = 4
+
+RECORD_BINARY = 0x80
+RECORD_HEADER = struct.Struct("<dBII")
+
+# The metrics of all rooms are served in the Prometheus text format at http://127.0.0.1:<metrics port>/metrics,
+# the durations are counted in the histogram buckets in seconds, None doesn't serve the metrics
+METRICS_PORT = None
+METRICS_BUCKETS = [ 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5 ]
+
+# The metrics port also serves profiles of the running server at /profile for some seconds or ticks, a sampling profile
+# samples the stack every sample interval in seconds and a deterministic profile traces every call; the samples and
+# calls are attributed to the message handler or program that they are in, the profile lines are the top functions
+PROFILE_SAMPLING = "sampling"
+PROFILE_DETERMINISTIC = "deterministic"
+
+PROFILE_SAMPLE_INTERVAL = 0.001
+PROFILE_MAX_SECONDS = 300
+PROFILE_LINES = 20
+
+# The ticks can be traced over the server, the robots and the supervisor: every robot tick message gets a trace id that
+# the robot and the supervisor send back in the messages of that tick, every hop writes the spans of the traces that it
+# handles as JSON lines to its own file in the trace folder, None doesn't trace the ticks
+TRACE_PATH = None
+
+# Map grid is unkown until supervisor connect message from supervisor
 mapWidth = None
 mapHeight = None
-mapData = None
+mapGrid = None
+mapReady = asyncio.Event()
+
+# Every map change increases the map version and is kept in the change log, the map id changes for every new map
+mapId = None
+mapVersion = 0
+mapChanges = collections.deque(maxlen=MAP_CHANGE_LOG_SIZE)
+
+# The unkown tiles that can still be discovered, so without the unkown tiles that are surrounded by chests,
+# the index is updated with every map change
+unkownTiles = set()
+
+# The connected components of the tiles that are not chests, the robots can drive over the floor and unkown tiles
+# of their component, every component has a list of its tiles for random sampling and the position of every tile
+# in that list for removing a new chest; the components are labeled when they are needed for the first time
+componentLabels = None
+componentPositions = None
+componentTiles = {}
+nextComponentLabel = 0
+
+# The union find parents of the chests by tile index, chests that touch each other also diagonally are in the same set
+# and the last index is the outside of the map, a new chest only splits a component when it connects a set with itself
+chestParents = None
+
+# The shard worker processes with their pipe and rows
+shards = []
+
+# The journal file of the world with its sequence number and the records since the last snapshot
+journalFile = None
+journalSequence = 0
+journalRecords = 0
+journalFlushing = False
+snapshotWriting = False
+
+# The encoded map snapshots by map encodings, they are cleared when the map changes
+mapSnapshots = {}
 
 # Server tick information
 tickType = TICK_MANUAL
 tickSpeed = 200
-
-# Robots
-robots = [
-    { "id": 1, "x": None, "y": None, "lift": 200, "color": { "red": 1, "green": 0, "blue": 0 }, "directions": [], "websocket": None },
-    { "id": 2, "x": None, "y": None, "lift": 300, "color": { "red": 0, "green": 1, "blue": 0 }, "directions": [], "websocket": None },
-    { "id": 3, "x": None, "y": None, "lift": 500, "color": { "red": 1, "green": 1, "blue": 0 }, "directions": [], "websocket": None },
-    { "id": 4, "x": None, "y": None, "lift": 250, "color": { "red": 0, "green": 0, "blue": 1 }, "directions": [], "websocket": None }
-]
-
-# Other connections data
-others = []
+tickPhase = TICK_PHASE_SERIAL
+tickOverrun = TICK_OVERRUN_SKIP
+ticker = None
+
+# Robots by id, robots are created when they connect for the first time
+robots = {}
+
+# The original four robots keep there color and lift
+robotPresets = {
+    1: { "lift": 200, "color": { "red": 1, "green": 0, "blue": 0 } },
+    2: { "lift": 300, "color": { "red": 0, "green": 1, "blue": 0 } },
+    3: { "lift": 500, "color": { "red": 1, "green": 1, "blue": 0 } },
+    4: { "lift": 250, "color": { "red": 0, "green": 0, "blue": 1 } }
+}
+
+# The free tiles where robots can be placed in the order of the spawn strategy
+spawnTiles = []
+spawnIndex = 0
+
+# Other connections by id
+websites = {}
+supervisors = {}
+
+# The outbound message bytes, the bytes on the wire and the compression time in seconds by connection type
+compressionStats = { type: { "messages": 0, "bytes": 0, "wire_bytes": 0, "time": 0 } for type in COMPRESSION_SETTINGS }
+
+# All robot and other connections by websocket
+connections = {}
+
+# The metrics of the world: the tick durations, the handler durations by message type and the counts of the handled
+# and the outbound messages by message type, a histogram has the count of every bucket and the sum of the durations
+tickStartTime = None
+tickDurations = { "counts": [ 0 ] * (len(METRICS_BUCKETS) + 1), "sum": 0 }
+handlerDurations = {}
+messagesReceived = collections.Counter()
+messagesSent = collections.Counter()
+
+# Only one profile runs at a time
+profiling = False
+
+# The trace file of the room is opened by its first span
+traceFile = None
+
+# Every room is its own instance of this module with its own map, ticker, program and robots, the default room
+# is this module itself; a new room gets the constants of this module as they are when the room is created,
+# so a constant that is changed at runtime on this module like the metrics port or the trace path also configures
+# the rooms that are created after it, the rooms are the modules in the rooms dict by name
+roomName = ROOM_DEFAULT
+rooms = {}
+roomCloseHandles = {}
+
+# The code that every room runs is compiled once when this module is loaded, so the rooms run the same code
+# as the default room even when the file is changed after the server is started; a room gets it from this module
+if "roomCode" not in globals():
+    with open(__file__, "r") as file:
+        roomCode = compile(file.read(), __file__, "exec")
+
+# The recorder of the messages of all rooms when recording
+recorder = None
 
 # Simple log function
 def log(line):
     if DEBUG:
-        print("[SERVER] " + line)
-
-# Websocket helper functions
-async def sendMessage(item, type, data = {}):
-    await item["websocket"].send(json.dumps({
-        "type": type,
-        "data": data
-    }, separators=(",", ":")))
+        print((roomName == ROOM_DEFAULT and "[SERVER] " or "[SERVER " + roomName + "] ") + line)
+
+# The map tiles in one bytearray row after row, the tile of x and y is at index y * width + x;
+# the queries over the whole map work on the complete buffer at once with bytes operations and big integer shifts
+class Grid:
+    def __init__(self, width, height, type = TILE_UNKOWN):
+        self.width = width
+        self.height = height
+        self.tiles = bytearray([ type ]) * (width * height)
+
+    # A grid with the tiles of a list of rows
+    @staticmethod
+    def fromRows(rows):
+        grid = Grid(len(rows[0]), len(rows))
+        grid.tiles[:] = b"".join(bytes(row) for row in rows)
+        return grid
+
+    def get(self, x, y):
+        return self.tiles[y * self.width + x]
+
+    def set(self, x, y, type):
+        self.tiles[y * self.width + x] = type
+
+    # The tiles as a list of rows for the JSON map
+    def rows(self):
+        return [ list(self.tiles[y * self.width:(y + 1) * self.width]) for y in range(self.height) ]
+
+    # Set all the tiles of the border of the map
+    def fillBorder(self, type):
+        self.tiles[:self.width] = bytes([ type ]) * self.width
+        self.tiles[-self.width:] = bytes([ type ]) * self.width
+        self.tiles[::self.width] = bytes([ type ]) * self.height
+        self.tiles[self.width - 1::self.width] = bytes([ type ]) * self.height
+
+    # A mask with a one for every tile of a type and a zero for the other tiles
+    def mask(self, type):
+        table = bytearray(256)
+        table[type] = 1
+        return self.tiles.translate(table)
+
+    # A mask of the tiles that are surrounded by chests on all four sides, the chest mask is shifted
+    # by one tile and one row in a big integer so the four neighbors of every tile are combined at once
+    def surroundedMask(self):
+        if self.width < 3 or self.height < 3:
+            return bytes(len(self.tiles))
+        chests = int.from_bytes(self.mask(TILE_CHEST), "little")
+        inner = bytes(self.width) + (b"\x00" + b"\x01" * (self.width - 2) + b"\x00") * (self.height - 2) + bytes(self.width)
+        surrounded = (chests << 8) & (chests >> 8) & (chests << (self.width * 8)) & (chests >> (self.width * 8)) & int.from_bytes(inner, "little")
+        return surrounded.to_bytes(len(self.tiles), "little")
+
+    # The tile indexes of the ones in a mask
+    @staticmethod
+    def maskIndexes(mask):
+        return [ match.start() for match in re.finditer(b"\x01", mask) ]
+
+# Compression of the outbound messages of a connection, it wraps the negotiated permessage-deflate extension
+# and sends the messages smaller than the threshold uncompressed, which is allowed by the extension
+# websockets has no public API to choose the compression per message, so this uses the extensions of the protocol and
+# the encoder of the extension which are not public; these are only checked with the versions in requirements.txt
+COMPRESSION_WEBSOCKETS_VERSIONS = (14, 18)
+
+class Compression:
+    name = PerMessageDeflate.name
+
+    def __init__(self, extension, type):
+        self.extension = extension
+        self.threshold = COMPRESSION_SETTINGS[type]["threshold"]
+        self.stats = compressionStats[type]
+        self._compress = False
+
+        # Nothing is compressed yet, so the encoder can still be replaced with one of the compression level
+        if extension != None:
+            extension.compress_settings = { "level": COMPRESSION_SETTINGS[type]["level"] }
+            if not extension.local_no_context_takeover:
+                extension.encoder = zlib.compressobj(wbits=-extension.local_max_window_bits, **extension.compress_settings)
+
+    def decode(self, frame, *, max_size = None):
+        if self.extension != None:
+            return self.extension.decode(frame, max_size=max_size)
+        return frame
+
+    def encode(self, frame):
+        if frame.opcode == Opcode.TEXT or frame.opcode == Opcode.BINARY:
+            self._compress = self.extension != None and self.threshold != None and len(frame.data) >= self.threshold
+            self.stats["messages"] += 1
+        elif frame.opcode != Opcode.CONT:
+            return frame
+        self.stats["bytes"] += len(frame.data)
+
+        if self._compress:
+            startTime = time.perf_counter()
+            frame = self.extension.encode(frame)
+            self.stats["time"] += time.perf_counter() - startTime
+        self.stats["wire_bytes"] += len(frame.data)
+        return frame
+
+# Use the compression settings of the connection type for a connection
+def setupCompression(websocket, type):
+    # Other versions of websockets keep the plain extension which compresses all messages
+    if not COMPRESSION_WEBSOCKETS_VERSIONS[0] <= int(websockets.version.version.split(".")[0]) < COMPRESSION_WEBSOCKETS_VERSIONS[1]:
+        return
+    extensions = websocket.protocol.extensions
+    index = next((i for i, extension in enumerate(extensions) if isinstance(extension, PerMessageDeflate)), None)
+    if index != None:
+        extensions[index] = Compression(extensions[index], type)
+    else:
+        extensions.append(Compression(None, type))
+
+# Outbound message queue of a connection which is drained by its own writer task,
+# when the queue has a size the slow consumer policy is used when it overflows
+# When the connection has a batch interval the broadcasted messages are collected in a batch which is send
+# at the end of every tick (interval 0) or every batch interval in ms, a message for only this connection sends the batch first
+class Outbox:
+    def __init__(self, websocket, size = None, policy = SLOW_CONSUMER_COALESCE, mapEncodings = (), batchInterval = None, codec = MESSAGE_CODEC_JSON):
+        self.websocket = websocket
+        self.size = size
+        self.policy = policy
+        self.mapEncodings = mapEncodings
+        self.codec = codec
+        self.batchInterval = batchInterval
+        self.messages = collections.deque()
+        self.batchMessages = []
+        self.traceTimes = {}
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._flushHandle = None
+        self._task = asyncio.ensure_future(self._job())
 
-async def broadcastMessage(type, data = {}):
-    for robot in robots:
-        if robot["websocket"] != None:
-            await sendMessage(robot, type, data)
+    def put(self, type, data, frames, batch = False):
+        if self.closed:
+            return
+        messagesSent[type] += 1
+
+        if batch and self.batchInterval != None:
+            self.batchMessages.append((type, data))
+            if self.batchInterval > 0:
+                if self._flushHandle == None:
+                    self._flushHandle = asyncio.get_running_loop().call_later(self.batchInterval / 1000, self.flush)
+            elif not tickRunning:
+                self.flush()
+            return
+        self.flush()
+        if TRACE_PATH != None and "trace_id" in data:
+            self.traceTimes[id(data)] = (data, time.time())
+        self._append(type, data, frames)
+
+    # Send the collected messages in one batch message with all their map updates merged
+    def flush(self):
+        if self._flushHandle != None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        if len(self.batchMessages) == 0:
+            return
+
+        type, data = batchMessageData(self.batchMessages)
+        self.batchMessages = []
+        self._append(type, data, encodeFrames(type, data, self.mapEncodings, self.codec))
+
+    def _append(self, type, data, frames):
+        self.messages.append((type, data, frames))
+        if self.size != None and len(self.messages) > self.size:
+            self._overflow()
+        self._ready.set()
+
+    def _overflow(self):
+        if self.policy == SLOW_CONSUMER_COALESCE:
+            self._coalesce()
+            if len(self.messages) <= self.size:
+                return
+            log("Outbox is still full after coalescing, sending a snapshot")
+
+        # The queue spans of the dropped messages are lost
+        self.traceTimes = {}
+
+        if self.policy == SLOW_CONSUMER_COALESCE or self.policy == SLOW_CONSUMER_SNAPSHOT:
+            self.batchMessages = []
+            self.messages = collections.deque((type, data, encodeFrames(type, data, self.mapEncodings, self.codec)) for type, data in snapshotMessages())
+
+        if self.policy == SLOW_CONSUMER_DISCONNECT:
+            log("Outbox is full, disconnecting the slow connection")
+            self.close()
+            asyncio.ensure_future(self.websocket.close())
+
+    # Merge all the queued position updates of a robot into the last one and drop the robot tick messages
+    def _coalesce(self):
+        coalesced = []
+        tickDoneIndexes = {}
+        for type, data, frames in self.messages:
+            if type == "robot_tick":
+                continue
+
+            if type == "robot_tick_done":
+                previousIndex = tickDoneIndexes.get(data["robot_id"])
+                if previousIndex != None:
+                    data = mergeTickDoneData(coalesced[previousIndex][1], data)
+                    frames = None
+                    coalesced[previousIndex] = None
+                tickDoneIndexes[data["robot_id"]] = len(coalesced)
+
+            coalesced.append((type, data, frames))
+
+        # The merged map changes are no longer in version order, so only the last message tells the map version
+        coalesced = [ item for item in coalesced if item != None ]
+        mapVersionIndexes = [ i for i, (type, data, frames) in enumerate(coalesced) if "map_version" in data ]
+        for i in mapVersionIndexes[:-1]:
+            type, data, frames = coalesced[i]
+            data = dict(data)
+            del data["map_version"]
+            coalesced[i] = (type, data, None)
+
+        self.messages = collections.deque()
+        for type, data, frames in coalesced:
+            self.messages.append((type, data, frames != None and frames or encodeFrames(type, data, self.mapEncodings, self.codec)))
 
-    for other in others:
-        await sendMessage(other, type, data)
+    async def _job(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while len(self.messages) > 0:
+                type, data, frames = self.messages.popleft()
+                try:
+                    for frame in frames:
+                        await self.websocket.send(frame)
+                except websockets.ConnectionClosed:
+                    self.close()
+                    return
+
+                # A traced message ends its queue span when it is send
+                traceTime = self.traceTimes.pop(id(data), None)
+                if traceTime != None and traceTime[0] is data:
+                    item = connections.get(self.websocket)
+                    traceSpan(data["trace_id"], "queue " + type, traceTime[1], {
+                        "to": item != None and item.get("type", "robot") + " " + str(item["id"]) or "closed"
+                    })
 
-async def sendWorldMessage(item):
-    # Wait until Webots supervisor is connected and given map data
-    while mapData == None:
-        log("Waiting for supervisor...")
-        await asyncio.sleep(200 / 1000)
+    def close(self):
+        self.closed = True
+        self.messages.clear()
+        self.batchMessages = []
+        self.traceTimes = {}
+        if self._flushHandle != None:
+            self._flushHandle.cancel()
+        self._task.cancel()
 
+# The recorder writes a record for every message: the time in seconds since the start of the recording, the kind
+# with the binary flag, the connection id and the payload size followed by the payload; the outbound messages are
+# recorded once in JSON before they are encoded for the connections and a broadcast has connection id 0
+class Recorder:
+    def __init__(self, path):
+        self.file = gzip.open(path, "wb", compresslevel=1)
+        self.startTime = time.monotonic()
+        self.flushTime = self.startTime
+        self.connectionIds = {}
+        self.nextConnectionId = 1
+
+    def record(self, kind, websocket, payload = ""):
+        if kind == RECORD_OPEN:
+            self.connectionIds[websocket] = self.nextConnectionId
+            self.nextConnectionId += 1
+
+        # Messages for connections that are already closed are not send, so they are not recorded
+        if websocket == None:
+            connectionId = 0
+        elif websocket in self.connectionIds:
+            connectionId = self.connectionIds[websocket]
+        else:
+            return
+
+        if isinstance(payload, str):
+            payload = payload.encode()
+        else:
+            kind |= RECORD_BINARY
+        currentTime = time.monotonic()
+        self.file.write(RECORD_HEADER.pack(currentTime - self.startTime, kind, connectionId, len(payload)))
+        self.file.write(payload)
+        if kind == RECORD_CLOSE:
+            del self.connectionIds[websocket]
+        if currentTime - self.flushTime >= RECORD_FLUSH_INTERVAL:
+            self.flushTime = currentTime
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Read the records of a recording as time, kind, connection id and payload, binary payloads are bytes and the others
+# are strings, a recording of a killed server ends at its last complete record
+def readRecords(path):
+    with gzip.open(path, "rb") as file:
+        while True:
+            try:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                recordTime, kind, connectionId, size = RECORD_HEADER.unpack(header)
+                payload = file.read(size)
+            except (EOFError, zlib.error):
+                return
+            if len(payload) < size:
+                return
+            if kind & RECORD_BINARY:
+                yield recordTime, kind & ~RECORD_BINARY, connectionId, payload
+            else:
+                yield recordTime, kind, connectionId, payload.decode()
+
+# Websocket helper functions, JSON messages are encoded with the faster JSON backend when it is installed
+def encodeMessage(type, data = {}, codec = MESSAGE_CODEC_JSON):
+    message = {
+        "type": type,
+        "data": data
+    }
+    if codec == MESSAGE_CODEC_MSGPACK:
+        return msgpack.packb(message)
+    if orjson != None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"))
+
+# Decode a message of a text frame with JSON or of a binary frame with MessagePack
+def decodeMessage(data):
+    if isinstance(data, bytes):
+        return msgpack.unpackb(data)
+    if orjson != None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Encode a message in the frames for the compact map encodings and codec of a connection, with compact map encodings
+# the map is send in a binary map frame before the message so the map is up to date when the message is handled
+def encodeFrames(type, data, mapEncodings, codec = MESSAGE_CODEC_JSON):
+    if len(mapEncodings) > 0:
+        if type == "world_info":
+            messageData = dict(data)
+            messageData["map"] = { key: value for key, value in data["map"].items() if key != "data" and key != "changes" }
+            if "data" in data["map"]:
+                return [ encodeMapSnapshot(mapEncodings), encodeMessage(type, messageData, codec) ]
+            if len(data["map"]["changes"]) > 0:
+                return [ encodeMapUpdates(data["map"]["changes"]), encodeMessage(type, messageData, codec) ]
+            return [ encodeMessage(type, messageData, codec) ]
+
+        if (type == "robot_tick_done" or type == "batch") and "map" in data:
+            messageData = dict(data)
+            del messageData["map"]
+            if len(data["map"]) == 0:
+                return [ encodeMessage(type, messageData, codec) ]
+            return [ encodeMapUpdates(data["map"]), encodeMessage(type, messageData, codec) ]
+
+    return [ encodeMessage(type, data, codec) ]
+
+# One batch message of collected messages with all their map updates merged, one message is send as that message
+def batchMessageData(batchMessages):
+    if len(batchMessages) == 1:
+        return batchMessages[0]
+
+    data = { "messages": [] }
+    for messageType, messageData in batchMessages:
+        if "map" in messageData and messageType == "robot_tick_done":
+            data.setdefault("map", []).extend(messageData["map"])
+            messageData = { key: value for key, value in messageData.items() if key != "map" and key != "map_version" }
+        data["messages"].append({ "type": messageType, "data": messageData })
+    mapVersions = [ messageData["map_version"] for messageType, messageData in batchMessages if "map_version" in messageData ]
+    if len(mapVersions) > 0:
+        data["map_version"] = max(mapVersions)
+    return "batch", data
+
+def sendMessage(item, type, data = {}):
+    if recorder != None and item["websocket"] != None:
+        recorder.record(RECORD_SEND, item["websocket"], encodeMessage(type, data))
+    item["outbox"].put(type, data, encodeFrames(type, data, item["outbox"].mapEncodings, item["outbox"].codec))
+
+def broadcastMessage(type, data = {}):
+    if recorder != None:
+        recorder.record(RECORD_BROADCAST, None, encodeMessage(type, data))
+
+    # The robots that ask for batches get the messages of a concurrent tick in one batch at the end of the tick,
+    # so a tick of N robots sends them N batches and not N * N messages
+    batchRobots = tickRunning and tickPhase == TICK_PHASE_CONCURRENT
+    if batchRobots:
+        robotBatchMessages.append((type, data))
+
+    # Encode the message only once for every combination of map encodings and codec
+    framesByEncodings = {}
+    for item in connections.values():
+        if batchRobots and item.get("batch", False):
+            continue
+        encodings = (item["outbox"].mapEncodings, item["outbox"].codec)
+        if encodings not in framesByEncodings:
+            framesByEncodings[encodings] = encodeFrames(type, data, *encodings)
+        item["outbox"].put(type, data, framesByEncodings[encodings], True)
+
+# The compact map encodings of a connect message that the server knows, without them the map is send in JSON
+def negotiateMapEncodings(data):
+    return tuple(mapEncoding for mapEncoding in MAP_COMPACT_ENCODINGS if mapEncoding in data.get("map_encodings", []))
+
+# The first codec of a connect message that the server knows, without codecs the messages are send in JSON;
+# the codec is per connection, so JSON only and MessagePack peers share a room: a broadcast is encoded once
+# for every codec and every inbound message is decoded by its frame type
+def negotiateCodec(data):
+    return next((codec for codec in data.get("codecs", []) if codec in MESSAGE_CODECS), MESSAGE_CODEC_JSON)
+
+# The batch interval of a connect message, without batch the messages are send one by one
+def negotiateBatchInterval(data):
+    if not data.get("batch", False):
+        return None
+    return max(data.get("batch_interval", 0), 0)
+
+# Encode the complete map in a binary map frame with the smallest of the map encodings:
+# uint8 frame type, uint8 encoding, uint32 width, uint32 height and the encoded tiles
+# The packed encoding has four tiles in every byte starting at the lowest bits,
+# the run length encoding has a varint of (run length << 2) | tile type for every run of tiles
+def encodeMapSnapshot(mapEncodings):
+    if mapEncodings in mapSnapshots:
+        return mapSnapshots[mapEncodings]
+
+    tiles = bytes(mapGrid.tiles)
+    snapshots = []
+    if MAP_ENCODING_PACKED in mapEncodings:
+        paddedTiles = tiles + bytes(-len(tiles) % 4)
+        packed = 0
+        for i in range(4):
+            packed |= int.from_bytes(paddedTiles[i::4], "little") << (i * 2)
+        snapshots.append((MAP_ENCODING_PACKED, packed.to_bytes(len(paddedTiles) // 4, "little")))
+
+    # Every run takes at least one byte, so don't run length encode when there are more runs than packed bytes
+    changes = (int.from_bytes(tiles[1:], "little") ^ int.from_bytes(tiles[:-1], "little")).to_bytes(len(tiles) - 1, "little")
+    runCount = len(changes) - changes.count(0) + 1
+    if MAP_ENCODING_RLE in mapEncodings and (len(snapshots) == 0 or runCount < len(snapshots[0][1])):
+        encodedTiles = bytearray()
+        for run in re.finditer(rb"\x00+|\x01+|\x02+|\x03+", tiles):
+            value = (run.end() - run.start()) << 2 | tiles[run.start()]
+            while value >= 0x80:
+                encodedTiles.append((value & 0x7f) | 0x80)
+                value >>= 7
+            encodedTiles.append(value)
+        snapshots.append((MAP_ENCODING_RLE, encodedTiles))
+
+    mapEncoding, encodedTiles = min(snapshots, key=lambda snapshot: len(snapshot[1]))
+    mapSnapshots[mapEncodings] = struct.pack("<BBII", MAP_FRAME_SNAPSHOT, mapEncoding, mapWidth, mapHeight) + encodedTiles
+    return mapSnapshots[mapEncodings]
+
+# Encode map updates in a binary map frame:
+# uint8 frame type, uint32 update count and a uint32 of (tile index << 2) | tile type for every update
+def encodeMapUpdates(mapUpdates):
+    return struct.pack("<BI%dI" % len(mapUpdates), MAP_FRAME_UPDATES, len(mapUpdates),
+        *((mapUpdate["y"] * mapWidth + mapUpdate["x"]) << 2 | mapUpdate["type"] for mapUpdate in mapUpdates))
+
+# Merge two robot tick done messages of the same robot
+def mergeTickDoneData(data, newData):
+    mergedData = { "robot_id": newData["robot_id"] }
+    if "robot" in newData:
+        mergedData["robot"] = newData["robot"]
+    elif "robot" in data:
+        mergedData["robot"] = data["robot"]
+    if "map" in data or "map" in newData:
+        mergedData["map"] = data.get("map", []) + newData.get("map", [])
+    if "map_version" in data or "map_version" in newData:
+        mergedData["map_version"] = max(data.get("map_version", 0), newData.get("map_version", 0))
+    return mergedData
+
+def robotData(robot):
+    return {
+        "x": robot["x"],
+        "y": robot["y"],
+        "lift": robot["lift"],
+        "color": robot["color"],
+        "directions": robot["directions"]
+    }
+
+# The world info with the complete map or only the map changes since a map version
+def worldInfoData(mapChangesData = None):
     programsData = []
     for program in programs:
         programsData.append({ "id": program["id"], "name": program["name"] })
-    await sendMessage(item, "world_info", {
+
+    mapInfoData = { "id": mapId, "version": mapVersion, "width": mapWidth, "height": mapHeight }
+    if mapChangesData != None:
+        mapInfoData["changes"] = mapChangesData
+    else:
+        mapInfoData["data"] = mapGrid.rows()
+
+    return {
         "tick": {
             "type": tickType,
-            "speed": tickSpeed
+            "speed": tickSpeed,
+            "phase": tickPhase,
+            "overrun": tickOverrun
         },
         "active_program_id": activeProgram["id"],
         "programs": programsData,
-        "map": {
-            "width": mapWidth,
-            "height": mapHeight,
-            "data": mapData
+        "map": mapInfoData
+    }
+
+# Change a tile of the map and keep the change in the change log
+def setMapTile(x, y, type):
+    global mapVersion
+
+    mapGrid.tiles[y * mapWidth + x] = type
+    mapVersion += 1
+    journal([ JOURNAL_TILE, x, y, type ])
+    mapChanges.append({ "x": x, "y": y, "type": type })
+    mapSnapshots.clear()
+
+    # A new chest can surround the unkown tiles next to it
+    removedTiles = [ (x, y) ]
+    if type == TILE_CHEST:
+        for neighbor in getTileNeighbors({ "x": x, "y": y }):
+            if isTileSurrounded(neighbor["x"], neighbor["y"]):
+                removedTiles.append((neighbor["x"], neighbor["y"]))
+    unkownTiles.difference_update(removedTiles)
+    if type == TILE_CHEST and componentLabels != None:
+        removeComponentTile(x, y)
+
+    for shard in shards:
+        if shard["haloStart"] <= y < shard["haloEnd"]:
+            shard["updates"].append((x, y, type, removedTiles))
+            if len(shard["updates"]) > SHARD_UPDATES_LIMIT:
+                shard["connection"].send(("updates", shard["updates"]))
+                shard["updates"] = []
+
+# Index all the unkown tiles of a new map that are not surrounded by chests
+def createUnkownTiles():
+    surrounded = mapGrid.surroundedMask()
+    unkownTiles.clear()
+    unkownTiles.update((index % mapWidth, index // mapWidth) for index in Grid.maskIndexes(mapGrid.mask(TILE_UNKOWN)) if surrounded[index] == 0)
+
+# Give every tile of a component its label with a breadth first search from a tile
+def labelComponent(x, y, label):
+    tiles = [ (x, y) ]
+    componentLabels[y][x] = label
+    componentPositions[y][x] = 0
+    frontier = collections.deque(tiles)
+    while len(frontier) > 0:
+        x, y = frontier.popleft()
+        for neighborX, neighborY in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+            if neighborX < 0 or neighborY < 0 or neighborX >= mapWidth or neighborY >= mapHeight:
+                continue
+            if mapGrid.tiles[neighborY * mapWidth + neighborX] == TILE_CHEST or componentLabels[neighborY][neighborX] == label:
+                continue
+            componentLabels[neighborY][neighborX] = label
+            componentPositions[neighborY][neighborX] = len(tiles)
+            tiles.append((neighborX, neighborY))
+            frontier.append((neighborX, neighborY))
+    componentTiles[label] = tiles
+
+# Forget the components of the previous map, they are labeled again when they are needed
+def clearComponents():
+    global componentLabels
+
+    componentLabels = None
+
+# Label all the components of the map
+def createComponents():
+    global componentLabels, componentPositions, nextComponentLabel, chestParents
+
+    componentLabels = [[None] * mapWidth for i in range(mapHeight)]
+    componentPositions = [[None] * mapWidth for i in range(mapHeight)]
+    componentTiles.clear()
+    nextComponentLabel = 0
+    for y in range(mapHeight):
+        for x in range(mapWidth):
+            if mapGrid.tiles[y * mapWidth + x] != TILE_CHEST and componentLabels[y][x] == None:
+                labelComponent(x, y, nextComponentLabel)
+                nextComponentLabel += 1
+
+    chestParents = list(range(mapWidth * mapHeight + 1))
+    for index in Grid.maskIndexes(mapGrid.mask(TILE_CHEST)):
+        x, y = index % mapWidth, index // mapWidth
+        joinChestSets(x, y, [ chestSetAt(ringX, ringY) for ringX, ringY in tileRing(x, y) ])
+
+# The eight tiles around a tile in clockwise order starting above it, the even tiles are the neighbors
+def tileRing(x, y):
+    return ((x, y - 1), (x + 1, y - 1), (x + 1, y), (x + 1, y + 1), (x, y + 1), (x - 1, y + 1), (x - 1, y), (x - 1, y - 1))
+
+# The root of a chest set with path halving
+def findChestSet(index):
+    while chestParents[index] != index:
+        chestParents[index] = chestParents[chestParents[index]]
+        index = chestParents[index]
+    return index
+
+# The chest set of a tile, all tiles outside the map are in the outside set and tiles that are not chests in no set
+def chestSetAt(x, y):
+    if x < 0 or y < 0 or x >= mapWidth or y >= mapHeight:
+        return findChestSet(mapWidth * mapHeight)
+    if mapGrid.tiles[y * mapWidth + x] == TILE_CHEST:
+        return findChestSet(y * mapWidth + x)
+    return None
+
+# Join a chest with the chest sets around it, the outside set stays the root
+def joinChestSets(x, y, chestSets):
+    root = findChestSet(y * mapWidth + x)
+    for chestSet in chestSets:
+        if chestSet == None:
+            continue
+        chestSet = findChestSet(chestSet)
+        if chestSet == root:
+            continue
+        if chestSet == mapWidth * mapHeight:
+            chestParents[root] = chestSet
+            root = chestSet
+        else:
+            chestParents[chestSet] = root
+
+# Remove a tile from the tile list of its component
+def popComponentTile(x, y):
+    tiles = componentTiles[componentLabels[y][x]]
+    lastX, lastY = tiles[-1]
+    tiles[componentPositions[y][x]] = (lastX, lastY)
+    componentPositions[lastY][lastX] = componentPositions[y][x]
+    tiles.pop()
+    componentLabels[y][x] = None
+    componentPositions[y][x] = None
+
+# Remove a new chest from its component and split the component when the chest closes a ring of chests,
+# the free neighbors of the chest are grouped in arcs around it, two arcs are only separated when the chests
+# on both sides between them are already in the same chest set
+def removeComponentTile(x, y):
+    global nextComponentLabel
+
+    label = componentLabels[y][x]
+    popComponentTile(x, y)
+    if len(componentTiles[label]) == 0:
+        del componentTiles[label]
+
+    ring = tileRing(x, y)
+    chestSets = [ chestSetAt(ringX, ringY) for ringX, ringY in ring ]
+    if None not in chestSets or chestSets.count(None) == 8:
+        joinChestSets(x, y, chestSets)
+        return
+
+    # The arcs with their neighbors and the chest sets of the walls before every arc, a free corner without neighbors is part of the wall
+    start = chestSets.index(next(chestSet for chestSet in chestSets if chestSet != None))
+    arcs = []
+    walls = [ set() ]
+    arc = None
+    for i in range(start, start + 8):
+        if chestSets[i % 8] != None:
+            if arc != None and len(arc) > 0:
+                arcs.append(arc)
+                walls.append(set())
+            arc = None
+            walls[-1].add(chestSets[i % 8])
+        else:
+            if arc == None:
+                arc = []
+            if i % 2 == 0:
+                arc.append(ring[i % 8])
+    if arc != None and len(arc) > 0:
+        arcs.append(arc)
+    elif len(walls) > 1:
+        walls[0] |= walls.pop()
+
+    groups = []
+    for i in range(len(arcs)):
+        for group in groups:
+            inner = set().union(*walls[group[0] + 1:i + 1])
+            outer = set().union(*walls[:group[0] + 1], *walls[i + 1:])
+            if inner.isdisjoint(outer):
+                group.append(i)
+                break
+        else:
+            groups.append([ i ])
+    joinChestSets(x, y, chestSets)
+    if len(groups) <= 1:
+        return
+
+    # Search all parts at the same time until one part is left, so only the smaller parts are visited and get a new label
+    searches = []
+    for group in groups:
+        seeds = [ tile for i in group for tile in arcs[i] ]
+        searches.append((set(seeds), collections.deque(seeds)))
+    active = list(range(len(searches)))
+    while len(active) > 1:
+        for i in list(active):
+            visited, frontier = searches[i]
+            if len(frontier) == 0:
+                active.remove(i)
+                continue
+            currentX, currentY = frontier.popleft()
+            for neighborX, neighborY in ((currentX - 1, currentY), (currentX, currentY - 1), (currentX + 1, currentY), (currentX, currentY + 1)):
+                if neighborX < 0 or neighborY < 0 or neighborX >= mapWidth or neighborY >= mapHeight:
+                    continue
+                if mapGrid.tiles[neighborY * mapWidth + neighborX] == TILE_CHEST or (neighborX, neighborY) in visited:
+                    continue
+                visited.add((neighborX, neighborY))
+                frontier.append((neighborX, neighborY))
+
+    if len(active) == 1:
+        keep = active[0]
+    else:
+        keep = max(range(len(searches)), key=lambda i: len(searches[i][0]))
+    for i, (visited, frontier) in enumerate(searches):
+        if i == keep:
+            continue
+        tiles = []
+        for tileX, tileY in visited:
+            popComponentTile(tileX, tileY)
+            componentLabels[tileY][tileX] = nextComponentLabel
+            componentPositions[tileY][tileX] = len(tiles)
+            tiles.append((tileX, tileY))
+        componentTiles[nextComponentLabel] = tiles
+        nextComponentLabel += 1
+    if len(componentTiles[label]) == 0:
+        del componentTiles[label]
+
+# A random tile that can be reached from a tile in constant time, none when there is no other tile in its component;
+# a tile without component like a chest that a robot reports as its position uses the component of a neighbor
+def randomReachableTile(x, y):
+    if componentLabels == None:
+        createComponents()
+    label = componentLabels[y][x]
+    for neighbor in getTileNeighbors({ "x": x, "y": y }):
+        if label != None:
+            break
+        label = componentLabels[neighbor["y"]][neighbor["x"]]
+    if label == None:
+        return None
+    tiles = componentTiles[label]
+    if len(tiles) <= 1:
+        return None
+    while True:
+        tile = random.choice(tiles)
+        if tile != (x, y):
+            return tile
+
+# The map changes since a map version of a connect message, none when the map is another map,
+# when the version is not in the change log anymore or when the complete map is smaller
+def mapChangesSince(data):
+    if data.get("map_id") != mapId or "map_version" not in data:
+        return None
+    changeCount = mapVersion - data["map_version"]
+    if changeCount < 0 or changeCount > len(mapChanges) or changeCount > mapWidth * mapHeight // 16:
+        return None
+    return list(itertools.islice(mapChanges, len(mapChanges) - changeCount, None))
+
+async def sendWorldMessage(item, data = {}):
+    # Wait until Webots supervisor is connected and given map data
+    if mapGrid == None:
+        log("Waiting for supervisor...")
+        await mapReady.wait()
+
+    # A reconnecting connection only gets the map changes since its map version
+    sendMessage(item, "world_info", worldInfoData(mapChangesSince(data)))
+
+# The messages that bring a connection back to the current state of the world
+def snapshotMessages():
+    messages = []
+    if mapGrid != None:
+        messages.append(("world_info", worldInfoData()))
+    for robot in robots.values():
+        if robot["websocket"] != None:
+            messages.append(("robot_connect", { "robot_id": robot["id"], "robot": robotData(robot) }))
+    for website in websites.values():
+        messages.append(("website_connect", { "website_id": website["id"] }))
+    for supervisor in supervisors.values():
+        messages.append(("supervisor_connect", { "supervisor_id": supervisor["id"] }))
+    return messages
+
+# Create a new robot, robots without a preset get a color and lift based on there id
+def createRobot(robotId):
+    preset = robotPresets.get(robotId)
+    if preset == None:
+        red, green, blue = colorsys.hsv_to_rgb((robotId * 0.618034) % 1, 0.75, 1)
+        preset = {
+            "lift": [ 200, 300, 500, 250 ][robotId % 4],
+            "color": { "red": round(red, 2), "green": round(green, 2), "blue": round(blue, 2) }
         }
-    })
+
+    robot = {
+        "id": robotId,
+        "x": None,
+        "y": None,
+        "lift": preset["lift"],
+        "color": preset["color"],
+        "directions": [],
+        "batch": False,
+        "websocket": None,
+        "outbox": None,
+        "traceId": None,
+        "traceStart": None
+    }
+    robots[robotId] = robot
+    return robot
+
+# Bit reverse an index, this gives an order that evenly spreads any amount of robots
+def bitReverse(index, bits):
+    reversedIndex = 0
+    for i in range(bits):
+        reversedIndex = (reversedIndex << 1) | ((index >> i) & 1)
+    return reversedIndex
+
+# The tiles of the map border are always free, order them for the spawn strategy
+def createSpawnTiles():
+    global spawnTiles, spawnIndex
+
+    borderTiles = [(x, 0) for x in range(mapWidth)]
+    borderTiles += [(mapWidth - 1, y) for y in range(1, mapHeight)]
+    borderTiles += [(x, mapHeight - 1) for x in range(mapWidth - 2, -1, -1)]
+    borderTiles += [(0, y) for y in range(mapHeight - 2, 0, -1)]
+
+    if SPAWN_STRATEGY == SPAWN_RANDOM:
+        random.shuffle(borderTiles)
+    else:
+        bits = max(len(borderTiles) - 1, 1).bit_length()
+        borderTiles = [borderTiles[i] for i in sorted(range(len(borderTiles)), key=lambda i: bitReverse(i, bits))]
+
+    # The corners strategy starts with the corners in the order of the first four robots,
+    # other robots are spread over the rest of the border
+    spawnIndex = 0
+    if SPAWN_STRATEGY == SPAWN_CORNERS:
+        corners = [(0, 0), (mapWidth - 1, 0), (0, mapHeight - 1), (mapWidth - 1, mapHeight - 1)]
+        borderTiles = corners + [tile for tile in borderTiles if tile not in corners]
+        spawnIndex = 4
+    spawnTiles = borderTiles
+
+# Place a robot on the next free spawn tile, returns false when there are no free tiles
+def placeRobot(robot):
+    global spawnIndex
+
+    occupiedTiles = set((otherRobot["x"], otherRobot["y"]) for otherRobot in robots.values() if otherRobot["x"] != None)
+
+    # The first four robots get there own corner when it is free
+    if SPAWN_STRATEGY == SPAWN_CORNERS and robot["id"] >= 1 and robot["id"] <= 4 and spawnTiles[robot["id"] - 1] not in occupiedTiles:
+        x, y = spawnTiles[robot["id"] - 1]
+    else:
+        for i in range(len(spawnTiles)):
+            x, y = spawnTiles[(spawnIndex + i) % len(spawnTiles)]
+            if (x, y) not in occupiedTiles:
+                spawnIndex = (spawnIndex + i + 1) % len(spawnTiles)
+                break
+        else:
+            log("No free tile for Robot " + str(robot["id"]))
+            return False
+
+    robot["x"] = x
+    robot["y"] = y
+    journalRobot(robot)
+    return True
 
 # Get all the neigbors of a point
 def getTileNeighbors(point):
@@ -109,77 +1131,268 @@ def getTileNeighbors(point):
         neighbors.append({ "x": point["x"], "y": point["y"] + 1 })
     return neighbors
 
+# Check if a tile is surrounded by chests on all four sides
+def isTileSurrounded(x, y):
+    return (
+        (x > 0 and mapGrid.tiles[y * mapWidth + x - 1] == TILE_CHEST) and
+        (y > 0 and mapGrid.tiles[(y - 1) * mapWidth + x] == TILE_CHEST) and
+        (x < mapWidth - 1 and mapGrid.tiles[y * mapWidth + x + 1] == TILE_CHEST) and
+        (y < mapHeight - 1 and mapGrid.tiles[(y + 1) * mapWidth + x] == TILE_CHEST)
+    )
+
+# The distances from every source robot to its closest discover candidates unkown tiles in one multi source breadth first search,
+# every source has its own distance field so the distance of a robot to the candidates of the other robots is known when it is reached;
+# the grid can be the rows of a shard which start at the row offset
+def discoverDistanceFields(sourceRobots, blockedTiles, grid, discoverTiles, rowOffset = 0):
+    distanceFields = [ { (robot["x"], robot["y"]): 0 } for robot in sourceRobots ]
+    candidates = [ [] for robot in sourceRobots ]
+    frontier = collections.deque((i, robot["x"], robot["y"]) for i, robot in enumerate(sourceRobots))
+    while len(frontier) > 0:
+        i, x, y = frontier.popleft()
+        if len(candidates[i]) >= DISCOVER_CANDIDATES:
+            continue
+
+        distance = distanceFields[i][(x, y)]
+        if (x, y) in discoverTiles and (x, y) not in blockedTiles:
+            candidates[i].append((x, y))
+
+        for neighborX, neighborY in ((x - 1, y), (x, y - 1), (x + 1, y), (x, y + 1)):
+            if neighborX < 0 or neighborY < rowOffset or neighborX >= grid.width or neighborY >= rowOffset + grid.height:
+                continue
+            if grid.tiles[(neighborY - rowOffset) * grid.width + neighborX] == TILE_CHEST or (neighborX, neighborY) in distanceFields[i]:
+                continue
+            distanceFields[i][(neighborX, neighborY)] = distance + 1
+            frontier.append((i, neighborX, neighborY))
+    return distanceFields, candidates
+
+# Shard worker process, it keeps the rows of its shard with the halo and the unkown tiles index of those rows
+# and searches the discover candidates of the robots on its rows, a search gives the candidates of every robot
+# and the distances of every robot to all candidates of the shard; the worker stops when the server is gone
+def shardWorker(connection, width, height, tiles, rowOffset, discoverTiles):
+    grid = Grid(width, height)
+    grid.tiles[:] = tiles
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message == None:
+            break
+
+        for x, y, type, removedTiles in message[1]:
+            grid.tiles[(y - rowOffset) * grid.width + x] = type
+            discoverTiles.difference_update(removedTiles)
+
+        # Without unkown tiles on its rows all robots of the shard are searched over the complete map
+        if message[0] == "search" and len(discoverTiles) == 0:
+            connection.send([ ([], {}) for robot in message[2] ])
+        elif message[0] == "search":
+            sourceRobots, blockedTiles = message[2], message[3]
+            distanceFields, candidates = discoverDistanceFields(sourceRobots, blockedTiles, grid, discoverTiles, rowOffset)
+            candidateTiles = { tile for robotCandidates in candidates for tile in robotCandidates }
+            connection.send([ (candidates[i], { tile: distanceFields[i][tile] for tile in candidateTiles if tile in distanceFields[i] })
+                for i in range(len(sourceRobots)) ])
+
+# Start the shard worker processes of a new map, every shard gets a copy of its rows with the halo
+# The workers are spawned as new processes, a forked child of the running server could hang on a lock that
+# a thread of the event loop held while forking; the module that starts the server must guard its main code
+def createShards():
+    stopShards()
+
+    # With one CPU the workers can't search at the same time, so they would only add the pipes to every search
+    if mapWidth * mapHeight < SHARD_MIN_TILES or (os.cpu_count() or 1) < 2:
+        return
+
+    # Every row belongs to one shard, a map with less rows than shards gets a shard per row
+    shardCount = min(SHARD_COUNT, mapHeight)
+    for i in range(shardCount):
+        rowStart = (i * mapHeight + shardCount - 1) // shardCount
+        rowEnd = ((i + 1) * mapHeight + shardCount - 1) // shardCount
+        haloStart = max(rowStart - SHARD_HALO, 0)
+        haloEnd = min(rowEnd + SHARD_HALO, mapHeight)
+        tiles = bytes(mapGrid.tiles[haloStart * mapWidth:haloEnd * mapWidth])
+        discoverTiles = { (x, y) for x, y in unkownTiles if haloStart <= y < haloEnd }
+
+        connection, workerConnection = multiprocessing.Pipe()
+        process = multiprocessing.get_context("spawn").Process(target=shardWorker,
+            args=(workerConnection, mapWidth, haloEnd - haloStart, tiles, haloStart, discoverTiles), daemon=True)
+        process.start()
+        workerConnection.close()
+        shards.append({ "id": i, "rowStart": rowStart, "rowEnd": rowEnd, "haloStart": haloStart, "haloEnd": haloEnd,
+            "process": process, "connection": connection, "updates": [] })
+        log("Shard " + str(i) + " owns the rows " + str(rowStart) + " to " + str(rowEnd))
+
+def stopShards():
+    for shard in shards:
+        shard["connection"].send(None)
+        shard["process"].join()
+        shard["connection"].close()
+    shards.clear()
+
+# The shard that owns a row
+def shardOfRow(y):
+    for shard in shards:
+        if shard["rowStart"] <= y < shard["rowEnd"]:
+            return shard
+    raise ValueError("Row " + str(y) + " has no shard")
+
+# Search the discover candidates of the robots in the shards of their rows at the same time, a robot without candidates
+# in the rows of its shard is searched over the complete map; the distance to the candidates of other shards stays unkown
+async def shardDistanceFields(sourceRobots, blockedTiles):
+    # A shard without unkown tiles on its rows and halo has no candidates, so its robots are not send to it
+    searchedShardIds = { shard["id"] for shard in shards
+        if mapGrid.tiles.find(bytes([ TILE_UNKOWN ]), shard["haloStart"] * mapWidth, shard["haloEnd"] * mapWidth) != -1 }
+    shardSources = {}
+    for i, robot in enumerate(sourceRobots):
+        shard = shardOfRow(robot["y"])
+        if shard["id"] in searchedShardIds:
+            shardSources.setdefault(shard["id"], []).append(i)
+
+    loop = asyncio.get_running_loop()
+    searches = []
+    for shardId, indexes in shardSources.items():
+        shard = shards[shardId]
+        shard["connection"].send(("search", shard["updates"],
+            [ { "x": sourceRobots[i]["x"], "y": sourceRobots[i]["y"] } for i in indexes ],
+            { tile for tile in blockedTiles if shard["haloStart"] <= tile[1] < shard["haloEnd"] }))
+        shard["updates"] = []
+        searches.append(loop.run_in_executor(None, shard["connection"].recv))
+    results = await asyncio.gather(*searches)
+
+    distanceFields = [ None ] * len(sourceRobots)
+    candidates = [ [] for robot in sourceRobots ]
+    for indexes, result in zip(shardSources.values(), results):
+        for i, (robotCandidates, distanceField) in zip(indexes, result):
+            candidates[i] = robotCandidates
+            distanceFields[i] = distanceField
+
+    otherIndexes = [ i for i in range(len(sourceRobots)) if len(candidates[i]) == 0 ]
+    if len(otherIndexes) > 0:
+        otherDistanceFields, otherCandidates = discoverDistanceFields([ sourceRobots[i] for i in otherIndexes ], blockedTiles, mapGrid, unkownTiles)
+        for i, distanceField, robotCandidates in zip(otherIndexes, otherDistanceFields, otherCandidates):
+            candidates[i] = robotCandidates
+            distanceFields[i] = { tile: distanceField[tile] for tile in robotCandidates }
+    return distanceFields, candidates
+
+# Hungarian algorithm which gives every row a different column with the lowest total cost, there are at least as many columns as rows
+def minimumCostAssignment(costs):
+    rowCount = len(costs)
+    columnCount = len(costs[0])
+    rowPotentials = [0] * (rowCount + 1)
+    columnPotentials = [0] * (columnCount + 1)
+    columnRows = [0] * (columnCount + 1)
+    for row in range(1, rowCount + 1):
+        columnRows[0] = row
+        column = 0
+        minimums = [float("inf")] * (columnCount + 1)
+        previousColumns = [0] * (columnCount + 1)
+        used = [False] * (columnCount + 1)
+        while True:
+            used[column] = True
+            currentRow = columnRows[column]
+            delta = float("inf")
+            nextColumn = 0
+            for otherColumn in range(1, columnCount + 1):
+                if not used[otherColumn]:
+                    cost = costs[currentRow - 1][otherColumn - 1] - rowPotentials[currentRow] - columnPotentials[otherColumn]
+                    if cost < minimums[otherColumn]:
+                        minimums[otherColumn] = cost
+                        previousColumns[otherColumn] = column
+                    if minimums[otherColumn] < delta:
+                        delta = minimums[otherColumn]
+                        nextColumn = otherColumn
+            for otherColumn in range(columnCount + 1):
+                if used[otherColumn]:
+                    rowPotentials[columnRows[otherColumn]] += delta
+                    columnPotentials[otherColumn] -= delta
+                else:
+                    minimums[otherColumn] -= delta
+            column = nextColumn
+            if columnRows[column] == 0:
+                break
+        while column != 0:
+            previousColumn = previousColumns[column]
+            columnRows[column] = columnRows[previousColumn]
+            column = previousColumn
+
+    rowColumns = [None] * rowCount
+    for column in range(1, columnCount + 1):
+        if columnRows[column] != 0:
+            rowColumns[columnRows[column] - 1] = column - 1
+    return rowColumns
+
 # Discover program
 async def discoverProgram():
-    # Get list off all unkown tiles that are not arounded with chests
-    unkownTiles = []
-    unkownMap = [[False] * mapWidth for i in range(mapHeight)]
-    for y in range(mapHeight):
-        for x in range(mapWidth):
-            if mapData[y][x] == TILE_UNKOWN and not (
-                (x > 0 and mapData[y][x - 1] == TILE_CHEST) and
-                (y > 0 and mapData[y - 1][x] == TILE_CHEST) and
-                (x < mapWidth - 1 and mapData[y][x + 1] == TILE_CHEST) and
-                (y < mapHeight - 1 and mapData[y + 1][x] == TILE_CHEST)
-            ):
-                unkownTiles.append({ "x": x, "y": y })
-                unkownMap[y][x] = True
+    # The unkown tiles index has all unkown tiles that are not arounded with chests
     if len(unkownTiles) == 0:
         return
+    idleRobots = [ robot for robot in robots.values() if robot["websocket"] != None and len(robot["directions"]) == 0 ]
+    if len(idleRobots) == 0:
+        return
 
-    for robot in robots:
-        if robot["websocket"] != None and len(robot["directions"]) == 0 and len(unkownTiles) > 0:
-            # A even simpeler version off the path finding
-            # algorithm to search for finding the closesd unkown tile
-            frontier = [ { "x": robot["x"], "y": robot["y"] } ]
-            cameFrom =  [[None] * mapWidth for i in range(mapHeight)]
-
-            while len(frontier) > 0:
-                current = frontier[0]
-                del frontier[0]
-
-                if unkownMap[current["y"]][current["x"]]:
-                    # Drive robot to closest unkown tile and broadcast new direction
-                    direction = {
-                        "id": round(time.time() * 1000),
-                        "x": current["x"],
-                        "y": current["y"]
-                    }
-                    robot["directions"].append(direction)
-                    await broadcastMessage("new_direction", {
-                        "robot_id": robot["id"],
-                        "direction": direction
-                    })
+    # The destinations of the other robots are already discovered by those robots
+    blockedTiles = set()
+    for robot in robots.values():
+        for direction in robot["directions"]:
+            blockedTiles.add((direction["x"], direction["y"]))
+
+    if len(shards) > 0:
+        distanceFields, candidates = await shardDistanceFields(idleRobots, blockedTiles)
+    else:
+        distanceFields, candidates = discoverDistanceFields(idleRobots, blockedTiles, mapGrid, unkownTiles)
+    candidateTiles = list(dict.fromkeys(tile for robotCandidates in candidates for tile in robotCandidates))
+    if len(candidateTiles) == 0:
+        return
 
-                    # Remove tile from list
-                    unkownTiles = [unkownTile for unkownTile in unkownTiles if not (unkownTile["x"] == current["x"] and unkownTile["y"] == current["y"])]
-                    unkownMap[current["y"]][current["x"]] = False
+    # A candidate that is not reached by a robot is at least further away than its own candidates
+    costs = []
+    for i, robot in enumerate(idleRobots):
+        maxDistance = max((distanceFields[i][tile] for tile in candidates[i]), default=0)
+        costs.append([ distanceFields[i].get(tile, max(maxDistance + 1, abs(tile[0] - robot["x"]) + abs(tile[1] - robot["y"]))) for tile in candidateTiles ])
+
+    # Give the robots their tiles, the matching needs at least as many candidates as robots
+    assignments = [ None ] * len(idleRobots)
+    if DISCOVER_ASSIGNMENT == DISCOVER_MATCHING and len(idleRobots) <= min(DISCOVER_MATCHING_LIMIT, len(candidateTiles)):
+        assignments = minimumCostAssignment(costs)
+    else:
+        claimedTiles = set()
+        order = range(len(idleRobots))
+        if DISCOVER_ASSIGNMENT == DISCOVER_MATCHING:
+            order = sorted(order, key=lambda i: min(costs[i]))
+        for i in order:
+            for j in sorted(range(len(candidateTiles)), key=lambda j: costs[i][j]):
+                if candidateTiles[j] not in claimedTiles and candidateTiles[j] in distanceFields[i]:
+                    assignments[i] = j
+                    claimedTiles.add(candidateTiles[j])
                     break
 
-                neighbors = getTileNeighbors(current)
-                random.shuffle(neighbors)
-                for neighbor in neighbors:
-                    tileType = mapData[neighbor["y"]][neighbor["x"]]
-                    if not (tileType == TILE_FLOOR or tileType == TILE_UNKOWN):
-                        continue
-
-                    if cameFrom[neighbor["y"]][neighbor["x"]] == None:
-                        frontier.append(neighbor)
-                        cameFrom[neighbor["y"]][neighbor["x"]] = current
+    for i, robot in enumerate(idleRobots):
+        if assignments[i] == None:
+            continue
 
+        # Drive robot to the given unkown tile and broadcast new direction
+        x, y = candidateTiles[assignments[i]]
+        direction = {
+            "id": round(time.time() * 1000),
+            "x": x,
+            "y": y
+        }
+        robot["directions"].append(direction)
+        journalRobot(robot)
+        broadcastMessage("new_direction", {
+            "robot_id": robot["id"],
+            "direction": direction
+        })
 
 # Random directions program
 async def randomDirectionsProgram():
-    for robot in robots:
+    for robot in robots.values():
         if robot["websocket"] != None and len(robot["directions"]) == 0:
-            # Drive robot to a random floor tile
-            x = None
-            y = None
-            while True:
-                x = random.randint(0, mapWidth - 1)
-                y = random.randint(0, mapHeight - 1)
-                if mapData[y][x] != TILE_CHEST:
-                    break
+            # Drive robot to a random tile that it can reach
+            tile = randomReachableTile(robot["x"], robot["y"])
+            if tile == None:
+                continue
+            x, y = tile
 
             # Broadcast new direction
             direction = {
@@ -188,7 +1401,8 @@ async def randomDirectionsProgram():
                 "y": y
             }
             robot["directions"].append(direction)
-            await broadcastMessage("new_direction", {
+            journalRobot(robot)
+            broadcastMessage("new_direction", {
                 "robot_id": robot["id"],
                 "direction": direction
             })
@@ -201,340 +1415,1103 @@ programs = [
 ]
 activeProgram = next((program for program in programs if program["id"] == 2), None)
 
-# Start a tick cycle
+# Start a tick cycle, the tick idle event is set when there is no tick running
 tickRunning = False
+tickIdle = asyncio.Event()
+tickIdle.set()
+tickRobots = []
 currentRobotIndex = None
+tickPendingRobots = set()
+reservations = {}
+robotBatchMessages = []
 async def tick():
-    global tickRunning, currentRobotIndex
+    global tickRunning, tickStartTime, tickRobots, currentRobotIndex, reservations
 
     # Wait until previous tick is done
     while tickRunning:
         log("Waiting for tick to be done...")
-        await asyncio.sleep(100 / 1000)
+        await tickIdle.wait()
     tickRunning = True
-
-    # Run active program
-    if activeProgram["function"] != None:
-        await activeProgram["function"]()
-
-    # Tick first robot in the robot_tick_done will the next robot be ticked
-    currentRobotIndex = 0
-    while currentRobotIndex < len(robots) and robots[currentRobotIndex]["websocket"] == None:
+    tickStartTime = time.perf_counter()
+    tickIdle.clear()
+
+    # A failing program or robot tick must not leave the tick running, every later tick would wait for it forever
+    robotsTicked = False
+    try:
+        # Run active program
+        if activeProgram["function"] != None:
+            await activeProgram["function"]()
+
+        # Tick all connected robots at once, moves are committed against the reservation table
+        if tickPhase == TICK_PHASE_CONCURRENT:
+            currentRobotIndex = None
+            reservations = {}
+            for robot in robots.values():
+                if robot["websocket"] != None:
+                    reservations[(robot["x"], robot["y"])] = robot["id"]
+                    tickPendingRobots.add(robot["id"])
+
+            # Without connected robots the tick is done right away
+            if len(tickPendingRobots) == 0:
+                return
+
+            log("Tick for Robots " + ", ".join(str(robotId) for robotId in tickPendingRobots))
+            for robotId in tickPendingRobots:
+                messageData = robotTickData(robots[robotId])
+                framesByCodec = { codec: [ encodeMessage("robot_tick", messageData, codec) ] for codec in MESSAGE_CODECS }
+                if recorder != None:
+                    recorder.record(RECORD_BROADCAST, None, framesByCodec[MESSAGE_CODEC_JSON][0])
+                robots[robotId]["outbox"].put("robot_tick", messageData, framesByCodec[robots[robotId]["outbox"].codec])
+                for website in websites.values():
+                    website["outbox"].put("robot_tick", messageData, framesByCodec[website["outbox"].codec], True)
+                for supervisor in supervisors.values():
+                    supervisor["outbox"].put("robot_tick", messageData, framesByCodec[supervisor["outbox"].codec], True)
+            robotsTicked = True
+            return
+
+        # Tick first robot in the robot_tick_done will the next robot be ticked
+        tickRobots = list(robots.values())
+        currentRobotIndex = 0
+        serialRobotTick()
+        robotsTicked = True
+    finally:
+        if not robotsTicked:
+            tickPendingRobots.clear()
+            currentRobotIndex = None
+            tickDone()
+
+# Tick the next connected robot of a serial tick or stop the tick when all robots are ticked
+def serialRobotTick():
+    global currentRobotIndex
+
+    while currentRobotIndex < len(tickRobots) and tickRobots[currentRobotIndex]["websocket"] == None:
         currentRobotIndex += 1
-    if currentRobotIndex < len(robots):
-        log("Tick for Robot " + str(robots[currentRobotIndex]["id"]))
-        await broadcastMessage("robot_tick", { "robot_id": robots[currentRobotIndex]["id"] })
+    if currentRobotIndex < len(tickRobots):
+        log("Tick for Robot " + str(tickRobots[currentRobotIndex]["id"]))
+        broadcastMessage("robot_tick", robotTickData(tickRobots[currentRobotIndex]))
         currentRobotIndex += 1
+    else:
+        currentRobotIndex = None
+        tickDone()
+
+# The robot of the running serial tick that is ticked and not done yet
+def serialTickRobot():
+    if currentRobotIndex == None or currentRobotIndex == 0:
+        return None
+    return tickRobots[currentRobotIndex - 1]
+
+# Try to move a robot in a concurrent tick, the move is rejected when the tile is reserved by another robot
+def reserveRobotMove(robot, x, y):
+    reservedRobotId = reservations.get((x, y))
+    if reservedRobotId != None and reservedRobotId != robot["id"]:
+        log("Move of Robot " + str(robot["id"]) + " rejected tile is reserved by Robot " + str(reservedRobotId))
+        return False
+
+    if reservations.get((robot["x"], robot["y"])) == robot["id"]:
+        del reservations[(robot["x"], robot["y"])]
+    reservations[(x, y)] = robot["id"]
+    robot["x"] = x
+    robot["y"] = y
+    journalRobot(robot)
+    return True
+
+# Mark a robot in a concurrent tick as done
+def concurrentRobotTickDone(robot):
+    tickPendingRobots.discard(robot["id"])
+    if len(tickPendingRobots) == 0:
+        tickDone()
+
+# Stop the running tick and wake up the waiting tick
+def tickDone():
+    global tickRunning, tickStartTime
+
+    tickRunning = False
+    tickIdle.set()
+    if tickStartTime != None:
+        observeDuration(tickDurations, time.perf_counter() - tickStartTime)
+        tickStartTime = None
+
+    # Send the batches of the connections that get one batch every tick
+    for item in connections.values():
+        if item["outbox"].batchInterval == 0:
+            item["outbox"].flush()
+
+    # Send the batch of the tick to the robots that ask for batches, it is encoded once for every combination
+    # of map encodings and codec
+    if len(robotBatchMessages) > 0:
+        type, data = batchMessageData(robotBatchMessages)
+        robotBatchMessages.clear()
+        framesByEncodings = {}
+        for robot in robots.values():
+            if robot["websocket"] != None and robot["batch"]:
+                encodings = (robot["outbox"].mapEncodings, robot["outbox"].codec)
+                if encodings not in framesByEncodings:
+                    framesByEncodings[encodings] = encodeFrames(type, data, *encodings)
+                robot["outbox"].put(type, data, framesByEncodings[encodings])
+
+# Drift free ticker which ticks against fixed monotonic deadlines while the tick type is auto
+class Ticker:
+    def __init__(self):
+        self.deadline = time.monotonic() + tickSpeed / 1000
+        self._lastDeadline = self.deadline - tickSpeed / 1000
+        self._wakeup = asyncio.Event()
+        self._rateTime = time.monotonic()
+        self._rateTicks = 0
+        self._rateOverruns = 0
+        self._rateCompressionStats = copy.deepcopy(compressionStats)
+        self._task = asyncio.ensure_future(self._job())
 
-# Ticker timer callback
-async def timerCallback(extra):
-    await tick()
-    if tickType == TICK_AUTO:
-        Timer(tickSpeed / 1000, timerCallback, None)
-
-async def websocketConnection(websocket, path):
-    global mapWidth, mapHeight, mapData, others, tickType, tickSpeed, activeProgram, tickRunning, currentRobotIndex
-
-    async for data in websocket:
-        log("Client message: " + data)
-        message = json.loads(data)
-
-        # Robot connect message
-        if message["type"] == "robot_connect":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            robot["websocket"] = websocket
-            log("Robot " + str(robot["id"]) + " is connected")
-
-            # Send world info message
-            await sendWorldMessage(robot)
-
-            # Broadcast robot connect message
-            await broadcastMessage("robot_connect", {
-                "robot_id": robot["id"],
-                "robot": {
-                    "x": robot["x"],
-                    "y": robot["y"],
-                    "lift": robot["lift"],
-                    "color": robot["color"],
-                    "directions": robot["directions"]
-                }
-            })
-
-            # Send robot connected message from other robots
-            for otherRobot in robots:
-                if otherRobot["websocket"] != None and otherRobot["id"] != robot["id"]:
-                    await sendMessage(robot, "robot_connect", {
-                        "robot_id": otherRobot["id"],
-                        "robot": {
-                            "x": otherRobot["x"],
-                            "y": otherRobot["y"],
-                            "lift": otherRobot["lift"],
-                            "color": otherRobot["color"],
-                            "directions": otherRobot["directions"]
-                        }
-                    })
-
-            # Send robot connected message from others
-            for other in others:
-                if other["type"] == "website":
-                    await sendMessage(robot, "website_connect", { "website_id": other["id"] })
+    # Wake up the ticker to use the new tick speed or to stop
+    def wakeup(self):
+        self._wakeup.set()
+
+    # Sleep until the deadline, returns false when the ticker is woken up
+    async def _sleep(self):
+        timeout = self.deadline - time.monotonic()
+        if timeout <= 0:
+            return True
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            self._wakeup.clear()
+            return False
+        except asyncio.TimeoutError:
+            return True
 
-                if other["type"] == "supervisor":
-                    await sendMessage(robot, "supervisor_connect", { "supervisor_id": other["id"] })
+    async def _job(self):
+        global ticker
+
+        while tickType == TICK_AUTO:
+            # A new tick speed takes effect from the last deadline
+            if not await self._sleep():
+                self.deadline = self._lastDeadline + tickSpeed / 1000
+                continue
+
+            # The previous tick is still running at the deadline so it overruns
+            if tickRunning:
+                await tickIdle.wait()
+                if tickType != TICK_AUTO:
+                    break
 
-        # Website connect message
-        if message["type"] == "website_connect":
-            website = {
-                "type": "website",
-                "id": message["data"]["website_id"],
-                "websocket": websocket
+                self._rateOverruns += 1
+                now = time.monotonic()
+                missedDeadlines = int((now - self.deadline) / (tickSpeed / 1000))
+                if tickOverrun == TICK_OVERRUN_STRETCH:
+                    self.deadline = now
+                elif missedDeadlines > 0 and (tickOverrun == TICK_OVERRUN_SKIP or missedDeadlines > TICK_CATCH_UP_LIMIT):
+                    log("Tick overrun, skipping " + str(missedDeadlines) + " ticks")
+                    self.deadline += missedDeadlines * tickSpeed / 1000
+
+            self._lastDeadline = self.deadline
+            self.deadline += tickSpeed / 1000
+            await tick()
+            self._rateTicks += 1
+            self._reportRate()
+
+        if ticker == self:
+            ticker = None
+
+    # Report the achieved ticks per second against the target of the tick speed
+    def _reportRate(self):
+        now = time.monotonic()
+        if now - self._rateTime < TICK_RATE_INTERVAL:
+            return
+
+        rate = round(self._rateTicks / (now - self._rateTime), 2)
+        log("Achieved " + str(rate) + " of " + str(round(1000 / tickSpeed, 2)) + " ticks/s with " + str(self._rateOverruns) + " overruns")
+
+        # The bytes on the wire and the compression time in ms per tick by connection type
+        compressionData = {}
+        for type, stats in compressionStats.items():
+            rateStats = self._rateCompressionStats[type]
+            ticks = max(self._rateTicks, 1)
+            compressionData[type] = {
+                "bytes": round((stats["bytes"] - rateStats["bytes"]) / ticks),
+                "wire_bytes": round((stats["wire_bytes"] - rateStats["wire_bytes"]) / ticks),
+                "time": round((stats["time"] - rateStats["time"]) * 1000 / ticks, 3)
             }
-            others.append(website)
-            log("Website " + str(website["id"]) + " is connected")
-
-            # Send world info message
-            await sendWorldMessage(website)
 
-            # Broadcast website connect message
-            await broadcastMessage("website_connect", { "website_id": website["id"] })
-
-            # Send website other robot connected messages
-            for robot in robots:
-                if robot["websocket"] != None:
-                    await sendMessage(website, "robot_connect", {
-                        "robot_id": robot["id"],
-                        "robot": {
-                            "x": robot["x"],
-                            "y": robot["y"],
-                            "lift": robot["lift"],
-                            "color": robot["color"],
-                            "directions": robot["directions"]
-                        }
-                    })
-
-            # Send website others connected messages
-            for other in others:
-                if other["type"] == "website" and website["id"] != other["id"]:
-                    await sendMessage(website, "website_connect", { "website_id": other["id"] })
+        broadcastMessage("update_world_info", { "tick": { "rate": rate, "overruns": self._rateOverruns, "compression": compressionData } })
+        self._rateTime = now
+        self._rateTicks = 0
+        self._rateOverruns = 0
+        self._rateCompressionStats = copy.deepcopy(compressionStats)
+
+# The state files of the room, the room name is made safe for a file name
+def statePath(extension, sequence = None):
+    name = re.sub(r"[^A-Za-z0-9_-]", "_", roomName)
+    if sequence != None:
+        name += "." + str(sequence)
+    return os.path.join(STATE_PATH, name + "." + extension)
+
+# The sequence numbers of the journals of the room in order
+def journalSequences():
+    name = re.sub(r"[^A-Za-z0-9_-]", "_", roomName)
+    sequences = []
+    for fileName in os.listdir(STATE_PATH):
+        match = re.fullmatch(re.escape(name) + r"\.(\d+)\.journal", fileName)
+        if match != None:
+            sequences.append(int(match.group(1)))
+    return sorted(sequences)
+
+# Append a state change to the journal, the journal is flushed once the running callbacks are done
+def journal(record):
+    global journalRecords, journalFlushing
+
+    if journalFile == None:
+        return
+    journalFile.write(json.dumps(record, separators=(",", ":")) + "\n")
+    journalRecords += 1
+    if not journalFlushing:
+        journalFlushing = True
+        asyncio.get_running_loop().call_soon(flushJournal)
 
-                if other["type"] == "supervisor":
-                    await sendMessage(website, "supervisor_connect", { "supervisor_id": other["id"] })
+def journalRobot(robot):
+    journal([ JOURNAL_ROBOT, robot["id"], robot["x"], robot["y"], robot["directions"] ])
 
-        # Supervisor connect message
-        if message["type"] == "supervisor_connect":
-            supervisor = {
-                "type": "supervisor",
-                "id": message["data"]["supervisor_id"],
-                "websocket": websocket
-            }
-            others.append(supervisor)
-            log("Supervisor " + str(supervisor["id"]) + " is connected")
+def flushJournal():
+    global journalFlushing
 
-            # Create map if it isn't exesting
-            if mapData == None:
-                mapWidth = message["data"]["map"]["width"]
-                mapHeight = message["data"]["map"]["height"]
+    journalFlushing = False
+    if journalFile == None:
+        return
+    journalFile.flush()
+    if journalRecords >= SNAPSHOT_JOURNAL_RECORDS:
+        snapshotWorld()
 
-                # Create map data
-                mapData = [[TILE_UNKOWN] * mapWidth for i in range(mapHeight)]
-                mapData[0][0] = TILE_FLOOR
-                mapData[0][mapWidth - 1] = TILE_FLOOR
-                mapData[mapHeight - 1][0] = TILE_FLOOR
-                mapData[mapHeight - 1][mapWidth - 1] = TILE_FLOOR
+# Start a new journal and write a snapshot of the world in a thread so the tick loop doesn't wait for the disk,
+# only the copy of the tiles is made here; the old journals are removed when the snapshot is written
+def snapshotWorld():
+    global journalFile, journalSequence, journalRecords, snapshotWriting
 
-                # Setup robots positions
-                robots[1 - 1]["x"] = 0
-                robots[1 - 1]["y"] = 0
+    if STATE_PATH == None or mapGrid == None or snapshotWriting:
+        return
+    os.makedirs(STATE_PATH, exist_ok=True)
+    if journalFile != None:
+        journalFile.close()
+    journalSequence += 1
+    journalFile = open(statePath("journal", journalSequence), "a")
+    journalRecords = 0
+
+    state = {
+        "journal": journalSequence,
+        "map": { "id": mapId, "version": mapVersion, "width": mapWidth, "height": mapHeight },
+        "tick": { "type": tickType, "speed": tickSpeed, "phase": tickPhase, "overrun": tickOverrun },
+        "active_program_id": activeProgram["id"],
+        "spawn_index": spawnIndex,
+        "robots": [ { "id": robot["id"], "x": robot["x"], "y": robot["y"], "directions": robot["directions"] }
+            for robot in robots.values() if robot["x"] != None ]
+    }
+    snapshotWriting = True
+    asyncio.get_running_loop().run_in_executor(None, writeSnapshot, journalSequence, json.dumps(state).encode(), bytes(mapGrid.tiles)) \
+        .add_done_callback(snapshotWritten)
+
+# Write a snapshot file: the magic, uint32 header size, the JSON header and the map tiles
+def writeSnapshot(sequence, header, tiles):
+    path = statePath("snapshot")
+    with open(path + ".tmp", "wb") as file:
+        file.write(struct.pack("<4sI", b"MBSS", len(header)) + header + tiles)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+    for oldSequence in journalSequences():
+        if oldSequence < sequence:
+            os.remove(statePath("journal", oldSequence))
+
+def snapshotWritten(future):
+    global snapshotWriting
+
+    snapshotWriting = False
+    if future.exception() != None:
+        log("Snapshot failed: " + str(future.exception()))
+    else:
+        log("Snapshot " + str(journalSequence) + " is written")
+    if journalRecords >= SNAPSHOT_JOURNAL_RECORDS:
+        snapshotWorld()
+
+# Restore the world of the room from its last snapshot which is mapped in memory and the journals after it
+def restoreWorld():
+    global mapWidth, mapHeight, mapGrid, mapId, mapVersion, spawnIndex, journalSequence
+
+    if STATE_PATH == None or not os.path.exists(statePath("snapshot")):
+        return False
+    with open(statePath("snapshot"), "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+            magic, headerSize = struct.unpack_from("<4sI", snapshot)
+            state = json.loads(snapshot[8:8 + headerSize])
+            mapWidth = state["map"]["width"]
+            mapHeight = state["map"]["height"]
+            mapGrid = Grid(mapWidth, mapHeight)
+            mapGrid.tiles[:] = snapshot[8 + headerSize:8 + headerSize + mapWidth * mapHeight]
+
+    mapId = state["map"]["id"]
+    mapVersion = state["map"]["version"]
+    createUnkownTiles()
+    clearComponents()
+    createSpawnTiles()
+    spawnIndex = state["spawn_index"]
+    for robotState in state["robots"]:
+        restoreRobot(robotState["id"], robotState["x"], robotState["y"], robotState["directions"])
+    restoreWorldInfo(state["tick"], state["active_program_id"])
+
+    # The last line of a journal can be cut off by a crash
+    for sequence in journalSequences():
+        if sequence < state["journal"]:
+            continue
+        journalSequence = sequence
+        with open(statePath("journal", sequence), "r") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record[0] == JOURNAL_TILE and mapGrid.get(record[1], record[2]) == TILE_UNKOWN:
+                    setMapTile(record[1], record[2], record[3])
+                if record[0] == JOURNAL_ROBOT:
+                    restoreRobot(record[1], record[2], record[3], record[4])
+                if record[0] == JOURNAL_WORLD:
+                    restoreWorldInfo(record[1].get("tick", {}), record[1].get("active_program_id"))
+
+    if SHARD_COUNT > 0:
+        createShards()
+    mapReady.set()
+    log("World " + str(mapId) + " is restored at map version " + str(mapVersion))
+    snapshotWorld()
+    return True
+
+def restoreRobot(robotId, x, y, directions):
+    robot = robots.get(robotId) or createRobot(robotId)
+    robot["x"] = x
+    robot["y"] = y
+    robot["directions"] = directions
+
+def restoreWorldInfo(tick, activeProgramId):
+    global tickType, tickSpeed, tickPhase, tickOverrun, ticker, activeProgram
+
+    tickSpeed = tick.get("speed", tickSpeed)
+    tickPhase = tick.get("phase", tickPhase)
+    tickOverrun = tick.get("overrun", tickOverrun)
+    tickType = tick.get("type", tickType)
+    if tickType == TICK_AUTO and ticker == None:
+        ticker = Ticker()
+    if activeProgramId != None:
+        activeProgram = next((program for program in programs if program["id"] == activeProgramId), activeProgram)
+
+# Send the connect messages of all the other connections to a new connection
+def sendConnectedMessages(item):
+    messages = []
+    for robot in robots.values():
+        if robot["websocket"] != None and robot != item:
+            messages.append(("robot_connect", {
+                "robot_id": robot["id"],
+                "robot": robotData(robot)
+            }))
+
+    for website in websites.values():
+        if website != item:
+            messages.append(("website_connect", { "website_id": website["id"] }))
+
+    for supervisor in supervisors.values():
+        if supervisor != item:
+            messages.append(("supervisor_connect", { "supervisor_id": supervisor["id"] }))
+
+    # A connection that asks for batches gets them in one batch, so a big fleet doesn't overflow its outbox
+    if len(messages) > 0 and (item.get("batch", False) or item["outbox"].batchInterval != None):
+        sendMessage(item, *batchMessageData(messages))
+    else:
+        for type, data in messages:
+            sendMessage(item, type, data)
+
+# Robot connect message
+async def robotConnectHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    if robot == None:
+        robot = createRobot(data["robot_id"])
+        if mapGrid != None and not placeRobot(robot):
+            del robots[robot["id"]]
+            await websocket.close()
+            return
+
+    # A robot that reconnects before its old connection is closed stops sending to the old connection,
+    # the old connection is no longer a connection of the robot so it doesn't get the broadcasts twice
+    if robot["outbox"] != None and robot["websocket"] != websocket:
+        robot["outbox"].close()
+        connections.pop(robot["websocket"], None)
+    robot["websocket"] = websocket
+    robot["batch"] = data.get("batch", False)
+    robot["outbox"] = Outbox(websocket, mapEncodings=negotiateMapEncodings(data), codec=negotiateCodec(data))
+    setupCompression(websocket, "robot")
+    connections[websocket] = robot
+    log("Robot " + str(robot["id"]) + " is connected")
+
+    # Send world info message
+    await sendWorldMessage(robot, data)
+
+    # Broadcast robot connect message
+    broadcastMessage("robot_connect", {
+        "robot_id": robot["id"],
+        "robot": robotData(robot)
+    })
 
-                robots[2 - 1]["x"] = mapWidth - 1
-                robots[2 - 1]["y"] = 0
+    # Send robot connected messages from other robots and others
+    sendConnectedMessages(robot)
+
+    # The robot tick of a robot that reconnects during its tick is lost with the old connection, so it is send again
+    if robot["id"] in tickPendingRobots or serialTickRobot() is robot:
+        log("Tick for reconnected Robot " + str(robot["id"]))
+        sendMessage(robot, "robot_tick", robotTickData(robot))
+
+# Website connect message
+async def websiteConnectHandler(websocket, data):
+    website = {
+        "type": "website",
+        "id": data["website_id"],
+        "websocket": websocket,
+        "outbox": Outbox(websocket, WEBSITE_OUTBOX_SIZE, SLOW_CONSUMER_POLICY, negotiateMapEncodings(data), negotiateBatchInterval(data), negotiateCodec(data))
+    }
+    websites[website["id"]] = website
+    connections[websocket] = website
+    setupCompression(websocket, "website")
+    log("Website " + str(website["id"]) + " is connected")
+
+    # Send world info message
+    await sendWorldMessage(website, data)
+
+    # Broadcast website connect message
+    broadcastMessage("website_connect", { "website_id": website["id"] })
+
+    # Send website robots and others connected messages
+    sendConnectedMessages(website)
+
+# Supervisor connect message
+async def supervisorConnectHandler(websocket, data):
+    global mapWidth, mapHeight, mapGrid, mapId
+
+    supervisor = {
+        "type": "supervisor",
+        "id": data["supervisor_id"],
+        "websocket": websocket,
+        "outbox": Outbox(websocket, mapEncodings=negotiateMapEncodings(data), batchInterval=negotiateBatchInterval(data), codec=negotiateCodec(data))
+    }
+    supervisors[supervisor["id"]] = supervisor
+    connections[websocket] = supervisor
+    setupCompression(websocket, "supervisor")
+    log("Supervisor " + str(supervisor["id"]) + " is connected")
+
+    # Create map if it isn't exesting
+    if mapGrid == None:
+        mapWidth = data["map"]["width"]
+        mapHeight = data["map"]["height"]
+
+        # Create map grid, the border of the map is always floor so the robots can spawn there
+        mapId = round(time.time() * 1000)
+        mapGrid = Grid(mapWidth, mapHeight)
+        mapGrid.fillBorder(TILE_FLOOR)
+        createUnkownTiles()
+        clearComponents()
+        if SHARD_COUNT > 0:
+            createShards()
+
+        # Place the robots that are already connected
+        createSpawnTiles()
+        for robot in list(robots.values()):
+            if not placeRobot(robot):
+                del robots[robot["id"]]
+                if robot["websocket"] != None:
+                    asyncio.ensure_future(robot["websocket"].close())
 
-                robots[3 - 1]["x"] = 0
-                robots[3 - 1]["y"] = mapHeight - 1
+        # Wake up the connections that are waiting for the map
+        mapReady.set()
+        snapshotWorld()
 
-                robots[4 - 1]["x"] = mapWidth - 1
-                robots[4 - 1]["y"] = mapHeight - 1
+    # Send world info message
+    await sendWorldMessage(supervisor)
 
-            # Send world info message
-            await sendWorldMessage(supervisor)
+    # Broadcast supervisor connect message
+    broadcastMessage("supervisor_connect", { "supervisor_id": supervisor["id"] })
 
-            # Broadcast supervisor connect message
-            await broadcastMessage("supervisor_connect", { "supervisor_id": supervisor["id"] })
+    # Send supervisor robots and others connected messages
+    sendConnectedMessages(supervisor)
 
-            # Send robot connected messages
-            for robot in robots:
-                if robot["websocket"] != None:
-                    await sendMessage(supervisor, "robot_connect", {
-                        "robot_id": robot["id"],
-                        "robot": {
-                            "x": robot["x"],
-                            "y": robot["y"],
-                            "lift": robot["lift"],
-                            "color": robot["color"],
-                            "directions": robot["directions"]
-                        }
-                    })
+# Update world info message
+async def updateWorldInfoHandler(websocket, data):
+    global tickType, tickSpeed, tickPhase, tickOverrun, ticker, activeProgram
 
-            # Send others connected messages
-            for other in others:
-                if other["type"] == "website":
-                    await sendMessage(supervisor, "website_connect", { "website_id": other["id"] })
+    messageData = {}
 
-                if other["type"] == "supervisor" and supervisor["id"] != other["id"]:
-                    await sendMessage(supervisor, "supervisor_connect", { "supervisor_id": other["id"] })
+    if "tick" in data:
+        messageData["tick"] = {}
 
-        # Update world info message
-        if message["type"] == "update_world_info":
-            messageData = {}
+        if "speed" in data["tick"]:
+            tickSpeed = data["tick"]["speed"]
+            messageData["tick"]["speed"] = tickSpeed
+            if ticker != None:
+                ticker.wakeup()
 
-            if "tick" in message["data"]:
-                messageData["tick"] = {}
+        if "phase" in data["tick"]:
+            tickPhase = data["tick"]["phase"]
+            messageData["tick"]["phase"] = tickPhase
 
-                if "speed" in message["data"]["tick"]:
-                    tickSpeed = message["data"]["tick"]["speed"]
-                    messageData["tick"]["speed"] = tickSpeed
+        if "overrun" in data["tick"]:
+            tickOverrun = data["tick"]["overrun"]
+            messageData["tick"]["overrun"] = tickOverrun
 
-                if "type" in message["data"]["tick"]:
-                    oldTickType = tickType
-                    tickType = message["data"]["tick"]["type"]
-                    messageData["tick"]["type"] = tickType
+        if "type" in data["tick"]:
+            tickType = data["tick"]["type"]
+            messageData["tick"]["type"] = tickType
 
-                    if oldTickType == TICK_MANUAL and tickType == TICK_AUTO:
-                        Timer(tickSpeed / 1000, timerCallback, None)
+            if tickType == TICK_AUTO and ticker == None:
+                ticker = Ticker()
+            if tickType == TICK_MANUAL and ticker != None:
+                ticker.wakeup()
 
-            if "active_program_id" in message["data"]:
-                activeProgram = next((program for program in programs if program["id"] == message["data"]["active_program_id"]), None)
-                messageData["active_program_id"] = activeProgram["id"]
+    if "active_program_id" in data:
+        activeProgram = next((program for program in programs if program["id"] == data["active_program_id"]), None)
+        messageData["active_program_id"] = activeProgram["id"]
 
-            await broadcastMessage("update_world_info", messageData)
+    journal([ JOURNAL_WORLD, messageData ])
+    broadcastMessage("update_world_info", messageData)
 
-        # World tick message
-        if message["type"] == "world_tick" and tickType == TICK_MANUAL:
-            await tick()
+# World tick message
+async def worldTickHandler(websocket, data):
+    if tickType == TICK_MANUAL:
+        await tick()
 
-        # New direction message
-        if message["type"] == "new_direction":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            robot["directions"].append({
-                "id": message["data"]["direction"]["id"],
-                "x": message["data"]["direction"]["x"],
-                "y": message["data"]["direction"]["y"]
-            })
-
-            log("New direction for Robot " + str(robot["id"]))
-            await broadcastMessage("new_direction", {
-                "robot_id": robot["id"],
-                "direction": {
-                    "id": message["data"]["direction"]["id"],
-                    "x": message["data"]["direction"]["x"],
-                    "y": message["data"]["direction"]["y"]
-                }
-            })
-
-        # Cancel direction message
-        if message["type"] == "cancel_direction":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            robot["directions"] = [direction for direction in robot["directions"] if direction["id"] != message["data"]["direction_id"]]
+# New direction message
+async def newDirectionHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    if robot == None:
+        return
+    robot["directions"].append({
+        "id": data["direction"]["id"],
+        "x": data["direction"]["x"],
+        "y": data["direction"]["y"]
+    })
+    journalRobot(robot)
+
+    log("New direction for Robot " + str(robot["id"]))
+    broadcastMessage("new_direction", {
+        "robot_id": robot["id"],
+        "direction": {
+            "id": data["direction"]["id"],
+            "x": data["direction"]["x"],
+            "y": data["direction"]["y"]
+        }
+    })
 
-            log("Cancel direction for Robot " + str(robot["id"]))
-            await broadcastMessage("cancel_direction", {
-                "robot_id": robot["id"],
-                "direction_id": message["data"]["direction_id"]
-            })
+# Cancel direction message
+async def cancelDirectionHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    if robot == None:
+        return
+    robot["directions"] = [direction for direction in robot["directions"] if direction["id"] != data["direction_id"]]
+    journalRobot(robot)
 
-        # Read sensors message
-        if message["type"] == "read_sensors":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            for other in others:
-                if other["type"] == "supervisor":
-                    messageData = { "robot_id": robot["id"] }
-                    if "robot" in message["data"]:
-                        robot["x"] = message["data"]["robot"]["x"]
-                        robot["y"] = message["data"]["robot"]["y"]
-                        messageData["robot"] = {
-                            "x": robot["x"],
-                            "y": robot["y"]
-                        }
-
-                    log("Read sensors from Robot " + str(robot["id"]))
-                    await sendMessage(other, "read_sensors", messageData)
-                    break
+    log("Cancel direction for Robot " + str(robot["id"]))
+    broadcastMessage("cancel_direction", {
+        "robot_id": robot["id"],
+        "direction_id": data["direction_id"]
+    })
 
-        # Read sensors done message
-        if message["type"] == "read_sensors_done":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            log("Read sensors done for Robot " + str(robot["id"]))
-            await sendMessage(robot, "read_sensors_done", {
-                "robot_id": robot["id"],
-                "sensors": {
-                    "up": message["data"]["sensors"]["up"],
-                    "left": message["data"]["sensors"]["left"],
-                    "right": message["data"]["sensors"]["right"],
-                    "down": message["data"]["sensors"]["down"]
-                }
-            })
+# Read sensors message
+async def readSensorsHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    supervisor = next(iter(supervisors.values()), None)
+    if robot == None or supervisor == None:
+        return
 
-        # Robot tick done message
-        if message["type"] == "robot_tick_done":
-            robot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-            messageData = { "robot_id": robot["id"] }
-
-            if "robot" in message["data"]:
-                robot["x"] = message["data"]["robot"]["x"]
-                robot["y"] = message["data"]["robot"]["y"]
-                messageData["robot"] = {
-                    "x": robot["x"],
-                    "y": robot["y"]
-                }
-
-            if "map" in message["data"]:
-                messageData["map"] = []
-                for mapUpdate in message["data"]["map"]:
-                    if mapData[mapUpdate["y"]][mapUpdate["x"]] == TILE_UNKOWN and mapUpdate["type"] != TILE_UNKOWN:
-                        mapData[mapUpdate["y"]][mapUpdate["x"]] = mapUpdate["type"]
-                        messageData["map"].append({ "x": mapUpdate["x"], "y": mapUpdate["y"], "type": mapUpdate["type"] })
-
-            log("Tick done from Robot " + str(robot["id"]))
-            await broadcastMessage("robot_tick_done", messageData)
-
-            if currentRobotIndex < len(robots):
-                while currentRobotIndex < len(robots) and robots[currentRobotIndex]["websocket"] == None:
-                    currentRobotIndex += 1
-                if currentRobotIndex < len(robots):
-                    log("Tick for Robot " + str(robots[currentRobotIndex]["id"]))
-                    await broadcastMessage("robot_tick", { "robot_id": robots[currentRobotIndex]["id"] })
-                    currentRobotIndex += 1
-                    continue
-            tickRunning = False
-
-    # Disconnect message for robots
-    for robot in robots:
-        if robot["websocket"] == websocket:
-            robot["websocket"] = None
-            log("Robot " + str(robot["id"]) + " is disconnected")
-            await broadcastMessage("robot_disconnect", { "robot_id": robot["id"] })
-            break
+    messageData = { "robot_id": robot["id"] }
+    if "robot" in data:
+        if robot["id"] in tickPendingRobots:
+            reserveRobotMove(robot, data["robot"]["x"], data["robot"]["y"])
+        else:
+            robot["x"] = data["robot"]["x"]
+            robot["y"] = data["robot"]["y"]
+            journalRobot(robot)
+        messageData["robot"] = {
+            "x": robot["x"],
+            "y": robot["y"]
+        }
 
-    # Disconnect message for others
-    for other in others:
-        if other["websocket"] == websocket:
-            other_id = other["id"]
-            others = [other for other in others if other["id"] != other_id]
+    if robot["traceId"] != None:
+        messageData["trace_id"] = robot["traceId"]
 
-            if other["type"] == "website":
-                log("Website " + str(other_id) + " is disconnected")
-                await broadcastMessage("website_disconnect", { "website_id": other_id })
+    log("Read sensors from Robot " + str(robot["id"]))
+    sendMessage(supervisor, "read_sensors", messageData)
 
-            if other["type"] == "supervisor":
-                log("Supervisor " + str(other_id) + " is disconnected")
-                await broadcastMessage("supervisor_disconnect", { "supervisor_id": other_id })
+# Read sensors done message
+async def readSensorsDoneHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    if robot == None:
+        return
+    log("Read sensors done for Robot " + str(robot["id"]))
+    messageData = {
+        "robot_id": robot["id"],
+        "robot": {
+            "x": robot["x"],
+            "y": robot["y"]
+        },
+        "sensors": {
+            "up": data["sensors"]["up"],
+            "left": data["sensors"]["left"],
+            "right": data["sensors"]["right"],
+            "down": data["sensors"]["down"]
+        }
+    }
+    if robot["traceId"] != None:
+        messageData["trace_id"] = robot["traceId"]
+    sendMessage(robot, "read_sensors_done", messageData)
+
+# Robot tick done message
+async def robotTickDoneHandler(websocket, data):
+    robot = robots.get(data["robot_id"])
+    if robot == None:
+        return
+    messageData = { "robot_id": robot["id"] }
+
+    # The position of a concurrent tick is already committed by the reservation table
+    if "robot" in data:
+        if robot["id"] not in tickPendingRobots:
+            robot["x"] = data["robot"]["x"]
+            robot["y"] = data["robot"]["y"]
+            journalRobot(robot)
+        messageData["robot"] = {
+            "x": robot["x"],
+            "y": robot["y"]
+        }
 
-            break
+    if "map" in data:
+        messageData["map"] = []
+        for mapUpdate in data["map"]:
+            if mapGrid.tiles[mapUpdate["y"] * mapWidth + mapUpdate["x"]] == TILE_UNKOWN and mapUpdate["type"] != TILE_UNKOWN:
+                setMapTile(mapUpdate["x"], mapUpdate["y"], mapUpdate["type"])
+                messageData["map"].append({ "x": mapUpdate["x"], "y": mapUpdate["y"], "type": mapUpdate["type"] })
+        messageData["map_version"] = mapVersion
+
+    log("Tick done from Robot " + str(robot["id"]))
+    broadcastMessage("robot_tick_done", messageData)
+
+    # The robot tick span is the whole trace from the robot tick message until the robot is done
+    if robot["traceId"] != None:
+        traceSpan(robot["traceId"], "robot tick", robot["traceStart"], { "robot_id": robot["id"] })
+        robot["traceId"] = None
+
+    if robot["id"] in tickPendingRobots:
+        concurrentRobotTickDone(robot)
+    elif currentRobotIndex != None:
+        serialRobotTick()
+
+# Disconnect message for robots and others, a connection that is already replaced by a reconnect with the same id
+# only removes its own connection and leaves the registry entry of the new connection alone
+def disconnectHandler(websocket):
+    item = connections.pop(websocket, None)
+    if item == None:
+        return
+    if item["websocket"] == websocket:
+        item["outbox"].close()
+
+    if item.get("type") == "website":
+        if websites.get(item["id"]) is not item:
+            return
+        del websites[item["id"]]
+        log("Website " + str(item["id"]) + " is disconnected")
+        broadcastMessage("website_disconnect", { "website_id": item["id"] })
+    elif item.get("type") == "supervisor":
+        if supervisors.get(item["id"]) is not item:
+            return
+        del supervisors[item["id"]]
+        log("Supervisor " + str(item["id"]) + " is disconnected")
+        broadcastMessage("supervisor_disconnect", { "supervisor_id": item["id"] })
+    elif item["websocket"] == websocket:
+        item["websocket"] = None
+        log("Robot " + str(item["id"]) + " is disconnected")
+        broadcastMessage("robot_disconnect", { "robot_id": item["id"] })
+
+        # Don't let a tick wait on a disconnected robot
+        if item["id"] in tickPendingRobots:
+            concurrentRobotTickDone(item)
+        elif serialTickRobot() is item:
+            serialRobotTick()
+
+# Stop the running tick, the ticker and the shards of the world of a room that is torn down,
+# a saved world is restored when the room is opened again
+def closeWorld():
+    global tickType, journalFile, traceFile
+
+    tickType = TICK_MANUAL
+    if tickRunning:
+        tickDone()
+    if ticker != None:
+        ticker.wakeup()
+    stopShards()
+    if journalFile != None:
+        journalFile.close()
+        journalFile = None
+    if traceFile != None:
+        traceFile.close()
+        traceFile = None
+
+# Open a room by name, a new room runs the code of this module again so it gets its own world,
+# the code is only compiled for the first room
+def openRoom(name):
+    if name == ROOM_DEFAULT:
+        return sys.modules[__name__]
+
+    room = rooms.get(name)
+    if room == None:
+        room = types.ModuleType("room_" + name)
+        room.__file__ = __file__
+        room.roomCode = roomCode
+        exec(roomCode, room.__dict__)
+
+        # A spawned shard worker can only import this module and not the module of a room, the code is the same
+        room.shardWorker = shardWorker
+        room.__dict__.update(roomConfig())
+        room.roomName = name
+        room.recorder = recorder
+        room.restoreWorld()
+        rooms[name] = room
+        log("Room " + name + " is created")
+
+    closeHandle = roomCloseHandles.pop(name, None)
+    if closeHandle != None:
+        closeHandle.cancel()
+    return room
+
+# The configuration of a new room, the constants of this module and the state that is sized by them
+def roomConfig():
+    config = { name: value for name, value in globals().items() if name.isupper() }
+    config["mapChanges"] = collections.deque(maxlen=MAP_CHANGE_LOG_SIZE)
+    config["compressionStats"] = { type: { "messages": 0, "bytes": 0, "wire_bytes": 0, "time": 0 } for type in COMPRESSION_SETTINGS }
+    config["tickDurations"] = { "counts": [ 0 ] * (len(METRICS_BUCKETS) + 1), "sum": 0 }
+    return config
+
+# Tear down a room after the close delay when it has no connections, an idle room has no running tasks
+def closeRoomWhenEmpty(room):
+    if room.roomName == ROOM_DEFAULT or len(room.connections) > 0 or room.roomName in roomCloseHandles:
+        return
+    roomCloseHandles[room.roomName] = asyncio.get_running_loop().call_later(ROOM_CLOSE_DELAY, closeRoom, room.roomName)
+
+def closeRoom(name):
+    del roomCloseHandles[name]
+    rooms.pop(name).closeWorld()
+    log("Room " + name + " is closed")
+
+# The robot tick message of a robot, a traced robot tick starts a new trace of the robot
+def robotTickData(robot):
+    messageData = { "robot_id": robot["id"] }
+    if TRACE_PATH != None:
+        robot["traceId"] = messageData["trace_id"] = "%016x" % random.getrandbits(64)
+        robot["traceStart"] = time.time()
+    return messageData
+
+# Write a span of a trace to the trace file of the room, the times are in seconds since the epoch so the spans
+# of all the processes on one machine line up
+def traceSpan(traceId, name, startTime, extraData = {}):
+    global traceFile
+
+    if traceFile == None:
+        os.makedirs(TRACE_PATH, exist_ok=True)
+        fileName = "server-" + re.sub(r"[^A-Za-z0-9_-]", "_", roomName) + "-" + str(os.getpid()) + ".jsonl"
+        traceFile = open(os.path.join(TRACE_PATH, fileName), "a", buffering=1)
+    span = {
+        "trace_id": traceId,
+        "name": name,
+        "process": roomName == ROOM_DEFAULT and "server" or "server " + roomName,
+        "start": startTime,
+        "duration": time.time() - startTime
+    }
+    span.update(extraData)
+    traceFile.write(json.dumps(span) + "\n")
+
+# Metrics helpers, a histogram counts a duration in the first bucket that it fits in
+def observeDuration(histogram, duration):
+    histogram["counts"][bisect.bisect_left(METRICS_BUCKETS, duration)] += 1
+    histogram["sum"] += duration
+
+def observeHandler(type, duration):
+    messagesReceived[type] += 1
+    if type not in handlerDurations:
+        handlerDurations[type] = { "counts": [ 0 ] * (len(METRICS_BUCKETS) + 1), "sum": 0 }
+    observeDuration(handlerDurations[type], duration)
+
+def metricLabels(labels):
+    return "{" + ",".join(key + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for key, value in labels.items()) + "}"
+
+# The samples of a metric family are collected over all rooms, so the family is written once
+def addMetric(families, name, type, help, labels, value):
+    if name not in families:
+        families[name] = { "type": type, "help": help, "samples": [] }
+    families[name]["samples"].append(name + metricLabels(labels) + " " + str(value))
+
+def addHistogram(families, name, help, labels, histogram):
+    if name not in families:
+        families[name] = { "type": "histogram", "help": help, "samples": [] }
+    samples = families[name]["samples"]
+    count = 0
+    for bucket, bucketCount in zip(METRICS_BUCKETS + [ "+Inf" ], histogram["counts"]):
+        count += bucketCount
+        samples.append(name + "_bucket" + metricLabels(dict(labels, le=bucket)) + " " + str(count))
+    samples.append(name + "_sum" + metricLabels(labels) + " " + str(histogram["sum"]))
+    samples.append(name + "_count" + metricLabels(labels) + " " + str(count))
+
+# Add the metrics of the world of this room, the gauges are read when the metrics are scraped
+def collectMetrics(families):
+    labels = { "room": roomName }
+    addHistogram(families, "megabots_tick_duration_seconds", "Duration of the ticks from the start until all robots are done", labels, tickDurations)
+    for type, histogram in handlerDurations.items():
+        addHistogram(families, "megabots_handler_duration_seconds", "Duration of the message handlers by message type", dict(labels, type=type), histogram)
+    for type, count in messagesReceived.items():
+        addMetric(families, "megabots_messages_received_total", "counter", "Handled inbound messages by message type", dict(labels, type=type), count)
+    for type, count in messagesSent.items():
+        addMetric(families, "megabots_messages_sent_total", "counter", "Outbound messages to the connections by message type", dict(labels, type=type), count)
+    for type, stats in compressionStats.items():
+        addMetric(families, "megabots_sent_bytes_total", "counter", "Outbound message bytes by connection type", dict(labels, type=type), stats["bytes"])
+        addMetric(families, "megabots_sent_wire_bytes_total", "counter", "Outbound bytes on the wire after compression by connection type", dict(labels, type=type), stats["wire_bytes"])
+
+    addMetric(families, "megabots_connections", "gauge", "Connected robots, websites and supervisors", dict(labels, type="robot"), sum(1 for robot in robots.values() if robot["websocket"] != None))
+    addMetric(families, "megabots_connections", "gauge", "Connected robots, websites and supervisors", dict(labels, type="website"), len(websites))
+    addMetric(families, "megabots_connections", "gauge", "Connected robots, websites and supervisors", dict(labels, type="supervisor"), len(supervisors))
+    for item in connections.values():
+        addMetric(families, "megabots_outbox_messages", "gauge", "Queued outbound messages of a connection", dict(labels, type=item.get("type", "robot"), id=item["id"]),
+            len(item["outbox"].messages) + len(item["outbox"].batchMessages))
+
+    if mapGrid != None:
+        floorTiles = mapGrid.tiles.count(TILE_FLOOR)
+        chestTiles = mapGrid.tiles.count(TILE_CHEST)
+        for type, count in (("unkown", len(mapGrid.tiles) - floorTiles - chestTiles), ("floor", floorTiles), ("chest", chestTiles)):
+            addMetric(families, "megabots_map_tiles", "gauge", "Map tiles by tile type", dict(labels, type=type), count)
+        addMetric(families, "megabots_discoverable_tiles", "gauge", "Unkown tiles that can still be discovered", labels, len(unkownTiles))
+
+# The metrics of the default room and all other rooms in the Prometheus text format
+def metricsText():
+    families = {}
+    for room in [ sys.modules[__name__] ] + list(rooms.values()):
+        room.collectMetrics(families)
+    lines = []
+    for name, family in families.items():
+        lines.append("# HELP " + name + " " + family["help"])
+        lines.append("# TYPE " + name + " " + family["type"])
+        lines += family["samples"]
+    return "\n".join(lines) + "\n"
+
+# The labels of the functions that the profiles are attributed to, the message handlers by message type and the programs
+def profileLabels():
+    labels = { handler.__name__: "handler " + type for type, handler in messageHandlers.items() }
+    for program in programs:
+        if program["function"] != None:
+            labels[program["function"].__name__] = "program " + program["function"].__name__
+    return labels
+
+def profileFunction(code):
+    return os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + "(" + code.co_name + ")"
+
+# Sample the stack of the event loop thread until the stop event is set, a sample is attributed to the innermost handler
+# or program on the stack and counts for all the functions above it up to the event loop callback that runs them,
+# the event loop waiting for events is idle; with a room only the samples inside the ticks of that room are taken
+def sampleProfile(threadId, stopEvent, labels, samples, room = None):
+    while not stopEvent.wait(PROFILE_SAMPLE_INTERVAL):
+        if room != None and not room.tickRunning:
+            continue
+        frame = sys._current_frames().get(threadId)
+        if frame == None:
+            return
+
+        label = "other"
+        functions = []
+        while frame != None:
+            functions.append(profileFunction(frame.f_code))
+            if frame.f_code.co_filename == __file__ and frame.f_code.co_name in labels:
+                label = labels[frame.f_code.co_name]
+                break
+            if frame.f_code.co_name == "_run" and functions[-1].startswith("events.py:"):
+                break
+            frame = frame.f_back
+        if label == "other" and functions[0].startswith("selectors.py:"):
+            label = "idle"
+
+        if label not in samples:
+            samples[label] = { "count": 0, "total": collections.Counter(), "self": collections.Counter() }
+        samples[label]["count"] += 1
+        samples[label]["total"].update(set(functions))
+        samples[label]["self"][functions[0]] += 1
+
+# Wait for some seconds or for some ticks of a room
+async def profileWait(seconds, ticks, room):
+    if ticks == None:
+        await asyncio.sleep(seconds)
+        return
+    startTicks = sum(room.tickDurations["counts"])
+    startTime = time.monotonic()
+    while sum(room.tickDurations["counts"]) - startTicks < ticks and time.monotonic() - startTime < PROFILE_MAX_SECONDS:
+        await asyncio.sleep(0.01)
+
+# Profile the server for some seconds or ticks and return the profile text
+async def profileText(mode, seconds, ticks, room):
+    global profiling
+
+    profiling = True
+    labels = profileLabels()
+    lines = []
+    startTime = time.perf_counter()
+    try:
+        if mode == PROFILE_DETERMINISTIC:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await profileWait(seconds, ticks, room)
+            finally:
+                profiler.disable()
+            elapsedTime = time.perf_counter() - startTime
+
+            # The top functions of the whole profile and the functions that every handler and program calls
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+            lines.append("Deterministic profile of %.2f s" % elapsedTime)
+            lines.append(stream.getvalue())
+            for function, (primitiveCalls, calls, totalTime, cumulativeTime, callers) in sorted(stats.stats.items(), key=lambda item: -item[1][3]):
+                if function[0] == __file__ and function[2] in labels:
+                    lines.append("%s: %d calls, %.3f s cumulative, %.3f s in itself" % (labels[function[2]], calls, cumulativeTime, totalTime))
+                    stream.seek(0)
+                    stream.truncate()
+                    stats.print_callees(re.escape(":" + str(function[1]) + "(" + function[2] + ")"))
+                    lines.append(stream.getvalue())
+        else:
+            # The event loop thread only gives the sampler the GIL when it waits or after the switch interval,
+            # so the switch interval is shorter than the sample interval to sample at every point of the code
+            samples = {}
+            stopEvent = threading.Event()
+            sampler = threading.Thread(target=sampleProfile, args=(threading.get_ident(), stopEvent, labels, samples, ticks != None and room or None), daemon=True)
+            switchInterval = sys.getswitchinterval()
+            sys.setswitchinterval(PROFILE_SAMPLE_INTERVAL / 10)
+            sampler.start()
+            try:
+                await profileWait(seconds, ticks, room)
+            finally:
+                stopEvent.set()
+                await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+                sys.setswitchinterval(switchInterval)
+            elapsedTime = time.perf_counter() - startTime
+
+            # The labels with the most samples first with their functions by the samples they are on the stack for
+            sampleCount = sum(labelSamples["count"] for labelSamples in samples.values())
+            lines.append("Sampling profile of %.2f s with %d samples every %.1f ms%s" % (elapsedTime, sampleCount, PROFILE_SAMPLE_INTERVAL * 1000,
+                ticks != None and " inside the ticks" or ""))
+            for label, labelSamples in sorted(samples.items(), key=lambda item: -item[1]["count"]):
+                lines.append("")
+                lines.append("%s: %d samples, %.1f%%" % (label, labelSamples["count"], labelSamples["count"] / sampleCount * 100))
+                lines.append("%10s %10s  %s" % ("total", "self", "function"))
+                for function, count in labelSamples["total"].most_common(PROFILE_LINES):
+                    lines.append("%10d %10d  %s" % (count, labelSamples["self"][function], function))
+    finally:
+        profiling = False
+    return "\n".join(lines) + "\n"
+
+def httpResponse(status, contentType, body):
+    return b"HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (status.encode(), contentType.encode(), len(body), body)
+
+# Minimal HTTP server for the metrics scrapes and the profiles, every request gets one response and the connection is closed
+async def metricsConnection(reader, writer):
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        url = urllib.parse.urlsplit(request.split(b" ")[1].decode())
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/metrics":
+            writer.write(httpResponse("200 OK", "text/plain; version=0.0.4", metricsText().encode()))
+        elif url.path == "/profile":
+            mode = query.get("mode", PROFILE_SAMPLING)
+            room = rooms.get(query.get("room"), sys.modules[__name__])
+            seconds = None
+            ticks = None
+            try:
+                seconds = min(float(query.get("seconds", 10)), PROFILE_MAX_SECONDS)
+                if "ticks" in query:
+                    ticks = int(query["ticks"])
+            except ValueError:
+                mode = None
+            if (mode != PROFILE_SAMPLING and mode != PROFILE_DETERMINISTIC) or not seconds > 0 or (ticks != None and ticks <= 0):
+                writer.write(httpResponse("400 Bad Request", "text/plain", b"Unknown profile mode, seconds or ticks\n"))
+            elif profiling:
+                writer.write(httpResponse("409 Conflict", "text/plain", b"A profile is already running\n"))
+            else:
+                log("Profiling the server with a " + mode + " profile")
+                writer.write(httpResponse("200 OK", "text/plain", (await profileText(mode, seconds, ticks, room)).encode()))
+        else:
+            writer.write(httpResponse("404 Not Found", "text/plain", b""))
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+# Message handlers by message type
+messageHandlers = {
+    "robot_connect": robotConnectHandler,
+    "website_connect": websiteConnectHandler,
+    "supervisor_connect": supervisorConnectHandler,
+    "update_world_info": updateWorldInfoHandler,
+    "world_tick": worldTickHandler,
+    "new_direction": newDirectionHandler,
+    "cancel_direction": cancelDirectionHandler,
+    "read_sensors": readSensorsHandler,
+    "read_sensors_done": readSensorsDoneHandler,
+    "robot_tick_done": robotTickDoneHandler
+}
+
+async def websocketConnection(websocket, path = None):
+    room = None
+    if recorder != None:
+        recorder.record(RECORD_OPEN, websocket)
+    try:
+        async for data in websocket:
+            log("Client message: " + str(data))
+            if recorder != None:
+                recorder.record(RECORD_RECEIVE, websocket, data)
+            message = decodeMessage(data)
+
+            # The first message of a connection picks its room
+            if room == None:
+                room = openRoom(message["data"].get("room", ROOM_DEFAULT))
+
+            handler = room.messageHandlers.get(message["type"])
+            if handler != None:
+                traceStart = time.time()
+                startTime = time.perf_counter()
+                await handler(websocket, message["data"])
+                room.observeHandler(message["type"], time.perf_counter() - startTime)
+                if room.TRACE_PATH != None and "trace_id" in message["data"]:
+                    room.traceSpan(message["data"]["trace_id"], "handle " + message["type"], traceStart)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        if room != None:
+            room.disconnectHandler(websocket)
+            closeRoomWhenEmpty(room)
+        if recorder != None:
+            recorder.record(RECORD_CLOSE, websocket)
 
 # Create websockets server
 async def websocketsServer():
+    global recorder
+
+    restoreWorld()
+    if RECORD_PATH != None:
+        recorder = Recorder(RECORD_PATH)
+        log("Recording all messages to " + RECORD_PATH)
+    metricsServer = None
+    if METRICS_PORT != None:
+        metricsServer = await asyncio.start_server(metricsConnection, "127.0.0.1", METRICS_PORT)
+        log("Metrics are served at http://127.0.0.1:" + str(METRICS_PORT) + "/metrics")
     log("Websockets server is listening at ws://127.0.0.1:" + str(WEBSOCKETS_PORT) + "/")
-    async with websockets.serve(websocketConnection, "127.0.0.1", WEBSOCKETS_PORT):
-        await asyncio.Future()
-
-asyncio.run(websocketsServer())
+    try:
+        async with websockets.serve(websocketConnection, "127.0.0.1", WEBSOCKETS_PORT, compression=WEBSOCKETS_COMPRESSION):
+            await asyncio.Future()
+    finally:
+        if metricsServer != None:
+            metricsServer.close()
+        if recorder != None:
+            recorder.close()
+            recorder = None
+
+if __name__ == "__main__":
+    asyncio.run(websocketsServer())
@@ -2,18 +2,35 @@
 const DEBUG = false;
 
 const WEBSOCKETS_URL = 'ws://127.0.0.1:8080/';
+const ROOM = new URLSearchParams(location.search).get('room') || 'default';
+const RECONNECT_DELAY = 1000;
 
 const TICK_MANUAL = 0;
 const TICK_AUTO = 1;
 
+const TICK_PHASE_SERIAL = 0;
+const TICK_PHASE_CONCURRENT = 1;
+
+const TICK_OVERRUN_SKIP = 0;
+const TICK_OVERRUN_CATCH_UP = 1;
+const TICK_OVERRUN_STRETCH = 2;
+
 const TILE_UNKOWN = 0;
 const TILE_FLOOR = 1;
 const TILE_CHEST = 2;
 
+const MAP_ENCODING_JSON = 0;
+const MAP_ENCODING_PACKED = 1;
+const MAP_ENCODING_RLE = 2;
+
+const MAP_FRAME_SNAPSHOT = 1;
+const MAP_FRAME_UPDATES = 2;
+
 // App
-let websocket, mapMeshesGroup, floorGeometry, cubeGeometry,
-    unkownMaterial, floorMaterial, chestMaterial;
-const ledOffColor = { r: 0, g: 0, b: 0 }, mapMeshes = [], robotGroups = [];
+let websocket, mapFrameData, scene, mapMeshesGroup, floorGeometry, cubeGeometry,
+    unkownMaterial, floorMaterial, chestMaterial,
+    robotGeometry, robotTexure, ledGeometry, destinationArrowGeometry;
+const ledOffColor = { r: 0, g: 0, b: 0 }, mapMeshes = [], robotGroups = {};
 
 const app = new Vue({
     el: '#app',
@@ -21,24 +38,30 @@ const app = new Vue({
     data: {
         tickManual: TICK_MANUAL,
         tickAuto: TICK_AUTO,
+        tickPhaseSerial: TICK_PHASE_SERIAL,
+        tickPhaseConcurrent: TICK_PHASE_CONCURRENT,
+        tickOverrunSkip: TICK_OVERRUN_SKIP,
+        tickOverrunCatchUp: TICK_OVERRUN_CATCH_UP,
+        tickOverrunStretch: TICK_OVERRUN_STRETCH,
 
         id: Date.now(),
         connected: false,
         tickType: undefined,
         tickSpeed: undefined,
+        tickPhase: undefined,
+        tickOverrun: undefined,
+        tickRate: undefined,
+        tickOverruns: undefined,
         activeProgramId: undefined,
         programs: undefined,
 
         mapWidth: undefined,
         mapHeight: undefined,
         mapData: undefined,
+        mapId: undefined,
+        mapVersion: undefined,
 
-        robots: [
-            { id: 1, x: undefined, y: undefined, lift: undefined, color: { r: undefined, g: undefined, b: undefined }, directions: [], connected: false },
-            { id: 2, x: undefined, y: undefined, lift: undefined, color: { r: undefined, g: undefined, b: undefined }, directions: [], connected: false },
-            { id: 3, x: undefined, y: undefined, lift: undefined, color: { r: undefined, g: undefined, b: undefined }, directions: [], connected: false },
-            { id: 4, x: undefined, y: undefined, lift: undefined, color: { r: undefined, g: undefined, b: undefined }, directions: [], connected: false }
-        ],
+        robots: [],
 
         sendForm: {
             robot_id: 1,
@@ -58,140 +81,239 @@ const app = new Vue({
     methods: {
         websocketsConnect() {
             websocket = new WebSocket(WEBSOCKETS_URL);
+            websocket.binaryType = 'arraybuffer';
 
             websocket.onopen = () => {
                 this.connected = true;
-                this.sendMessage('website_connect', { website_id: this.id });
+
+                // When reconnecting send the map version we already have so only the missed map changes are send
+                const connectData = {
+                    website_id: this.id,
+                    room: ROOM,
+                    map_encodings: [ MAP_ENCODING_RLE, MAP_ENCODING_PACKED ],
+                    batch: true
+                };
+                if (this.mapId != undefined) {
+                    connectData.map_id = this.mapId;
+                    connectData.map_version = this.mapVersion;
+                }
+                this.sendMessage('website_connect', connectData);
             };
 
             websocket.onmessage = event => {
+                // Binary map frames are send before the message they belong to
+                if (event.data instanceof ArrayBuffer) {
+                    this.decodeMapFrame(event.data);
+                    return;
+                }
+
                 if (DEBUG) {
                     console.log('Server message: ' + event.data);
                 }
                 const message = JSON.parse(event.data);
 
-                // World info message
-                if (message.type == 'world_info') {
-                    this.tickType = message.data.tick.type;
-                    this.tickSpeed = message.data.tick.speed;
+                // A batch message has all the messages of a tick in order with their map updates merged
+                if (message.type == 'batch') {
+                    if (message.data.map != undefined) {
+                        for (const mapUpdate of message.data.map) {
+                            this.worldUpdateTile(mapUpdate.x, mapUpdate.y, mapUpdate.type);
+                        }
+                    }
+                    if (message.data.map_version != undefined) {
+                        this.mapVersion = Math.max(this.mapVersion, message.data.map_version);
+                    }
+                    for (const batchMessage of message.data.messages) {
+                        this.handleMessage(batchMessage);
+                    }
+                    return;
+                }
 
-                    this.activeProgramId = message.data.active_program_id;
-                    this.programs = [];
-                    for (const program of message.data.programs) {
-                        this.programs.push({
-                            id: program.id,
-                            name: program.name
-                        });
+                this.handleMessage(message);
+            };
+
+            websocket.onclose = () => {
+                this.connected = false;
+                setTimeout(() => this.websocketsConnect(), RECONNECT_DELAY);
+            };
+        },
+
+        handleMessage(message) {
+            // World info message
+            if (message.type == 'world_info') {
+                this.tickType = message.data.tick.type;
+                this.tickSpeed = message.data.tick.speed;
+                this.tickPhase = message.data.tick.phase;
+                this.tickOverrun = message.data.tick.overrun;
+
+                this.activeProgramId = message.data.active_program_id;
+                this.programs = [];
+                for (const program of message.data.programs) {
+                    this.programs.push({
+                        id: program.id,
+                        name: program.name
+                    });
+                }
+
+                // Only the missed map changes are send when reconnecting, they are already applied when send in a binary map frame;
+                // changes for another map than ours mean the map is out of sync
+                const previousMapId = this.mapId;
+                this.mapId = message.data.map.id;
+                this.mapVersion = message.data.map.version;
+                if (message.data.map.changes != undefined) {
+                    if (message.data.map.id != previousMapId) {
+                        this.resyncMap();
+                        return;
+                    }
+                    for (const mapUpdate of message.data.map.changes) {
+                        this.worldUpdateTile(mapUpdate.x, mapUpdate.y, mapUpdate.type);
                     }
+                    return;
+                }
 
-                    this.mapWidth = message.data.map.width;
-                    this.mapHeight = message.data.map.height;
-                    this.mapData = [];
+                // The map data is already decoded when it is send in a binary map frame, a frame only belongs
+                // to the world info message after it, without a frame of the right size the complete map is asked again
+                let mapData = mapFrameData;
+                mapFrameData = undefined;
+                if (message.data.map.data == undefined && (mapData == undefined || mapData.length != message.data.map.width * message.data.map.height)) {
+                    this.resyncMap();
+                    return;
+                }
+                if (message.data.map.data != undefined) {
+                    mapData = new Uint8Array(message.data.map.width * message.data.map.height);
+                    for (let y = 0; y < message.data.map.height; y++) {
+                        for (let x = 0; x < message.data.map.width; x++) {
+                            mapData[y * message.data.map.width + x] = message.data.map.data[y][x];
+                        }
+                    }
+                }
+
+                // When the world simulation is already running only update the changed tiles
+                if (mapMeshes.length > 0) {
                     for (let y = 0; y < this.mapHeight; y++) {
-                        this.mapData[y] = [];
                         for (let x = 0; x < this.mapWidth; x++) {
-                            this.mapData[y][x] = message.data.map.data[y][x];
+                            this.worldUpdateTile(x, y, mapData[y * this.mapWidth + x]);
                         }
                     }
+                    return;
+                }
+
+                this.mapWidth = message.data.map.width;
+                this.mapHeight = message.data.map.height;
+                this.mapData = mapData;
 
-                    this.startWorldSimulation();
+                this.startWorldSimulation();
+            }
+
+            // Robot connect message
+            if (message.type == 'robot_connect') {
+                const robot = this.getRobot(message.data.robot_id);
+                robot.connected = true;
+                if (scene != undefined && robotGroups[robot.id] == undefined) {
+                    this.worldCreateRobotGroup(robot);
                 }
 
-                // Robot connect message
-                if (message.type == 'robot_connect') {
-                    const robot = this.robots.find(robot => robot.id == message.data.robot_id);
-                    robot.connected = true;
+                this.worldMoveRobot(robot.id, message.data.robot.x, message.data.robot.y);
+                robot.lift = message.data.robot.lift;
 
-                    this.worldMoveRobot(robot.id, message.data.robot.x, message.data.robot.y);
-                    robot.lift = message.data.robot.lift;
+                robot.color.r = message.data.robot.color.red;
+                robot.color.g = message.data.robot.color.green;
+                robot.color.b = message.data.robot.color.blue;
 
-                    robot.color.r = message.data.robot.color.red;
-                    robot.color.g = message.data.robot.color.green;
-                    robot.color.b = message.data.robot.color.blue;
+                robot.directions = [];
+                for (const direction of message.data.robot.directions) {
+                    robot.directions.push({
+                        id: direction.id,
+                        x: direction.x,
+                        y: direction.y
+                    })
+                }
+                this.worldUpdateRobotDestination(robot.id);
+            }
 
-                    robot.directions = [];
-                    for (const direction of message.data.robot.directions) {
-                        robot.directions.push({
-                            id: direction.id,
-                            x: direction.x,
-                            y: direction.y
-                        })
-                    }
-                    this.worldUpdateRobotDestination(robot.id);
+            // Robot disconnect message
+            if (message.type == 'robot_disconnect') {
+                const robot = this.getRobot(message.data.robot_id);
+                robot.connected = false;
+
+                if (robotGroups[robot.id] != undefined) {
+                    const robotGroup = robotGroups[robot.id];
+                    robotGroup.visible = false;
+                    robotGroup.destinationGroup.visible = false;
                 }
+            }
 
-                // Robot disconnect message
-                if (message.type == 'robot_disconnect') {
-                    const robot = this.robots.find(robot => robot.id == message.data.robot_id);
-                    robot.connected = false;
+            // Update world info message
+            if (message.type == 'update_world_info') {
+                if (message.data.tick != undefined) {
+                    if (message.data.tick.type != undefined) {
+                        this.tickType = message.data.tick.type;
+                    }
 
-                    if (robotGroups.length > 0) {
-                        const robotGroup = robotGroups[robot.id - 1];
-                        robotGroup.visible = false;
-                        robotGroup.destinationGroup.visible = false;
+                    if (message.data.tick.speed != undefined) {
+                        this.tickSpeed = message.data.tick.speed;
                     }
-                }
 
-                // Update world info message
-                if (message.type == 'update_world_info') {
-                    if (message.data.tick != undefined) {
-                        if (message.data.tick.type != undefined) {
-                            this.tickType = message.data.tick.type;
-                        }
+                    if (message.data.tick.phase != undefined) {
+                        this.tickPhase = message.data.tick.phase;
+                    }
 
-                        if (message.data.tick.speed != undefined) {
-                            this.tickSpeed = message.data.tick.speed;
-                        }
+                    if (message.data.tick.overrun != undefined) {
+                        this.tickOverrun = message.data.tick.overrun;
                     }
 
-                    if (message.data.active_program_id != undefined) {
-                        this.activeProgramId = message.data.active_program_id;
+                    if (message.data.tick.rate != undefined) {
+                        this.tickRate = message.data.tick.rate;
+                        this.tickOverruns = message.data.tick.overruns;
                     }
                 }
 
-                // New direction message
-                if (message.type == 'new_direction') {
-                    const robot = this.robots.find(robot => robot.id == message.data.robot_id);
-                    robot.directions.push({
-                        id: message.data.direction.id,
-                        x: message.data.direction.x,
-                        y: message.data.direction.y
-                    });
-                    this.worldUpdateRobotDestination(robot.id);
+                if (message.data.active_program_id != undefined) {
+                    this.activeProgramId = message.data.active_program_id;
                 }
+            }
 
-                // Cancel direction message
-                if (message.type == 'cancel_direction') {
-                    const robot = this.robots.find(robot => robot.id == message.data.robot_id);
-                    robot.directions = robot.directions.filter(direction => direction.id != message.data.direction_id);
-                    this.worldUpdateRobotDestination(robot.id);
-                }
+            // New direction message
+            if (message.type == 'new_direction') {
+                const robot = this.getRobot(message.data.robot_id);
+                robot.directions.push({
+                    id: message.data.direction.id,
+                    x: message.data.direction.x,
+                    y: message.data.direction.y
+                });
+                this.worldUpdateRobotDestination(robot.id);
+            }
 
-                // Tick done message
-                if (message.type == 'robot_tick_done') {
-                    if (message.data.map != undefined) {
-                        for (const mapUpdate of message.data.map) {
-                            this.worldUpdateTile(mapUpdate.x, mapUpdate.y, mapUpdate.type);
-                        }
-                    }
+            // Cancel direction message
+            if (message.type == 'cancel_direction') {
+                const robot = this.getRobot(message.data.robot_id);
+                robot.directions = robot.directions.filter(direction => direction.id != message.data.direction_id);
+                this.worldUpdateRobotDestination(robot.id);
+            }
 
-                    if (message.data.robot != undefined) {
-                        this.worldMoveRobot(message.data.robot_id, message.data.robot.x, message.data.robot.y);
-                    } else {
-                        const robot = this.robots.find(robot => robot.id == message.data.robot_id);
-                        this.worldMoveRobot(robot.id, robot.x, robot.y);
+            // Tick done message
+            if (message.type == 'robot_tick_done') {
+                if (message.data.map_version != undefined) {
+                    this.mapVersion = Math.max(this.mapVersion, message.data.map_version);
+                }
+
+                if (message.data.map != undefined) {
+                    for (const mapUpdate of message.data.map) {
+                        this.worldUpdateTile(mapUpdate.x, mapUpdate.y, mapUpdate.type);
                     }
                 }
 
-                // Website tick message
-                if (message.type == 'website_tick') {
-                    this.programs[this.activeProgram].bind(this)();
+                if (message.data.robot != undefined) {
+                    this.worldMoveRobot(message.data.robot_id, message.data.robot.x, message.data.robot.y);
+                } else {
+                    const robot = this.getRobot(message.data.robot_id);
+                    this.worldMoveRobot(robot.id, robot.x, robot.y);
                 }
-            };
+            }
 
-            websocket.onclose = () => {
-                this.connected = false;
-            };
+            // Website tick message
+            if (message.type == 'website_tick') {
+                this.programs[this.activeProgram].bind(this)();
+            }
         },
 
         sendMessage(type, data = {}) {
@@ -228,6 +350,22 @@ const app = new Vue({
             });
         },
 
+        changeTickPhase() {
+            this.sendMessage('update_world_info', {
+                tick: {
+                    phase: parseInt(this.tickPhase)
+                }
+            });
+        },
+
+        changeTickOverrun() {
+            this.sendMessage('update_world_info', {
+                tick: {
+                    overrun: parseInt(this.tickOverrun)
+                }
+            });
+        },
+
         changeActiveProgramId() {
             this.sendMessage('update_world_info', {
                 active_program_id: parseInt(this.activeProgramId)
@@ -310,9 +448,59 @@ const app = new Vue({
             }
         },
 
+        // Reconnect without our map id, so the server sends the complete map in a new binary map frame
+        resyncMap() {
+            this.mapId = undefined;
+            this.mapVersion = undefined;
+            websocket.close();
+        },
+
+        // Decode a binary map frame directly into a flat tiles buffer
+        decodeMapFrame(frame) {
+            const view = new DataView(frame);
+            const bytes = new Uint8Array(frame);
+
+            if (view.getUint8(0) == MAP_FRAME_SNAPSHOT) {
+                const mapEncoding = view.getUint8(1);
+                const mapWidth = view.getUint32(2, true);
+                const mapHeight = view.getUint32(6, true);
+                mapFrameData = new Uint8Array(mapWidth * mapHeight);
+
+                if (mapEncoding == MAP_ENCODING_PACKED) {
+                    for (let i = 0; i < mapFrameData.length; i++) {
+                        mapFrameData[i] = (bytes[10 + (i >> 2)] >> ((i & 3) * 2)) & 3;
+                    }
+                }
+
+                if (mapEncoding == MAP_ENCODING_RLE) {
+                    let index = 0, value = 0, shift = 0;
+                    for (let i = 10; i < bytes.length; i++) {
+                        value += (bytes[i] & 0x7f) * Math.pow(2, shift);
+                        shift += 7;
+                        if (bytes[i] < 0x80) {
+                            const runLength = Math.floor(value / 4);
+                            mapFrameData.fill(value % 4, index, index + runLength);
+                            index += runLength;
+                            value = 0;
+                            shift = 0;
+                        }
+                    }
+                }
+            }
+
+            if (view.getUint8(0) == MAP_FRAME_UPDATES) {
+                const updateCount = view.getUint32(1, true);
+                for (let i = 0; i < updateCount; i++) {
+                    const mapUpdate = view.getUint32(5 + i * 4, true);
+                    const index = Math.floor(mapUpdate / 4);
+                    this.worldUpdateTile(index % this.mapWidth, Math.floor(index / this.mapWidth), mapUpdate % 4);
+                }
+            }
+        },
+
         worldUpdateTile(x, y, type) {
-            if (type != this.mapData[y][x]) {
-                this.mapData[y][x] = type;
+            if (type != this.mapData[y * this.mapWidth + x]) {
+                this.mapData[y * this.mapWidth + x] = type;
 
                 if (mapMeshes.length > 0) {
                     mapMeshesGroup.remove(mapMeshes[y][x]);
@@ -338,15 +526,24 @@ const app = new Vue({
             }
         },
 
+        getRobot(robotId) {
+            let robot = this.robots.find(robot => robot.id == robotId);
+            if (robot == undefined) {
+                robot = { id: robotId, x: undefined, y: undefined, lift: undefined, color: { r: undefined, g: undefined, b: undefined }, directions: [], connected: false };
+                this.robots.push(robot);
+            }
+            return robot;
+        },
+
         worldMoveRobot(robotId, x, y) {
-            const robot = this.robots.find(robot => robot.id == robotId);
+            const robot = this.getRobot(robotId);
             const old_robot_x = robot.x;
             const old_robot_y = robot.y;
             robot.x = x;
             robot.y = y;
 
-            if (robot.connected && robotGroups.length > 0) {
-                const robotsGroup = robotGroups[robot.id - 1];
+            if (robot.connected && robotGroups[robot.id] != undefined) {
+                const robotsGroup = robotGroups[robot.id];
 
                 robotsGroup.robotMesh.material.color = robot.color;
                 if (old_robot_x != undefined && old_robot_y != undefined) {
@@ -378,9 +575,9 @@ const app = new Vue({
         },
 
         worldUpdateRobotDestination(robotId) {
-            if (robotGroups.length > 0) {
-                const robot = this.robots.find(robot => robot.id == robotId);
-                const robotDestinationGroup = robotGroups[robot.id - 1].destinationGroup;
+            if (robotGroups[robotId] != undefined) {
+                const robot = this.getRobot(robotId);
+                const robotDestinationGroup = robotGroups[robot.id].destinationGroup;
                 if (robot.connected && robot.directions.length > 0) {
                     robotDestinationGroup.destinationArrowMesh.material.color = robot.color;
                     robotDestinationGroup.visible = true;
@@ -405,9 +602,70 @@ const app = new Vue({
             }
         },
 
+        worldCreateRobotGroup(robot) {
+            // Robot group
+            const robotGroup = new THREE.Group();
+            if (robot.connected) {
+                robotGroup.position.x = robot.x - this.mapWidth / 2;
+                robotGroup.position.z = robot.y - this.mapHeight / 2;
+            } else {
+                robotGroup.visible = false;
+            }
+            scene.add(robotGroup);
+            robotGroups[robot.id] = robotGroup;
+
+            const robotMesh = new THREE.Mesh(robotGeometry, new THREE.MeshBasicMaterial({ map: robotTexure }));
+            if (robot.connected) {
+                robotMesh.material.color = robot.color;
+            }
+            robotGroup.robotMesh = robotMesh;
+            robotGroup.add(robotMesh);
+
+            robotGroup.upLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
+            robotGroup.upLedMesh.material.color = ledOffColor;
+            robotGroup.upLedMesh.position.y = 0.5;
+            robotGroup.upLedMesh.position.z = -0.3;
+            robotGroup.add(robotGroup.upLedMesh);
+
+            robotGroup.leftLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
+            robotGroup.leftLedMesh.material.color = ledOffColor;
+            robotGroup.leftLedMesh.position.x = -0.3;
+            robotGroup.leftLedMesh.position.y = 0.5;
+            robotGroup.add(robotGroup.leftLedMesh);
+
+            robotGroup.rightLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
+            robotGroup.rightLedMesh.material.color = ledOffColor;
+            robotGroup.rightLedMesh.position.x = 0.3;
+            robotGroup.rightLedMesh.position.y = 0.5;
+            robotGroup.add(robotGroup.rightLedMesh);
+
+            robotGroup.downLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
+            robotGroup.downLedMesh.material.color = ledOffColor;
+            robotGroup.downLedMesh.position.y = 0.5;
+            robotGroup.downLedMesh.position.z = 0.3;
+            robotGroup.add(robotGroup.downLedMesh);
+
+            // Robot destination group
+            robotGroup.destinationGroup = new THREE.Group();
+            if (robot.directions.length > 0) {
+                robotGroup.destinationGroup.position.x = robot.directions[0].x - this.mapWidth / 2;
+                robotGroup.destinationGroup.position.z = robot.directions[0].y - this.mapHeight / 2;
+            } else {
+                robotGroup.destinationGroup.visible = false;
+            }
+            scene.add(robotGroup.destinationGroup);
+
+            const destinationArrowMesh = new THREE.Mesh(destinationArrowGeometry, new THREE.MeshBasicMaterial());
+            destinationArrowMesh.material.color = ledOffColor;
+            destinationArrowMesh.rotation.x = Math.PI;
+            destinationArrowMesh.position.y = 1.5;
+            robotGroup.destinationGroup.destinationArrowMesh = destinationArrowMesh;
+            robotGroup.destinationGroup.add(destinationArrowMesh);
+        },
+
         startWorldSimulation() {
             // 3D Map Simulation
-            const scene = new THREE.Scene();
+            scene = new THREE.Scene();
 
             const camera = new THREE.PerspectiveCamera( 75, window.innerWidth / window.innerHeight, 0.1, 1000 );
             camera.position.y = this.mapWidth;
@@ -445,7 +703,7 @@ const app = new Vue({
             for (let y = 0; y < this.mapHeight; y++) {
                 mapMeshes[y] = [];
                 for (let x = 0; x < this.mapWidth; x++) {
-                    const type = this.mapData[y][x];
+                    const type = this.mapData[y * this.mapWidth + x];
 
                     let geometry
                     if (type == TILE_UNKOWN || type == TILE_CHEST) geometry = cubeGeometry;
@@ -513,70 +771,13 @@ const app = new Vue({
             wallGroup.add(bottomWall);
 
             // Create robot meshes
-            const robotGeometry = new THREE.CylinderGeometry(0.3, 0.3, 0.99, 32);
-            const robotTexure = new THREE.TextureLoader().load('/images/robot.jpg');
-            const ledGeometry = new THREE.SphereGeometry(0.05, 32, 32);
-            const destinationArrowGeometry = new THREE.ConeGeometry(0.3, 0.5, 32);
+            robotGeometry = new THREE.CylinderGeometry(0.3, 0.3, 0.99, 32);
+            robotTexure = new THREE.TextureLoader().load('/images/robot.jpg');
+            ledGeometry = new THREE.SphereGeometry(0.05, 32, 32);
+            destinationArrowGeometry = new THREE.ConeGeometry(0.3, 0.5, 32);
 
             for (const robot of this.robots) {
-                // Robot group
-                const robotGroup = new THREE.Group();
-                if (robot.connected) {
-                    robotGroup.position.x = robot.x - this.mapWidth / 2;
-                    robotGroup.position.z = robot.y - this.mapHeight / 2;
-                } else {
-                    robotGroup.visible = false;
-                }
-                scene.add(robotGroup);
-                robotGroups[robot.id - 1] = robotGroup;
-
-                const robotMesh = new THREE.Mesh(robotGeometry, new THREE.MeshBasicMaterial({ map: robotTexure }));
-                if (robot.connected) {
-                    robotMesh.material.color = robot.color;
-                }
-                robotGroup.robotMesh = robotMesh;
-                robotGroup.add(robotMesh);
-
-                robotGroup.upLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
-                robotGroup.upLedMesh.material.color = ledOffColor;
-                robotGroup.upLedMesh.position.y = 0.5;
-                robotGroup.upLedMesh.position.z = -0.3;
-                robotGroup.add(robotGroup.upLedMesh);
-
-                robotGroup.leftLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
-                robotGroup.leftLedMesh.material.color = ledOffColor;
-                robotGroup.leftLedMesh.position.x = -0.3;
-                robotGroup.leftLedMesh.position.y = 0.5;
-                robotGroup.add(robotGroup.leftLedMesh);
-
-                robotGroup.rightLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
-                robotGroup.rightLedMesh.material.color = ledOffColor;
-                robotGroup.rightLedMesh.position.x = 0.3;
-                robotGroup.rightLedMesh.position.y = 0.5;
-                robotGroup.add(robotGroup.rightLedMesh);
-
-                robotGroup.downLedMesh = new THREE.Mesh(ledGeometry, new THREE.MeshBasicMaterial());
-                robotGroup.downLedMesh.material.color = ledOffColor;
-                robotGroup.downLedMesh.position.y = 0.5;
-                robotGroup.downLedMesh.position.z = 0.3;
-                robotGroup.add(robotGroup.downLedMesh);
-
-                // Robot destination group
-                robotGroup.destinationGroup = new THREE.Group();
-                if (robot.directions.length > 0) {
-                    robotGroup.destinationGroup.position.x = robot.directions[0].x - this.mapWidth / 2;
-                    robotGroup.destinationGroup.position.z = robot.directions[0].y - this.mapHeight / 2;
-                } else {
-                    robotGroup.destinationGroup.visible = false;
-                }
-                scene.add(robotGroup.destinationGroup);
-
-                const destinationArrowMesh = new THREE.Mesh(destinationArrowGeometry, new THREE.MeshBasicMaterial());
-                destinationArrowMesh.material.color = ledOffColor;
-                destinationArrowMesh.rotation.x = Math.PI;
-                destinationArrowMesh.position.y = 1.5;
-                robotGroup.destinationGroup.destinationArrowMesh = destinationArrowMesh;
-                robotGroup.destinationGroup.add(destinationArrowMesh);
+                this.worldCreateRobotGroup(robot);
             }
 
             // Map renderer loop
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+# MegaBots tracing for the robot clients and the supervisors, writes the spans of the ticks that the server traces
+# as JSON lines to a file of the process in the trace folder, like the server does for its own spans
+
+import json
+import os
+import time
+
+class TraceWriter:
+    def __init__(self, path, process, fileName):
+        self.path = path
+        self.process = process
+        self.fileName = fileName
+        self.file = None
+
+    # Write a span from its start until now, the file is opened by the first span
+    def span(self, traceId, name, startTime):
+        if self.file == None:
+            os.makedirs(self.path, exist_ok=True)
+            self.file = open(os.path.join(self.path, self.fileName + "-" + str(os.getpid()) + ".jsonl"), "a", buffering=1)
+        self.file.write(json.dumps({
+            "trace_id": traceId,
+            "name": name,
+            "process": self.process,
+            "start": startTime,
+            "duration": time.time() - startTime
+        }) + "\n")
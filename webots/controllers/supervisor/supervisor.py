@@ -5,9 +5,14 @@
 import asyncio
 from controller import Supervisor
 import json
+import os
+import sys
 import time
 import websockets
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+import tracing
+
 # Constants
 DEBUG = False
 
@@ -15,18 +20,24 @@ SUPERVISOR_ID = round(time.time() * 1000)
 
 WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
 
+# The trace folder for the spans of the ticks that the server traces
+TRACE_PATH = "traces"
+
 TILE_UNKOWN = 0
 TILE_FLOOR = 1
 TILE_CHEST = 2
 
+# The spans of the traced ticks
+traceWriter = tracing.TraceWriter(TRACE_PATH, "supervisor", "supervisor")
+
 # Robots
 supervisor = Supervisor()
-robots = [
-    { "id": 1, "x": None, "y": None, "connected": False },
-    { "id": 2, "x": None, "y": None, "connected": False },
-    { "id": 3, "x": None, "y": None, "connected": False },
-    { "id": 4, "x": None, "y": None, "connected": False }
-]
+robots = {}
+
+def getRobot(robotId):
+    if robotId not in robots:
+        robots[robotId] = { "id": robotId, "x": None, "y": None, "connected": False }
+    return robots[robotId]
 
 # Load map from webots world
 arena = supervisor.getFromDef("arena")
@@ -53,32 +64,35 @@ def updateRobotPosition(robot, x, y):
     robot["y"] = y
 
     robotNode = supervisor.getFromDef("robot_" + str(robot["id"]))
-    robotNode.getField("translation").setSFVec3f([ robot["x"] / 10, 0.05, robot["y"] / 10 ])
-
-    if oldRobotX != None and oldRobotY != None:
-        upLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_up_led")
-        if robot["y"] - oldRobotY < 0:
-            upLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
-        else:
-            upLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
-
-        leftLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_left_led")
-        if robot["x"] - oldRobotX < 0:
-            leftLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
-        else:
-            leftLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
-
-        rightLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_right_led")
-        if robot["x"] - oldRobotX > 0:
-            rightLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
-        else:
-            rightLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
-
-        downLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_down_led")
-        if robot["y"] - oldRobotY > 0:
-            downLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
-        else:
-            downLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
+
+    # Robots without a node in the world are only simulated
+    if robotNode != None:
+        robotNode.getField("translation").setSFVec3f([ robot["x"] / 10, 0.05, robot["y"] / 10 ])
+
+        if oldRobotX != None and oldRobotY != None:
+            upLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_up_led")
+            if robot["y"] - oldRobotY < 0:
+                upLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
+            else:
+                upLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
+
+            leftLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_left_led")
+            if robot["x"] - oldRobotX < 0:
+                leftLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
+            else:
+                leftLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
+
+            rightLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_right_led")
+            if robot["x"] - oldRobotX > 0:
+                rightLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
+            else:
+                rightLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
+
+            downLedNode = supervisor.getFromDef("robot_" + str(robot["id"]) + "_down_led")
+            if robot["y"] - oldRobotY > 0:
+                downLedNode.getField("diffuseColor").setSFColor([ 1, 1, 1 ])
+            else:
+                downLedNode.getField("diffuseColor").setSFColor([ 0, 0, 0 ])
 
     supervisor.step(int(supervisor.getBasicTimeStep()))
 
@@ -112,20 +126,21 @@ async def websocketConnection():
 
             # Robot connect message
             if message["type"] == "robot_connect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 updateRobotPosition(otherRobot, message["data"]["robot"]["x"], message["data"]["robot"]["y"])
                 otherRobot["connected"] = True
                 log("Robot " + str(otherRobot["id"]) + " is connected")
 
             # Robot disconnect message
             if message["type"] == "robot_disconnect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 otherRobot["connected"] = False
                 log("Robot " + str(otherRobot["id"]) + " is disconnected")
 
             # Read sensors message
             if message["type"] == "read_sensors":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                startTime = time.time()
+                otherRobot = getRobot(message["data"]["robot_id"])
 
                 robotX = otherRobot["x"]
                 robotY = otherRobot["y"]
@@ -134,7 +149,7 @@ async def websocketConnection():
                     robotY = message["data"]["robot"]["y"]
 
                 log("Read sensors from Robot " + str(otherRobot["id"]))
-                await sendMessage("read_sensors_done", {
+                messageData = {
                     "robot_id": otherRobot["id"],
                     "sensors": {
                         "up": robotY == 0 or mapData[robotY - 1][robotX] == TILE_CHEST,
@@ -142,11 +157,17 @@ async def websocketConnection():
                         "right": robotX == mapWidth - 1 or mapData[robotY][robotX + 1] == TILE_CHEST,
                         "down": robotY == mapHeight - 1 or mapData[robotY + 1][robotX] == TILE_CHEST
                     }
-                })
+                }
+
+                # The answer of a traced tick carries its trace id, the span is the sensor lookup
+                if "trace_id" in message["data"]:
+                    messageData["trace_id"] = message["data"]["trace_id"]
+                    traceWriter.span(message["data"]["trace_id"], "sensor lookup", startTime)
+                await sendMessage("read_sensors_done", messageData)
 
             # Robot tick done message
             if message["type"] == "robot_tick_done":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
+                otherRobot = getRobot(message["data"]["robot_id"])
                 if "robot" in message["data"]:
                     updateRobotPosition(otherRobot, message["data"]["robot"]["x"], message["data"]["robot"]["y"])
                 else:
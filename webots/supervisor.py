@@ -4,35 +4,61 @@
 
 import asyncio
 import json
+import os
+import sys
 import time
 import websockets
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tracing
+
+# Optional MessagePack codec
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Constants
 DEBUG = False
 
 SUPERVISOR_ID = round(time.time() * 1000)
 
 WEBSOCKETS_URL = "ws://127.0.0.1:8080/"
+# The permessage-deflate compression, None sends and receives all messages uncompressed
+WEBSOCKETS_COMPRESSION = "deflate"
+
+# The trace folder for the spans of the ticks that the server traces
+TRACE_PATH = "traces"
 
 TILE_UNKOWN = 0
 TILE_FLOOR = 1
 TILE_CHEST = 2
 
-# Load map from file
-mapFile = open("webots/map.json", "r")
+MESSAGE_CODEC_JSON = 0
+MESSAGE_CODEC_MSGPACK = 1
+
+# Load map from file, the path can be given via first argument
+MAP_PATH = len(sys.argv) >= 2 and sys.argv[1] or "webots/map.json"
+mapFile = open(MAP_PATH, "r")
 mapFileData = json.loads(mapFile.read())
 mapFile.close()
 mapWidth = mapFileData["width"]
 mapHeight = mapFileData["height"]
 mapData = mapFileData["data"]
 
+# The room of the world on the server, the room can be given via second argument
+ROOM = len(sys.argv) >= 3 and sys.argv[2] or "default"
+
+# The spans of the traced ticks
+traceWriter = tracing.TraceWriter(TRACE_PATH, "supervisor", "supervisor")
+
 # Robots
-robots = [
-    { "id": 1, "x": None, "y": None, "connected": False },
-    { "id": 2, "x": None, "y": None, "connected": False },
-    { "id": 3, "x": None, "y": None, "connected": False },
-    { "id": 4, "x": None, "y": None, "connected": False }
-]
+robots = {}
+
+def getRobot(robotId):
+    if robotId not in robots:
+        robots[robotId] = { "id": robotId, "x": None, "y": None, "connected": False }
+    return robots[robotId]
 
 # Simple log function
 def log(line):
@@ -42,16 +68,22 @@ def log(line):
 # Websocket server connection
 async def websocketConnection():
     log("Connecting with the websockets server at " + WEBSOCKETS_URL + "...")
-    async with websockets.connect(WEBSOCKETS_URL) as websocket:
+    async with websockets.connect(WEBSOCKETS_URL, compression=WEBSOCKETS_COMPRESSION) as websocket:
+        # The messages are send in the codec the server uses, which is known after the first message
+        messageCodec = MESSAGE_CODEC_JSON
         async def sendMessage(type, data = {}):
-            await websocket.send(json.dumps({
-                "type": type,
-                "data": data
-            }, separators=(",", ":")))
+            message = { "type": type, "data": data }
+            if messageCodec == MESSAGE_CODEC_MSGPACK:
+                await websocket.send(msgpack.packb(message))
+            else:
+                await websocket.send(json.dumps(message, separators=(",", ":")))
 
-        # Send supervisor connect message
+        # Send supervisor connect message, the broadcasted messages are send in one batch every tick in the first codec the server knows
         await sendMessage("supervisor_connect", {
             "supervisor_id": SUPERVISOR_ID,
+            "room": ROOM,
+            "batch": True,
+            "codecs": [ MESSAGE_CODEC_MSGPACK, MESSAGE_CODEC_JSON ] if msgpack != None else [ MESSAGE_CODEC_JSON ],
             "map": {
                 "width": mapWidth,
                 "height": mapHeight
@@ -59,50 +91,64 @@ async def websocketConnection():
         })
 
         async for data in websocket:
-            log("Server message: " + data)
-            message = json.loads(data)
-
-            # Robot connect message
-            if message["type"] == "robot_connect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-                otherRobot["x"] = message["data"]["robot"]["x"]
-                otherRobot["y"] = message["data"]["robot"]["y"]
-                otherRobot["connected"] = True
-                log("Robot " + str(otherRobot["id"]) + " is connected")
-
-            # Robot disconnect message
-            if message["type"] == "robot_disconnect":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-                otherRobot["connected"] = False
-                log("Robot " + str(otherRobot["id"]) + " is disconnected")
-
-            # Read sensors message
-            if message["type"] == "read_sensors":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-
-                robotX = otherRobot["x"]
-                robotY = otherRobot["y"]
-                if "robot" in message["data"]:
-                    robotX = message["data"]["robot"]["x"]
-                    robotY = message["data"]["robot"]["y"]
-
-                log("Read sensors from Robot " + str(otherRobot["id"]))
-                await sendMessage("read_sensors_done", {
-                    "robot_id": otherRobot["id"],
-                    "sensors": {
-                        "up": robotY == 0 or mapData[robotY - 1][robotX] == TILE_CHEST,
-                        "left": robotX == 0 or mapData[robotY][robotX - 1] == TILE_CHEST,
-                        "right": robotX == mapWidth - 1 or mapData[robotY][robotX + 1] == TILE_CHEST,
-                        "down": robotY == mapHeight - 1 or mapData[robotY + 1][robotX] == TILE_CHEST
-                    }
-                })
-
-            # Robot tick done message
-            if message["type"] == "robot_tick_done":
-                otherRobot = next((robot for robot in robots if robot["id"] == message["data"]["robot_id"]), None)
-                if "robot" in message["data"]:
+            # Binary frames are MessagePack messages
+            log("Server message: " + str(data))
+            if isinstance(data, bytes):
+                messageCodec = MESSAGE_CODEC_MSGPACK
+                message = msgpack.unpackb(data)
+            else:
+                message = json.loads(data)
+
+            # A batch message has all the messages of a tick in order
+            for message in (message["type"] == "batch" and message["data"]["messages"] or [ message ]):
+                # Robot connect message
+                if message["type"] == "robot_connect":
+                    otherRobot = getRobot(message["data"]["robot_id"])
                     otherRobot["x"] = message["data"]["robot"]["x"]
                     otherRobot["y"] = message["data"]["robot"]["y"]
-                log("Tick done from Robot " + str(otherRobot["id"]))
+                    otherRobot["connected"] = True
+                    log("Robot " + str(otherRobot["id"]) + " is connected")
+
+                # Robot disconnect message
+                if message["type"] == "robot_disconnect":
+                    otherRobot = getRobot(message["data"]["robot_id"])
+                    otherRobot["connected"] = False
+                    log("Robot " + str(otherRobot["id"]) + " is disconnected")
+
+                # Read sensors message
+                if message["type"] == "read_sensors":
+                    startTime = time.time()
+                    otherRobot = getRobot(message["data"]["robot_id"])
+
+                    robotX = otherRobot["x"]
+                    robotY = otherRobot["y"]
+                    if "robot" in message["data"]:
+                        robotX = message["data"]["robot"]["x"]
+                        robotY = message["data"]["robot"]["y"]
+
+                    log("Read sensors from Robot " + str(otherRobot["id"]))
+                    messageData = {
+                        "robot_id": otherRobot["id"],
+                        "sensors": {
+                            "up": robotY == 0 or mapData[robotY - 1][robotX] == TILE_CHEST,
+                            "left": robotX == 0 or mapData[robotY][robotX - 1] == TILE_CHEST,
+                            "right": robotX == mapWidth - 1 or mapData[robotY][robotX + 1] == TILE_CHEST,
+                            "down": robotY == mapHeight - 1 or mapData[robotY + 1][robotX] == TILE_CHEST
+                        }
+                    }
+
+                    # The answer of a traced tick carries its trace id, the span is the sensor lookup
+                    if "trace_id" in message["data"]:
+                        messageData["trace_id"] = message["data"]["trace_id"]
+                        traceWriter.span(message["data"]["trace_id"], "sensor lookup", startTime)
+                    await sendMessage("read_sensors_done", messageData)
+
+                # Robot tick done message
+                if message["type"] == "robot_tick_done":
+                    otherRobot = getRobot(message["data"]["robot_id"])
+                    if "robot" in message["data"]:
+                        otherRobot["x"] = message["data"]["robot"]["x"]
+                        otherRobot["y"] = message["data"]["robot"]["y"]
+                    log("Tick done from Robot " + str(otherRobot["id"]))
 
 asyncio.run(websocketConnection())